@@ -1,4 +1,7 @@
 import os
+import re
+import socket
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
@@ -9,7 +12,11 @@ login_manager = LoginManager()
 socketio = SocketIO()
 
 
-def create_app():
+def create_app(preload=False):
+    """Build the app. With ``preload=True`` no threads or process pools are
+    started, so the result can be forked; each process then calls
+    :func:`start_workers` (see ``gunicorn.conf.py``).
+    """
     app = Flask(__name__)
 
     secret_key = os.environ.get('SECRET_KEY', '')
@@ -28,20 +35,124 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
     app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
+    # Compressible uploads are stored compressed (see storage.py): zstd, gzip or none
+    app.config['UPLOAD_COMPRESSION'] = os.environ.get('UPLOAD_COMPRESSION', 'zstd')
+    app.config['UPLOAD_ZSTD_LEVEL'] = int(os.environ.get('UPLOAD_ZSTD_LEVEL', '3'))
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+    app.config['TERMINAL_FRAME_INTERVAL'] = int(os.environ.get('TERMINAL_FRAME_INTERVAL_MS', '20')) / 1000
+    app.config['TERMINAL_FRAME_BYTES'] = int(os.environ.get('TERMINAL_FRAME_BYTES', str(64 * 1024)))
+    app.config['TERMINAL_MAX_INFLIGHT'] = int(os.environ.get('TERMINAL_MAX_INFLIGHT', '8'))
+    app.config['TERMINAL_BINARY_FRAMES'] = os.environ.get('TERMINAL_BINARY_FRAMES', '1') == '1'
+    app.config['TERMINAL_SCROLLBACK_BYTES'] = int(os.environ.get('TERMINAL_SCROLLBACK_BYTES', str(256 * 1024)))
+    app.config['TERMINAL_IDLE_TTL'] = int(os.environ.get('TERMINAL_IDLE_TTL', '1800'))
+    app.config['TERMINAL_MAX_PER_USER'] = int(os.environ.get('TERMINAL_MAX_PER_USER', '3'))
+    app.config['TERMINAL_MEMORY_BUDGET'] = int(os.environ.get('TERMINAL_MEMORY_BUDGET', str(256 * 1024 * 1024)))
+    app.config['TERMINAL_MUX_LOOPS'] = int(os.environ.get('TERMINAL_MUX_LOOPS', '1'))
+    # Per-shell resource limits (0 disables a limit)
+    app.config['TERMINAL_NICE'] = int(os.environ.get('TERMINAL_NICE', '5'))
+    app.config['TERMINAL_RLIMIT_AS_MB'] = int(os.environ.get('TERMINAL_RLIMIT_AS_MB', '4096'))
+    app.config['TERMINAL_RLIMIT_FSIZE_MB'] = int(os.environ.get('TERMINAL_RLIMIT_FSIZE_MB', '1024'))
+    app.config['TERMINAL_RLIMIT_NOFILE'] = int(os.environ.get('TERMINAL_RLIMIT_NOFILE', '1024'))
+    app.config['TERMINAL_RLIMIT_CPU'] = int(os.environ.get('TERMINAL_RLIMIT_CPU', '0'))
+    app.config['TERMINAL_CGROUP_ROOT'] = os.environ.get('TERMINAL_CGROUP_ROOT', '')
+    app.config['TERMINAL_CPU_WEIGHT'] = int(os.environ.get('TERMINAL_CPU_WEIGHT', '100'))
+    app.config['TERMINAL_IDLE_CPU_WEIGHT'] = int(os.environ.get('TERMINAL_IDLE_CPU_WEIGHT', '10'))
+    app.config['TERMINAL_IDLE_CPU_PERCENT'] = int(os.environ.get('TERMINAL_IDLE_CPU_PERCENT', '20'))
+    app.config['TERMINAL_MEMORY_MAX_MB'] = int(os.environ.get('TERMINAL_MEMORY_MAX_MB', '1024'))
+    app.config['TERMINAL_PIDS_MAX'] = int(os.environ.get('TERMINAL_PIDS_MAX', '256'))
+
+    # Stateful editor kernels (see kernels.py)
+    app.config['KERNEL_ENABLED'] = os.environ.get('KERNEL_ENABLED', '1') == '1'
+    app.config['KERNEL_TIMEOUT'] = int(os.environ.get('KERNEL_TIMEOUT', '60'))
+    app.config['KERNEL_IDLE_TTL'] = int(os.environ.get('KERNEL_IDLE_TTL', '900'))
+    app.config['KERNEL_MEMORY_MB'] = int(os.environ.get('KERNEL_MEMORY_MB', '2048'))
+    app.config['KERNEL_MAX'] = int(os.environ.get('KERNEL_MAX', '32'))
+
+    # Batch test-case runs: cases run in parallel per request, at most this many
+    app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', str(min(4, os.cpu_count() or 1))))
+    app.config['BATCH_MAX_CASES'] = int(os.environ.get('BATCH_MAX_CASES', '200'))
+
+    # Images shown by runs (see display.py), kept for a week after a run last produced them
+    app.config['DISPLAY_CACHE_DIR'] = os.environ.get(
+        'DISPLAY_CACHE_DIR', os.path.join(app.instance_path, 'display'))
+    app.config['DISPLAY_CACHE_TTL'] = int(os.environ.get('DISPLAY_CACHE_TTL', str(7 * 24 * 3600)))
+
+    # Thumbnails and table previews of hosted files (see previews.py), made by a
+    # process pool (0 = one background thread) and stored by content hash.
+    app.config['PREVIEW_WORKERS'] = int(os.environ.get('PREVIEW_WORKERS', '2'))
+    app.config['PREVIEW_CACHE_DIR'] = os.environ.get(
+        'PREVIEW_CACHE_DIR', os.path.join(app.instance_path, 'previews'))
+
+    # Per-user package environments (see envs.py): installed offline from
+    # ENV_WHEELHOUSE unless ENV_INDEX_URL allows downloading missing wheels.
+    app.config['ENVS_ENABLED'] = os.environ.get('ENVS_ENABLED', '1') == '1'
+    app.config['ENV_ROOT'] = os.environ.get('ENV_ROOT', os.path.join(app.instance_path, 'envs'))
+    app.config['ENV_WHEELHOUSE'] = os.environ.get(
+        'ENV_WHEELHOUSE', os.path.join(app.instance_path, 'wheelhouse'))
+    app.config['ENV_INDEX_URL'] = os.environ.get('ENV_INDEX_URL', '')
+    app.config['ENV_INHERIT_PACKAGES'] = os.environ.get('ENV_INHERIT_PACKAGES', '1') == '1'
+    app.config['ENV_MAX_REQUIREMENTS'] = int(os.environ.get('ENV_MAX_REQUIREMENTS', '50'))
+
+    # Multi-node deployments: every node needs a distinct NODE_ID (used for
+    # sticky terminal routing) and a shared SOCKETIO_MESSAGE_QUEUE.
+    node_id = os.environ.get('NODE_ID') or socket.gethostname()
+    app.config['NODE_ID'] = re.sub(r'[^A-Za-z0-9]', '', node_id)[:32] or 'node'
+    app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+    app.config['SOCKETIO_ASYNC_MODE'] = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+
+    # Instrumentation: Server-Timing headers, /metrics (loopback only unless a
+    # METRICS_TOKEN is set) and ?_profile=1 for the users in PROFILER_ADMINS.
+    app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '1') == '1'
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+    app.config['PROFILER_ADMINS'] = frozenset(
+        name.strip() for name in os.environ.get('PROFILER_ADMINS', '').split(',') if name.strip())
+
+    # Rendering: per-user fragment cache (see chatcore/fragments.py) and compiled
+    # templates kept on disk so a fresh process skips Jinja's compiler.
+    app.config['FRAGMENT_CACHE'] = os.environ.get('FRAGMENT_CACHE', '1') == '1'
+    app.config['TEMPLATE_CACHE_DIR'] = os.environ.get(
+        'TEMPLATE_CACHE_DIR', os.path.join(app.instance_path, 'jinja-cache'))
+
+    # Static assets: serve the fingerprinted bundles built by `flask build-assets`
+    # when static/dist exists (0 = always the source files, for development).
+    app.config['ASSET_BUNDLES'] = os.environ.get('ASSET_BUNDLES', '1') == '1'
 
     os.makedirs(app.instance_path, exist_ok=True)
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+    if app.config['TEMPLATE_CACHE_DIR']:
+        from jinja2 import FileSystemBytecodeCache
+        os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+        app.jinja_options = {**app.jinja_options,
+                             'bytecode_cache': FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])}
+
     db.init_app(app)
 
+    from chatcore import passwords
+    passwords.init_app(app)
+
+    from . import metrics
+    metrics.init_app(app)
+
+    from chatcore import assets
+    from .assets import BUNDLES
+    assets.init_app(app, BUNDLES)
+
+    from . import storage
+    storage.init_app(app)
+
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please log in to access this page.'
     login_manager.login_message_category = 'warning'
 
-    # SocketIO — use threading mode (stable; works without eventlet)
+    # SocketIO — threading mode by default (stable; works without eventlet).
+    # With a message queue, broadcasts and cross-node emits go through it.
     allowed_origins = os.environ.get('CORS_ALLOWED_ORIGINS', None)
-    socketio.init_app(app, async_mode='threading',
+    socketio.init_app(app, async_mode=app.config['SOCKETIO_ASYNC_MODE'],
+                      message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'],
+                      channel='pyhost-socketio',
                       cors_allowed_origins=allowed_origins or ['http://localhost:5000'],
                       logger=False, engineio_logger=False)
 
@@ -63,16 +174,50 @@ def create_app():
 
     from . import models
 
+    from chatcore import identity
+    identity.init_app(app, models.User, db)
+
     @login_manager.user_loader
     def load_user(user_id):
-        return models.User.query.get(int(user_id))
+        return identity.load_cached_user(int(user_id))
 
-    with app.app_context():
-        db.create_all()
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create any missing database tables."""
+        init_db(app)
+        print('Database tables are up to date.')
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Bundle, fingerprint and precompress static files into static/dist."""
+        try:
+            manifest = assets.build(app.static_folder, BUNDLES)
+        except FileNotFoundError as exc:
+            raise click.ClickException(str(exc))
+        for name, built in sorted(manifest.items()):
+            print(f'{name} -> dist/{built}')
+
+    @app.cli.command('prune-envs')
+    def prune_envs_command():
+        """Delete package environments and unpacked wheels nobody uses any more."""
+        from . import envs
+        removed, wheels = envs.prune(app.config)
+        print(f'Removed {removed} environments and {wheels} unpacked wheels.')
+
+    @app.cli.command('prune-previews')
+    def prune_previews_command():
+        """Delete thumbnails and previews of files that are gone."""
+        from . import previews
+        with app.app_context():
+            removed = previews.prune(app.config)
+        print(f'Removed {removed} preview files.')
 
     from datetime import datetime as _dt
     from flask import render_template
     from flask_login import current_user
+    from chatcore import fragments
+
+    fragments.init_app(app)
 
     @app.context_processor
     def inject_now():
@@ -87,15 +232,44 @@ def create_app():
         from flask import redirect, url_for
         if not current_user.is_authenticated:
             return redirect(url_for('auth.login'))
-        file_count = models.HostedFile.query.filter_by(user_id=current_user.id).count()
-        session_count = models.ChatSession.query.filter_by(user_id=current_user.id).count()
-        snippet_count = models.CodeSnippet.query.filter_by(user_id=current_user.id).count()
-        recent_runs = models.RunHistory.query.filter_by(user_id=current_user.id).order_by(
-            models.RunHistory.ran_at.desc()).limit(5).all()
-        return render_template('dashboard.html',
-                               file_count=file_count,
-                               session_count=session_count,
-                               snippet_count=snippet_count,
-                               recent_runs=recent_runs)
+        from .stats import get_user_stats
+        return render_template('dashboard.html', **get_user_stats(current_user.id))
 
+    if preload:
+        precompile_templates(app)
+    else:
+        start_workers(app)
     return app
+
+
+def precompile_templates(app):
+    """Compile every template now, so forked workers inherit them ready to render."""
+    env = app.jinja_env
+    for name in env.list_templates():
+        if name.endswith('.html'):
+            env.get_template(name)
+
+
+def start_workers(app):
+    """Start this process's password-hashing and preview pools, PTY loops and reapers."""
+    from chatcore import passwords
+    from . import kernels, previews
+    from .terminal import start_background
+    passwords.start(app)
+    previews.start(app)
+    start_background(app.config['TERMINAL_MUX_LOOPS'])
+    if app.config['KERNEL_ENABLED']:
+        kernels.start_reaper(app.config['KERNEL_IDLE_TTL'])
+
+
+def init_db(app):
+    """Create any missing tables and indexes; run once per deploy, not on every boot.
+
+    ``create_all`` skips tables that already exist, so indexes added to
+    existing columns (the ``user_id`` foreign keys) are created here.
+    """
+    with app.app_context():
+        db.create_all()
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
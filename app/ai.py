@@ -1,11 +1,13 @@
 import json
-import requests as http_requests
 from datetime import datetime
 from flask import (Blueprint, render_template, request, jsonify,
                    redirect, url_for, flash, abort)
 from flask_login import login_required, current_user
-from . import db
+from chatcore import ProviderError, chat_turn
+from chatcore import fragments
+from . import changes, db, listing
 from .models import ChatSession, ChatMessage
+from .stats import invalidate_user_stats
 
 ai_bp = Blueprint('ai', __name__, url_prefix='/ai')
 
@@ -37,101 +39,32 @@ def get_user_key(provider):
     return getattr(current_user, attr, None)
 
 
-def call_openai(api_key, model_id, messages):
-    url = 'https://api.openai.com/v1/chat/completions'
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'Content-Type': 'application/json',
-    }
-    payload = {'model': model_id, 'messages': messages}
-    resp = http_requests.post(url, headers=headers, json=payload, timeout=60)
-    resp.raise_for_status()
-    data = resp.json()
-    return data['choices'][0]['message']['content']
+def _sessions_query():
+    # Only run when the cached sidebar fragment is stale.
+    return (ChatSession.query
+            .filter_by(user_id=current_user.id)
+            .order_by(ChatSession.created_at.desc()))
 
 
-def call_anthropic(api_key, model_id, messages):
-    url = 'https://api.anthropic.com/v1/messages'
-    headers = {
-        'x-api-key': api_key,
-        'anthropic-version': '2023-06-01',
-        'Content-Type': 'application/json',
-    }
-    # Anthropic separates system prompt from messages
-    system_msgs = [m['content'] for m in messages if m['role'] == 'system']
-    chat_msgs = [m for m in messages if m['role'] != 'system']
-    payload = {
-        'model': model_id,
-        'max_tokens': 4096,
-        'messages': chat_msgs,
-    }
-    if system_msgs:
-        payload['system'] = '\n'.join(system_msgs)
-    resp = http_requests.post(url, headers=headers, json=payload, timeout=60)
-    resp.raise_for_status()
-    data = resp.json()
-    return data['content'][0]['text']
-
-
-def call_google(api_key, model_id, messages):
-    url = f'https://generativelanguage.googleapis.com/v1beta/models/{model_id}:generateContent?key={api_key}'
-    contents = []
-    for m in messages:
-        if m['role'] == 'system':
-            continue
-        role = 'user' if m['role'] == 'user' else 'model'
-        contents.append({'role': role, 'parts': [{'text': m['content']}]})
-    payload = {'contents': contents}
-    resp = http_requests.post(url, json=payload, timeout=60)
-    resp.raise_for_status()
-    data = resp.json()
-    return data['candidates'][0]['content']['parts'][0]['text']
-
-
-def call_groq(api_key, model_id, messages):
-    url = 'https://api.groq.com/openai/v1/chat/completions'
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'Content-Type': 'application/json',
-    }
-    payload = {'model': model_id, 'messages': messages}
-    resp = http_requests.post(url, headers=headers, json=payload, timeout=60)
-    resp.raise_for_status()
-    data = resp.json()
-    return data['choices'][0]['message']['content']
-
-
-def call_mistral(api_key, model_id, messages):
-    url = 'https://api.mistral.ai/v1/chat/completions'
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'Content-Type': 'application/json',
-    }
-    payload = {'model': model_id, 'messages': messages}
-    resp = http_requests.post(url, headers=headers, json=payload, timeout=60)
-    resp.raise_for_status()
-    data = resp.json()
-    return data['choices'][0]['message']['content']
+@ai_bp.route('/')
+@login_required
+def index():
+    return render_template('ai/index.html', models=MODELS, sessions=_sessions_query(),
+                           active_session=None, messages=[])
 
 
-PROVIDER_CALLERS = {
-    'openai':    call_openai,
-    'anthropic': call_anthropic,
-    'google':    call_google,
-    'groq':      call_groq,
-    'mistral':   call_mistral,
+SESSION_FIELDS = {
+    'id': ChatSession.id, 'model_name': ChatSession.model_name, 'title': ChatSession.title,
+    'created_at': ChatSession.created_at,
 }
 
 
-@ai_bp.route('/')
+@ai_bp.route('/sessions')
 @login_required
-def index():
-    sessions = (ChatSession.query
-                .filter_by(user_id=current_user.id)
-                .order_by(ChatSession.created_at.desc())
-                .all())
-    return render_template('ai/index.html', models=MODELS, sessions=sessions,
-                           active_session=None, messages=[])
+def list_sessions():
+    """Chat sessions, newest first; see listing.py for the parameters."""
+    return listing.respond('session', ChatSession, SESSION_FIELDS,
+                           ['model_name', 'title', 'created_at'], ChatSession.created_at)
 
 
 @ai_bp.route('/session/new', methods=['POST'])
@@ -147,7 +80,10 @@ def new_session():
         created_at=datetime.utcnow(),
     )
     db.session.add(session)
+    db.session.flush()
+    changes.record(current_user.id, 'session', session.id)
     db.session.commit()
+    invalidate_user_stats(current_user.id)
     return redirect(url_for('ai.session_view', session_id=session.id))
 
 
@@ -158,13 +94,9 @@ def session_view(session_id):
     if chat_session.user_id != current_user.id:
         abort(403)
 
-    sessions = (ChatSession.query
-                .filter_by(user_id=current_user.id)
-                .order_by(ChatSession.created_at.desc())
-                .all())
     messages = chat_session.messages
 
-    return render_template('ai/index.html', models=MODELS, sessions=sessions,
+    return render_template('ai/index.html', models=MODELS, sessions=_sessions_query(),
                            active_session=chat_session, messages=messages)
 
 
@@ -190,57 +122,18 @@ def send_message(session_id):
             'error': 'No API key set for this provider. Go to Profile > Settings.'
         }), 400
 
-    # Save user message
-    user_msg = ChatMessage(
-        session_id=chat_session.id,
-        role='user',
-        content=user_text,
-        created_at=datetime.utcnow(),
-    )
-    db.session.add(user_msg)
-    db.session.commit()
-
-    # Build message history for the API call
-    history = [
-        {'role': m.role, 'content': m.content}
-        for m in chat_session.messages
-    ]
-
-    # Set session title from first user message
-    if not chat_session.title:
-        chat_session.title = user_text[:80]
-        db.session.commit()
-
-    caller = PROVIDER_CALLERS[model_info['provider']]
+    titled = bool(chat_session.title)
     try:
-        reply_text = caller(api_key, chat_session.model_name, history)
-    except http_requests.Timeout:
-        db.session.delete(user_msg)
-        db.session.commit()
-        return jsonify({'error': 'The AI provider took too long to respond. Please try again.'}), 504
-    except http_requests.HTTPError as exc:
-        try:
-            err_body = exc.response.json()
-            err_msg = (err_body.get('error', {}) or {}).get('message') or str(exc)
-        except (ValueError, AttributeError, KeyError):
-            err_msg = str(exc)
-        # Remove the user message we already saved so the session stays consistent
-        db.session.delete(user_msg)
-        db.session.commit()
-        return jsonify({'error': f'API error: {err_msg}'}), 502
-    except Exception as exc:
-        db.session.delete(user_msg)
-        db.session.commit()
-        return jsonify({'error': f'Unexpected error: {exc}'}), 500
-
-    assistant_msg = ChatMessage(
-        session_id=chat_session.id,
-        role='assistant',
-        content=reply_text,
-        created_at=datetime.utcnow(),
-    )
-    db.session.add(assistant_msg)
-    db.session.commit()
+        reply_text = chat_turn(chat_session, ChatMessage, user_text,
+                               provider=model_info['provider'], api_key=api_key,
+                               model=chat_session.model_name)
+    except ProviderError as exc:
+        return jsonify({'error': exc.message}), exc.status
+    finally:
+        if not titled:   # the first message names the session in the sidebar
+            changes.record(current_user.id, 'session', chat_session.id)
+            db.session.commit()
+            fragments.bump(current_user.id)
 
     return jsonify({'reply': reply_text})
 
@@ -251,7 +144,9 @@ def delete_session(session_id):
     chat_session = ChatSession.query.get_or_404(session_id)
     if chat_session.user_id != current_user.id:
         abort(403)
+    changes.record(current_user.id, 'session', chat_session.id, deleted=True)
     db.session.delete(chat_session)
     db.session.commit()
+    invalidate_user_stats(current_user.id)
     flash('Chat session deleted.', 'info')
     return redirect(url_for('ai.index'))
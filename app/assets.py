@@ -0,0 +1,29 @@
+"""
+PyHost's static asset bundles; the pipeline is :mod:`chatcore.assets`.
+
+Templates emit a bundle with ``{{ asset('editor.js') }}`` and
+``flask build-assets`` builds the first-party files of each one into
+``static/dist``.
+"""
+# Bundle name -> sources in load order: CDN URLs (pinned; linked as they
+# are) and first-party files under static/ (bundled).
+BOOTSTRAP = 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist'
+CODEMIRROR = 'https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.65.17'
+BUNDLES = {
+    'base.css': [f'{BOOTSTRAP}/css/bootstrap.min.css',
+                 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css',
+                 'https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700'
+                 '&family=JetBrains+Mono:wght@400;500&display=swap'],
+    'style.css': ['css/style.css'],
+    'base.js': [f'{BOOTSTRAP}/js/bootstrap.bundle.min.js'],
+    'editor.css': [f'{CODEMIRROR}/codemirror.min.css', f'{CODEMIRROR}/theme/dracula.min.css'],
+    'editor.js': [f'{CODEMIRROR}/codemirror.min.js', f'{CODEMIRROR}/mode/python/python.min.js',
+                  f'{CODEMIRROR}/addon/edit/closebrackets.min.js',
+                  f'{CODEMIRROR}/addon/edit/matchbrackets.min.js',
+                  f'{CODEMIRROR}/addon/selection/active-line.min.js', 'js/editor.js'],
+    'terminal.css': ['https://cdn.jsdelivr.net/npm/xterm@5.3.0/css/xterm.css'],
+    'terminal.js': ['https://cdn.jsdelivr.net/npm/xterm@5.3.0/lib/xterm.js',
+                    'https://cdn.jsdelivr.net/npm/xterm-addon-fit@0.8.0/lib/xterm-addon-fit.js',
+                    'https://cdn.jsdelivr.net/npm/socket.io@4.7.4/dist/socket.io.min.js'],
+    'ai.js': ['js/ai.js'],
+}
@@ -1,11 +1,27 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from chatcore.identity import invalidate_user
+from chatcore.passwords import HasherBusy, hash_password, verify_password, needs_rehash
+from chatcore.ratelimit import TokenBucket
 from . import db
 from .models import User
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+# ── Rate limiting ─────────────────────────────────────────────────────────────
+# Every login/register attempt costs a password hash, so attempts are limited
+# per client IP and per submitted identifier before any hashing happens.
+
+IP_BURST, IP_PER_MINUTE = 20, 10
+IDENTIFIER_BURST, IDENTIFIER_PER_MINUTE = 5, 5
+
+_ip_limiter = TokenBucket(IP_BURST, IP_PER_MINUTE / 60)
+_identifier_limiter = TokenBucket(IDENTIFIER_BURST, IDENTIFIER_PER_MINUTE / 60)
+
+RATE_LIMITED_MSG = 'Too many attempts. Please wait a minute and try again.'
+BUSY_MSG = 'The server is busy. Please try again in a moment.'
+
+
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
 def register():
@@ -18,6 +34,11 @@ def register():
         password = request.form.get('password', '')
         confirm = request.form.get('confirm_password', '')
 
+        if not _ip_limiter.consume(request.remote_addr or ''):
+            flash(RATE_LIMITED_MSG, 'danger')
+            return render_template('auth/register.html',
+                                   username=username, email=email), 429
+
         error = None
         if not username or len(username) < 3:
             error = 'Username must be at least 3 characters.'
@@ -37,10 +58,17 @@ def register():
             return render_template('auth/register.html',
                                    username=username, email=email)
 
+        try:
+            pwhash = hash_password(password)
+        except HasherBusy:
+            flash(BUSY_MSG, 'danger')
+            return render_template('auth/register.html',
+                                   username=username, email=email), 503
+
         user = User(
             username=username,
             email=email,
-            password_hash=generate_password_hash(password)
+            password_hash=pwhash
         )
         db.session.add(user)
         db.session.commit()
@@ -62,11 +90,26 @@ def login():
         password = request.form.get('password', '')
         remember = request.form.get('remember') == 'on'
 
+        if not (_ip_limiter.consume(request.remote_addr or '')
+                and _identifier_limiter.consume(identifier.lower())):
+            flash(RATE_LIMITED_MSG, 'danger')
+            return render_template('auth/login.html', identifier=identifier), 429
+
         user = User.query.filter(
             (User.username == identifier) | (User.email == identifier.lower())
         ).first()
 
-        if not user or not check_password_hash(user.password_hash, password):
+        try:
+            valid = user is not None and verify_password(user.password_hash, password)
+            if valid and needs_rehash(user.password_hash):
+                user.password_hash = hash_password(password)
+                db.session.commit()
+                invalidate_user(user.id)
+        except HasherBusy:
+            flash(BUSY_MSG, 'danger')
+            return render_template('auth/login.html', identifier=identifier), 503
+
+        if not valid:
             flash('Invalid username/email or password.', 'danger')
             return render_template('auth/login.html', identifier=identifier)
 
@@ -82,6 +125,7 @@ def login():
 @auth_bp.route('/logout')
 @login_required
 def logout():
+    invalidate_user(current_user.id)
     logout_user()
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
@@ -0,0 +1,190 @@
+"""
+Batch test-case runner, started by ``/editor/run/batch`` as a plain script.
+
+Reads one JSON request on stdin — ``code``, its marshalled ``bytecode``
+(compiled by the app, so syntax errors never get here), ``cases``
+(``stdin`` and optional ``expected``), ``timeout`` and ``workers`` — and
+forks a child per case, so a case costs a fork instead of an
+interpreter start-up. Up to ``workers`` cases run at once; a case past its
+timeout is killed with its process group. Each result (with a unified diff
+against the expected output) is written as a JSON line as soon as the case
+finishes, so outputs are compared while later cases still run. Images a
+case shows with ``pyhost.display()`` are discarded.
+"""
+import base64
+import difflib
+import json
+import linecache
+import marshal
+import math
+import os
+import resource
+import select
+import signal
+import sys
+import tempfile
+import time
+import traceback
+from collections import deque
+
+FILENAME = 'main.py'
+MAX_OUTPUT = 16 * 1024           # characters of stdout/stderr returned per case
+MAX_FILE_BYTES = 8 * 1024 * 1024  # RLIMIT_FSIZE for every case
+MAX_DIFF_LINES = 60
+SANDBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sandbox')
+
+
+def _normalize(text):
+    """Lines compared with trailing whitespace and trailing blank lines ignored."""
+    return [line.rstrip() for line in text.rstrip().splitlines()]
+
+
+def _diff(expected, actual):
+    lines = list(difflib.unified_diff(_normalize(expected), _normalize(actual),
+                                      'expected', 'actual', lineterm='', n=2))
+    if len(lines) > MAX_DIFF_LINES:
+        lines = lines[:MAX_DIFF_LINES] + [f'... {len(lines) - MAX_DIFF_LINES} more lines']
+    return '\n'.join(lines)
+
+
+def _print_exception():
+    etype, value, tb = sys.exc_info()
+    while tb is not None and tb.tb_frame.f_code.co_filename != FILENAME:
+        tb = tb.tb_next   # hide this runner's frames
+    traceback.print_exception(etype, value, tb)
+
+
+def _child(program, files, timeout):
+    """Runs in the forked child: execute *program* on the case's files, never return."""
+    exit_code = 1
+    try:
+        os.setpgid(0, 0)
+        resource.setrlimit(resource.RLIMIT_FSIZE, (MAX_FILE_BYTES, MAX_FILE_BYTES))
+        # Backstop for a child outliving the runner (which enforces the real timeout).
+        cpu = math.ceil(timeout) + 1
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+        for fd, f in enumerate(files):
+            os.dup2(f.fileno(), fd)
+        sys.stdin = open(0, encoding='utf-8', closefd=False)
+        sys.stdout = open(1, 'w', encoding='utf-8', closefd=False)
+        sys.stderr = open(2, 'w', encoding='utf-8', closefd=False)
+        try:
+            exec(program, {'__name__': '__main__', '__builtins__': __builtins__})
+            exit_code = 0
+        except SystemExit as exc:
+            if exc.code is None or isinstance(exc.code, int):
+                exit_code = exc.code or 0
+            else:
+                print(exc.code, file=sys.stderr)
+        except BaseException:
+            _print_exception()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(exit_code)
+
+
+class Case:
+    def __init__(self, index, spec):
+        self.index = index
+        self.stdin = spec.get('stdin', '')
+        self.expected = spec.get('expected')
+        self.files = []
+        self.pid = self.pidfd = None
+        self.started = 0.0
+        self.timed_out = False
+
+    def open(self):
+        # Created just before the fork, so only running cases hold descriptors.
+        self.files = [tempfile.TemporaryFile() for _ in range(3)]
+        self.files[0].write(self.stdin.encode('utf-8'))
+        self.files[0].seek(0)
+
+    def read(self, f):
+        f.seek(0)
+        return f.read().decode('utf-8', 'replace')
+
+    def result(self, status):
+        if self.timed_out:
+            exit_code = -1
+        elif os.WIFEXITED(status):
+            exit_code = os.WEXITSTATUS(status)
+        else:
+            exit_code = -os.WTERMSIG(status)
+        stdout, stderr = self.read(self.files[1]), self.read(self.files[2])
+        for f in self.files:
+            f.close()
+        result = {'index': self.index, 'exit_code': exit_code,
+                  'stdout': stdout[:MAX_OUTPUT], 'stderr': stderr[:MAX_OUTPUT],
+                  'duration_ms': round((time.monotonic() - self.started) * 1000, 1)}
+        if self.timed_out:
+            result['status'] = 'timeout'
+        elif exit_code != 0:
+            result['status'] = 'error'
+        elif self.expected is None or _normalize(stdout) == _normalize(self.expected):
+            result['status'] = 'pass'
+        else:
+            result['status'] = 'fail'
+            result['diff'] = _diff(self.expected, stdout)
+        return result
+
+
+def run(program, cases, timeout, workers, emit):
+    pending = deque(cases)
+    running = {}   # pidfd -> Case
+    poller = select.poll()
+    while pending or running:
+        while pending and len(running) < workers:
+            case = pending.popleft()
+            case.open()
+            sys.stdout.flush()
+            case.pid = os.fork()
+            if case.pid == 0:
+                _child(program, case.files, timeout)
+            try:
+                os.setpgid(case.pid, case.pid)   # the child does too; whoever runs first wins
+            except OSError:
+                pass
+            case.started = time.monotonic()
+            case.pidfd = os.pidfd_open(case.pid)
+            running[case.pidfd] = case
+            poller.register(case.pidfd, select.POLLIN)
+
+        now = time.monotonic()
+        deadline = min(case.started + timeout for case in running.values())
+        ready = poller.poll(max(0, (deadline - now) * 1000))
+        for pidfd, _ in ready:
+            case = running.pop(pidfd)
+            poller.unregister(pidfd)
+            _, status = os.waitpid(case.pid, 0)
+            os.close(pidfd)
+            emit(case.result(status))
+        now = time.monotonic()
+        for case in running.values():
+            if not case.timed_out and now - case.started >= timeout:
+                case.timed_out = True
+                try:
+                    os.killpg(case.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+
+def main():
+    request = json.load(sys.stdin)
+    out = sys.stdout
+
+    def emit(message):
+        out.write(json.dumps(message) + '\n')
+        out.flush()
+
+    sys.path.insert(0, SANDBOX_DIR)   # `import pyhost` works here too (-I drops PYTHONPATH)
+    code = request['code']
+    program = marshal.loads(base64.b64decode(request['bytecode']))
+    # Tracebacks in the children show source lines from the cache.
+    linecache.cache[FILENAME] = (len(code), None, code.splitlines(True), FILENAME)
+    cases = [Case(i, spec) for i, spec in enumerate(request['cases'])]
+    run(program, cases, request['timeout'], max(1, request['workers']), emit)
+
+
+if __name__ == '__main__':
+    main()
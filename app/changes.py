@@ -0,0 +1,66 @@
+"""
+Per-user change log behind the list versions and ``since`` feeds.
+
+Writes that add, alter or remove a snippet, run or chat session call
+:func:`record` before committing. The log keeps one row per object, its
+latest change, so it grows with what the user has rather than with how
+often they save; tombstones of removed objects are capped at
+:data:`TOMBSTONES_KEPT` per list, and a ``floor`` row remembers the
+newest one pruned. The row ids come from one autoincrement sequence, so
+the newest id in a user's list is that list's version.
+
+Ids are taken in insert order, not commit order: on a database with
+concurrent writers a change can commit below a version a client has
+already seen. One user's writes rarely overlap, and a reload catches up.
+"""
+from sqlalchemy import func
+from . import db
+from .models import Change
+
+TOMBSTONES_KEPT = 500
+
+
+def record(user_id, kind, object_id, deleted=False):
+    """Log that *object_id* was added or changed, or removed (caller commits)."""
+    Change.query.filter(Change.user_id == user_id, Change.kind == kind,
+                        Change.object_id == object_id, Change.op != 'floor') \
+        .delete(synchronize_session=False)
+    db.session.add(Change(user_id=user_id, kind=kind, object_id=object_id,
+                          op='delete' if deleted else 'put'))
+    if deleted:
+        _prune(user_id, kind)
+
+
+def _prune(user_id, kind):
+    newest_pruned = db.session.query(Change.id) \
+        .filter_by(user_id=user_id, kind=kind, op='delete') \
+        .order_by(Change.id.desc()).offset(TOMBSTONES_KEPT).limit(1).scalar()
+    if newest_pruned is None:
+        return
+    Change.query.filter(Change.user_id == user_id, Change.kind == kind,
+                        Change.op == 'delete', Change.id <= newest_pruned) \
+        .delete(synchronize_session=False)
+    Change.query.filter_by(user_id=user_id, kind=kind, op='floor').delete(synchronize_session=False)
+    db.session.add(Change(user_id=user_id, kind=kind, object_id=newest_pruned, op='floor'))
+
+
+def version(user_id, kind):
+    """The current version of the user's *kind* list (0 before any change)."""
+    return db.session.query(func.max(Change.id)).filter_by(user_id=user_id, kind=kind).scalar() or 0
+
+
+def since(user_id, kind, after, limit):
+    """Up to *limit* ``(version, object_id, deleted)`` after version *after*, oldest first.
+
+    Returns None if tombstones the client has not seen were pruned since;
+    it has to reload the list.
+    """
+    floor = db.session.query(Change.object_id) \
+        .filter_by(user_id=user_id, kind=kind, op='floor').scalar() or 0
+    if after < floor:
+        return None
+    rows = db.session.query(Change.id, Change.object_id, Change.op) \
+        .filter(Change.user_id == user_id, Change.kind == kind, Change.id > after,
+                Change.op != 'floor') \
+        .order_by(Change.id).limit(limit)
+    return [(change_id, object_id, op == 'delete') for change_id, object_id, op in rows]
@@ -0,0 +1,214 @@
+"""
+Images produced by editor runs: side channel, content-addressed cache, resizing.
+
+User code shows images with ``pyhost.display()`` or ``plt.show()`` (see
+``sandbox/pyhost.py``), which writes them to a side channel instead of
+stdout: an in-memory file handed to the run as ``PYHOST_DISPLAY_FD``.
+:func:`collect` reads the channel once the run is over and stores each
+image under its sha256 in ``DISPLAY_CACHE_DIR``, so a plot re-drawn by
+every run is written once. Run responses only carry the image URLs.
+
+:func:`serve` returns an image — downscaled with Pillow to the smallest of
+:data:`WIDTHS` that covers the requested width, cached next to the
+original — with a private, immutable ``Cache-Control``: the URL is the content.
+Resizing decodes user-made images, so it runs on the preview pool (see
+previews.py), and images over :data:`MAX_RESIZE_PIXELS` are served as they are.
+Images no run has produced for ``DISPLAY_CACHE_TTL`` seconds are deleted.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from flask import abort, current_app, send_file
+from . import previews
+
+try:
+    from PIL import Image
+except ImportError:           # images are served at full size only
+    Image = None
+
+SANDBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sandbox')
+MAX_ITEMS = 16
+MAX_BYTES = 16 * 1024 * 1024
+WIDTHS = (240, 480, 960, 1440)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+PRUNE_INTERVAL = 3600           # seconds between sweeps of the cache
+MAX_RESIZE_PIXELS = 4096 * 4096  # larger images are never decoded
+RESIZE_TIMEOUT = 10             # seconds a request waits for a resized copy
+
+TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'gif': 'image/gif', 'webp': 'image/webp'}
+_MAGIC = ((b'\x89PNG\r\n\x1a\n', 'png'), (b'\xff\xd8\xff', 'jpg'),
+          (b'GIF87a', 'gif'), (b'GIF89a', 'gif'))
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+
+# ── Side channel ──────────────────────────────────────────────────────────────
+
+def open_channel():
+    """A file for the run's display records; pass its fileno() to the child."""
+    if hasattr(os, 'memfd_create'):
+        return os.fdopen(os.memfd_create('pyhost-display', 0), 'w+b')
+    return tempfile.TemporaryFile()
+
+
+def sandbox_env(env=None, fd=None):
+    """*env* (default: the server's) plus what the sandbox needs for rich output."""
+    env = dict(os.environ if env is None else env)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [SANDBOX_DIR, env.get('PYTHONPATH')]))
+    env['MPLBACKEND'] = 'module://pyhost'
+    if fd is not None:
+        env['PYHOST_DISPLAY_FD'] = str(fd)
+    else:
+        env.pop('PYHOST_DISPLAY_FD', None)
+    return env
+
+
+def collect(channel, config):
+    """Store every image the run wrote to *channel*; returns their descriptions."""
+    channel.seek(0)
+    records = []
+    total = 0
+    while len(records) < MAX_ITEMS:
+        header = channel.readline(256)
+        if not header.endswith(b'\n'):
+            break
+        try:
+            size = int(json.loads(header)['size'])
+        except (ValueError, KeyError, TypeError):
+            break
+        total += size
+        if size < 0 or total > MAX_BYTES:
+            break
+        data = channel.read(size)
+        if len(data) < size:
+            break
+        records.append(data)
+    return store_all(records, config)
+
+
+def store_all(images, config):
+    """Store each image in *images* (raw bytes) and describe the valid ones."""
+    outputs = []
+    for data in images[:MAX_ITEMS]:
+        item = store(data, config)
+        if item is not None:
+            outputs.append(item)
+    _maybe_prune(config)
+    return outputs
+
+
+# ── Cache ─────────────────────────────────────────────────────────────────────
+
+def _sniff(data):
+    for magic, ext in _MAGIC:
+        if data.startswith(magic):
+            return ext
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def _path(config, name):
+    return os.path.join(config['DISPLAY_CACHE_DIR'], name[:2], name)
+
+
+def _dimensions(path):
+    if Image is None:
+        return None, None
+    try:
+        with Image.open(path) as image:     # reads the header only
+            return image.size
+    except (OSError, Image.DecompressionBombError):
+        return None, None
+
+
+def store(data, config):
+    """Cache *data* under its hash; returns ``{name, mime, width, height}`` or None."""
+    ext = _sniff(data)
+    if ext is None:
+        return None         # only raster images we can serve safely
+    name = f'{hashlib.sha256(data).hexdigest()}.{ext}'
+    path = _path(config, name)
+    if os.path.isfile(path):
+        os.utime(path)      # keeps it from being pruned
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    width, height = _dimensions(path)
+    return {'name': name, 'mime': TYPES[ext], 'width': width, 'height': height}
+
+
+def _resized_path(path, name, width):
+    stem, ext = name.rsplit('.', 1)
+    return os.path.join(os.path.dirname(path), f'{stem}.w{width}.{ext}')
+
+
+def _resized(path, name, width):
+    """The cached copy of *path* at most *width* wide (runs on the preview pool)."""
+    target = _resized_path(path, name, width)
+    if os.path.isfile(target):
+        return target
+    ext = name.rsplit('.', 1)[1]
+    with Image.open(path) as image:
+        if image.width <= width or getattr(image, 'is_animated', False) \
+                or image.width * image.height > MAX_RESIZE_PIXELS:
+            return path
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            resized.save(f, format=image.format, **({'quality': 85} if ext == 'jpg' else {}))
+    os.replace(tmp, target)
+    return target
+
+
+def serve(name, width, config):
+    """Response for cached image *name*, downscaled to cover *width* pixels if given."""
+    stem, _, ext = name.partition('.')
+    if ext not in TYPES or len(stem) != 64 or any(c not in '0123456789abcdef' for c in stem):
+        abort(404)
+    path = _path(config, name)
+    if not os.path.isfile(path):
+        abort(404)
+    if width and Image is not None:
+        bucket = next((w for w in WIDTHS if w >= width), None)
+        target = bucket and _resized_path(path, name, bucket)
+        if target and os.path.isfile(target):
+            path = target
+        elif target:
+            try:
+                path = previews.run(_resized, path, name, bucket, timeout=RESIZE_TIMEOUT)
+            except Exception as exc:    # no pool, too slow, or not an image Pillow will decode
+                current_app.logger.info('Serving display image %s unresized: %r', name, exc)
+    response = send_file(path, mimetype=TYPES[ext], max_age=IMMUTABLE_MAX_AGE, conditional=True)
+    response.cache_control.public = False
+    response.cache_control.private = True     # users' own output: keep it out of shared caches
+    response.cache_control.immutable = True
+    return response
+
+
+def _maybe_prune(config):
+    global _last_prune
+    now = time.time()
+    if now - _last_prune < PRUNE_INTERVAL or not _prune_lock.acquire(blocking=False):
+        return
+    try:
+        _last_prune = now
+        cutoff = now - config['DISPLAY_CACHE_TTL']
+        for dirpath, _, filenames in os.walk(config['DISPLAY_CACHE_DIR']):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.unlink(path)
+                except FileNotFoundError:
+                    pass
+    finally:
+        _prune_lock.release()
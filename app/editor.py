@@ -1,11 +1,28 @@
+import base64
+import hashlib
+import importlib.util
+import json
+import marshal
+import math
 import os
 import subprocess
 import sys
 import tempfile
-from flask import Blueprint, render_template, request, jsonify
+import time
+import traceback
+import warnings
+from functools import lru_cache
+from flask import Blueprint, current_app, render_template, request, jsonify, url_for
 from flask_login import login_required, current_user
-from . import db
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
+from chatcore.cache import TTLCache
+from chatcore import fragments
+from . import changes, db, display, envs, governor, kernels, listing, metrics, versions
 from .models import CodeSnippet, RunHistory
+from .stats import invalidate_user_stats
+from .terminal import NODE_COOKIE
 
 editor_bp = Blueprint('editor', __name__, url_prefix='/editor')
 
@@ -15,56 +32,173 @@ MAX_CODE_STORE = 4000
 MAX_STDIN_STORE = 500
 MAX_STDOUT_STORE = 4000
 MAX_STDERR_STORE = 2000
+BATCH_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batchproc.py')
+BATCH_TIMEOUT_SECONDS = 5   # per case, unless the request asks for less
+BYTECODE_TTL = 3600         # seconds a compiled program is kept
+MAX_COMPILE_CHARS = 256 * 1024   # compiling holds the GIL of the node's only worker
+
+_bytecode = TTLCache(ttl=BYTECODE_TTL, maxsize=1024)
+
+
+# ── Pre-flight compile ─────────────────────────────────────────────────────────
+
+def compile_code(code, filename='main.py'):
+    """Compile *code* in-process without running it.
+
+    Returns ``(bytecode, None)`` — a marshalled code object, cached by
+    content hash — or ``(None, error)`` with the formatted SyntaxError and
+    its position, so a typo never reaches a subprocess. Programs the compiler
+    cannot handle (too long, too deeply nested) come back as errors too.
+    """
+    if len(code) > MAX_COMPILE_CHARS:
+        return None, {'stderr': f'Program too long: at most {MAX_COMPILE_CHARS // 1024} KB of code '
+                                'can be run here.\n'}
+    key = (filename, hashlib.sha256(code.encode('utf-8', 'surrogatepass')).digest())
+    bytecode = _bytecode.get(key)
+    if bytecode is not None:
+        return bytecode, None
+    try:
+        with warnings.catch_warnings():
+            # SyntaxWarnings would land in the server log, not the user's output.
+            warnings.simplefilter('ignore', SyntaxWarning)
+            program = compile(code, filename, 'exec', dont_inherit=True)
+    except (SyntaxError, ValueError, RecursionError, MemoryError) as exc:
+        # RecursionError/MemoryError: valid but deeply nested code, e.g. a long chain of unary ops
+        error = {'stderr': ''.join(traceback.format_exception_only(type(exc), exc))}
+        if isinstance(exc, SyntaxError):
+            error.update(line=exc.lineno, column=exc.offset,
+                         end_line=exc.end_lineno, end_column=exc.end_offset)
+        return None, error
+    bytecode = marshal.dumps(program)
+    _bytecode.set(key, bytecode)
+    return bytecode, None
+
+
+def _syntax_error_response(code, stdin_data, error):
+    _save_run(code, stdin_data, '', error['stderr'], 1)
+    return jsonify({'stdout': '', 'stderr': error['stderr'], 'exit_code': 1,
+                    'syntax_error': {k: v for k, v in error.items() if k != 'stderr'}})
+
+
+def prune_run_history(user_id):
+    """Delete all but the newest MAX_HISTORY runs of *user_id* (caller commits)."""
+    old = RunHistory.query.filter_by(user_id=user_id).order_by(
+        RunHistory.ran_at.desc()).offset(MAX_HISTORY).all()
+    for o in old:
+        changes.record(user_id, 'run', o.id, deleted=True)
+        db.session.delete(o)
 
 
 @editor_bp.route('/')
 @login_required
 def index():
-    snippets = CodeSnippet.query.filter_by(user_id=current_user.id).order_by(
-        CodeSnippet.updated_at.desc()).limit(50).all()
-    history = RunHistory.query.filter_by(user_id=current_user.id).order_by(
-        RunHistory.ran_at.desc()).limit(MAX_HISTORY).all()
+    # Queries, not lists: they only run when the cached sidebar is stale.
+    # The sidebar only shows titles and the start of each run's code.
+    snippets = CodeSnippet.query.options(load_only(CodeSnippet.id, CodeSnippet.title)) \
+        .filter_by(user_id=current_user.id).order_by(CodeSnippet.updated_at.desc()).limit(50)
+    history = db.session.query(RunHistory.id, RunHistory.exit_code,
+                               func.substr(RunHistory.code, 1, 40).label('code')) \
+        .filter_by(user_id=current_user.id).order_by(RunHistory.ran_at.desc()).limit(MAX_HISTORY)
+    user_id = current_user.id
     python_version = f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
-    return render_template('editor/index.html', snippets=snippets, history=history,
-                           python_version=python_version)
+    response = current_app.make_response(render_template(
+        'editor/index.html', snippets=snippets, history=history, python_version=python_version,
+        snippets_version=lambda: changes.version(user_id, 'snippet'),
+        kernel_enabled=current_app.config['KERNEL_ENABLED']))
+    if current_app.config['KERNEL_ENABLED'] and request.cookies.get(NODE_COOKIE) is None:
+        # Kernels live on one node: pin the browser to it, as terminals do.
+        response.set_cookie(NODE_COOKIE, current_app.config['NODE_ID'], samesite='Lax')
+    return response
 
 
-@editor_bp.route('/run', methods=['POST'])
-@login_required
-def run_code():
+def _read_run_request():
     data = request.get_json(force=True, silent=True) or {}
     code = data.get('code', '')
     stdin_data = data.get('stdin', '')
-
     if not isinstance(code, str) or not isinstance(stdin_data, str):
+        return None, None
+    return code, stdin_data
+
+
+def _add_stdin_hint(stderr, stdin_data):
+    # Hint for missing stdin when input() raises EOFError
+    if 'EOFError: EOF when reading a line' in stderr and not stdin_data.strip():
+        stderr += (
+            '\n\n💡 Hint: Your code calls input() but no stdin was provided.\n'
+            'Enter each input on a separate line in the "Standard Input" box before running.'
+        )
+    return stderr
+
+
+def _display_outputs(items):
+    """Stored images as the run response lists them: URLs, not data."""
+    return [{'url': url_for('editor.display_output', name=item.pop('name')), **item}
+            for item in items]
+
+
+def _save_run(code, stdin_data, stdout, stderr, exit_code):
+    try:
+        hist = RunHistory(
+            user_id=current_user.id,
+            code=code[:MAX_CODE_STORE],
+            stdin=stdin_data[:MAX_STDIN_STORE] if stdin_data else None,
+            stdout=stdout[:MAX_STDOUT_STORE] if stdout else None,
+            stderr=stderr[:MAX_STDERR_STORE] if stderr else None,
+            exit_code=exit_code,
+        )
+        db.session.add(hist)
+        db.session.flush()
+        changes.record(current_user.id, 'run', hist.id)
+        prune_run_history(current_user.id)
+        db.session.commit()
+        invalidate_user_stats(current_user.id)
+    except Exception:
+        db.session.rollback()
+
+
+@editor_bp.route('/run', methods=['POST'])
+@login_required
+def run_code():
+    code, stdin_data = _read_run_request()
+    if code is None:
         return jsonify({'error': 'Invalid input.'}), 400
 
     if not code.strip():
         return jsonify({'stdout': '', 'stderr': '', 'exit_code': 0})
 
-    tmp_path = None
+    bytecode, error = compile_code(code)
+    if error:
+        return _syntax_error_response(code, stdin_data, error)
+
+    outputs = []
     try:
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False, encoding='utf-8') as f:
-            f.write(code)
-            tmp_path = f.name
-        import stat
-        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IWUSR)  # 0o600 — owner read/write only
-
-        result = subprocess.run(
-            [sys.executable, tmp_path],
-            input=stdin_data,
-            capture_output=True,
-            text=True,
-            timeout=TIMEOUT_SECONDS,
-        )
+        # The interpreter runs the cached bytecode as main.pyc; main.py is only
+        # there so tracebacks (which say "main.py") can show source lines.
+        with tempfile.TemporaryDirectory(prefix='pyhost-run-') as workdir:
+            with open(os.path.join(workdir, 'main.py'), 'w', encoding='utf-8') as f:
+                f.write(code)
+            with open(os.path.join(workdir, 'main.pyc'), 'wb') as f:
+                f.write(importlib.util.MAGIC_NUMBER + bytes(12) + bytecode)
+
+            # Images shown by the program arrive on a side channel, not stdout.
+            python, env = envs.activate(current_user.id, current_app.config)
+            with display.open_channel() as channel, \
+                    metrics.CODE_RUNS.track(), metrics.timed('subprocess'):
+                result = subprocess.run(
+                    [python, 'main.pyc'],
+                    input=stdin_data,
+                    capture_output=True,
+                    text=True,
+                    timeout=TIMEOUT_SECONDS,
+                    cwd=workdir,
+                    env=display.sandbox_env(env, channel.fileno()),
+                    pass_fds=(channel.fileno(),),
+                )
+                outputs = _display_outputs(display.collect(channel, current_app.config))
         stdout = result.stdout
         stderr = result.stderr
         exit_code = result.returncode
 
-        # Replace the temp file path in tracebacks with "main.py"
-        if tmp_path and tmp_path in stderr:
-            stderr = stderr.replace(tmp_path, 'main.py')
-
     except subprocess.TimeoutExpired:
         stdout = ''
         stderr = (
@@ -76,82 +210,230 @@ def run_code():
         stdout = ''
         stderr = f'Server error: {exc}'
         exit_code = -1
-    finally:
-        if tmp_path:
-            try:
-                os.unlink(tmp_path)
-            except Exception:
-                pass
 
-    # Hint for missing stdin when input() raises EOFError
-    if 'EOFError: EOF when reading a line' in stderr and not stdin_data.strip():
-        stderr += (
-            '\n\n💡 Hint: Your code calls input() but no stdin was provided.\n'
-            'Enter each input on a separate line in the "Standard Input" box before running.'
-        )
+    stderr = _add_stdin_hint(stderr, stdin_data)
+    _save_run(code, stdin_data, stdout, stderr, exit_code)
+    return jsonify({'stdout': stdout, 'stderr': stderr, 'exit_code': exit_code,
+                    'display': outputs})
+
+
+@editor_bp.route('/run/batch', methods=['POST'])
+@login_required
+def run_batch():
+    """Run one program against many stdin/expected-output cases.
 
-    # Save to run history
+    The program is compiled once (in-process, see :func:`compile_code`) and
+    each case runs in a child forked from
+    that (see batchproc.py), several at a time; the response aggregates every
+    case and the batch is saved as a single history entry.
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    code, cases = data.get('code', ''), data.get('cases')
+    max_cases = current_app.config['BATCH_MAX_CASES']
+    if not isinstance(code, str) or not code.strip() or not isinstance(cases, list) or not cases:
+        return jsonify({'error': 'Send code and a non-empty list of cases.'}), 400
+    if len(cases) > max_cases:
+        return jsonify({'error': f'At most {max_cases} cases per batch.'}), 400
+    specs = []
+    for case in cases:
+        stdin_data = case.get('stdin', '') if isinstance(case, dict) else None
+        expected = case.get('expected') if isinstance(case, dict) else None
+        if not isinstance(stdin_data, str) or not isinstance(expected, (str, type(None))):
+            return jsonify({'error': 'Each case needs a string stdin and optional string expected.'}), 400
+        specs.append({'stdin': stdin_data, 'expected': expected})
     try:
-        hist = RunHistory(
-            user_id=current_user.id,
-            code=code[:MAX_CODE_STORE],
-            stdin=stdin_data[:MAX_STDIN_STORE] if stdin_data else None,
-            stdout=stdout[:MAX_STDOUT_STORE] if stdout else None,
-            stderr=stderr[:MAX_STDERR_STORE] if stderr else None,
-            exit_code=exit_code,
-        )
-        db.session.add(hist)
-        # Keep only last MAX_HISTORY runs per user
-        old = RunHistory.query.filter_by(user_id=current_user.id).order_by(
-            RunHistory.ran_at.desc()).offset(MAX_HISTORY).all()
-        for o in old:
-            db.session.delete(o)
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
+        timeout = float(BATCH_TIMEOUT_SECONDS if data.get('timeout') is None else data['timeout'])
+    except (TypeError, ValueError):
+        timeout = math.nan
+    if not (math.isfinite(timeout) and timeout > 0):
+        return jsonify({'error': 'Invalid timeout.'}), 400
+    timeout = min(timeout, TIMEOUT_SECONDS)
+    workers = max(1, current_app.config['BATCH_WORKERS'])
+
+    started = time.perf_counter()
+    bytecode, error = compile_code(code)
+    if error:
+        _save_run(code, f'[batch of {len(specs)} cases]', '', error['stderr'], 1)
+        return jsonify({'total': len(specs), 'passed': 0, 'failed': 0, 'errors': len(specs),
+                        'timed_out': 0, 'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+                        'compile_error': error['stderr'], 'cases': []})
+    payload = json.dumps({'code': code, 'bytecode': base64.b64encode(bytecode).decode('ascii'),
+                          'cases': specs, 'timeout': timeout, 'workers': workers})
+    waves = -(-len(specs) // workers)
+    python, env = envs.activate(current_user.id, current_app.config, governor.shell_env())
+    try:
+        with metrics.CODE_RUNS.track(), metrics.timed('subprocess'):
+            proc = subprocess.run([python, '-I', BATCH_SCRIPT], input=payload,
+                                  capture_output=True, text=True, env=display.sandbox_env(env),
+                                  cwd=tempfile.gettempdir(), timeout=waves * (timeout + 1) + 10)
+    except subprocess.TimeoutExpired:
+        return jsonify({'error': 'The batch did not finish in time.'}), 504
+    messages = [json.loads(line) for line in proc.stdout.splitlines() if line]
+    if proc.returncode != 0 or not messages:
+        return jsonify({'error': f'Batch runner failed: {proc.stderr[-500:]}'}), 500
+
+    counts = dict.fromkeys(('pass', 'fail', 'error', 'timeout'), 0)
+    results = sorted(messages, key=lambda r: r['index'])
+    for result in results:
+        counts[result['status']] += 1
+    summary = {
+        'total': len(specs), 'passed': counts['pass'], 'failed': counts['fail'],
+        'errors': counts['error'], 'timed_out': counts['timeout'],
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+        'compile_error': None, 'cases': results,
+    }
+
+    report = f"{counts['pass']}/{len(specs)} cases passed"
+    failing = [f"case {r['index'] + 1}: {r['status']}" for r in results if r['status'] != 'pass']
+    _save_run(code, f'[batch of {len(specs)} cases]', '\n'.join([report] + failing),
+              '', 0 if counts['pass'] == len(specs) else 1)
+    return jsonify(summary)
 
-    return jsonify({'stdout': stdout, 'stderr': stderr, 'exit_code': exit_code})
+
+@editor_bp.route('/display/<name>')
+@login_required
+def display_output(name):
+    """An image a run showed; ``?w=`` asks for a downscaled copy."""
+    return display.serve(name, request.args.get('w', type=int), current_app.config)
+
+
+# ── Kernel endpoints ───────────────────────────────────────────────────────────
+
+@editor_bp.before_request
+def _kernels_enabled():
+    if request.endpoint and request.endpoint.startswith('editor.kernel_') \
+            and not current_app.config['KERNEL_ENABLED']:
+        return jsonify({'error': 'Kernel mode is disabled on this server.'}), 404
+
+
+@editor_bp.route('/kernel', methods=['GET'])
+@login_required
+def kernel_status():
+    return jsonify(kernels.status(current_user.id))
+
+
+@editor_bp.route('/kernel/run', methods=['POST'])
+@login_required
+def kernel_run():
+    """Run code as the next cell of the user's kernel, keeping its variables."""
+    code, stdin_data = _read_run_request()
+    if code is None:
+        return jsonify({'error': 'Invalid input.'}), 400
+    if not code.strip():
+        return jsonify({'stdout': '', 'stderr': '', 'exit_code': 0})
+
+    _, error = compile_code(code, '<cell>')
+    if error:
+        return _syntax_error_response(code, stdin_data, error)
+
+    config = current_app.config
+    try:
+        interpreter = envs.activate(current_user.id, config, governor.shell_env())
+        with metrics.CODE_RUNS.track(), metrics.timed('subprocess'):
+            kernel = kernels.get(current_user.id, config, interpreter)   # reserved until execute returns
+            result = kernel.execute(code, stdin_data, config['KERNEL_TIMEOUT'])
+    except kernels.KernelBusy as exc:
+        return jsonify({'error': str(exc)}), 409
+    except kernels.KernelUnavailable as exc:
+        return jsonify({'error': str(exc)}), 503
+
+    images = [base64.b64decode(data) for data in result['display']]
+    result['display'] = _display_outputs(display.store_all(images, config))
+    result['stderr'] = _add_stdin_hint(result['stderr'], stdin_data)
+    _save_run(code, stdin_data, result['stdout'], result['stderr'], result['exit_code'])
+    return jsonify(result)
+
+
+@editor_bp.route('/kernel/interrupt', methods=['POST'])
+@login_required
+def kernel_interrupt():
+    return jsonify({'interrupted': kernels.interrupt(current_user.id)})
+
+
+@editor_bp.route('/kernel/restart', methods=['POST'])
+@login_required
+def kernel_restart():
+    """Discard the kernel and its variables; the next run starts a fresh one."""
+    kernels.shutdown(current_user.id)
+    return jsonify({'message': 'Kernel restarted.'})
 
 
 # ── Snippet endpoints ──────────────────────────────────────────────────────────
 
+SNIPPET_FIELDS = {
+    'id': CodeSnippet.id, 'title': CodeSnippet.title, 'language': CodeSnippet.language,
+    'code': CodeSnippet.code, 'created_at': CodeSnippet.created_at,
+    'updated_at': CodeSnippet.updated_at,
+}
+
+
 @editor_bp.route('/snippets', methods=['GET'])
 @login_required
 def list_snippets():
-    snippets = CodeSnippet.query.filter_by(user_id=current_user.id).order_by(
-        CodeSnippet.updated_at.desc()).all()
-    return jsonify([
-        {'id': s.id, 'title': s.title, 'language': s.language,
-         'created_at': s.created_at.isoformat()}
-        for s in snippets
-    ])
+    """Snippets, most recently saved first; see listing.py for the parameters."""
+    return listing.respond('snippet', CodeSnippet, SNIPPET_FIELDS,
+                           ['title', 'language', 'created_at', 'updated_at'],
+                           CodeSnippet.updated_at)
 
 
 @editor_bp.route('/snippets', methods=['POST'])
 @login_required
 def save_snippet():
+    """Create or update a snippet from its full ``code`` or a ``patch``.
+
+    A patch (see versions.py) is applied to ``base_version``, which must be
+    the current version; so must ``base_version`` when sent with full code.
+    A stale base gets a 409 with the current version.
+    """
     data = request.get_json(force=True, silent=True) or {}
     title = (data.get('title') or '').strip()[:120]
     code = data.get('code', '')
+    patch = data.get('patch')
+    base_version = data.get('base_version')
     snippet_id = data.get('id')
 
     if not title:
         return jsonify({'error': 'Title is required.'}), 400
-    if not isinstance(code, str):
+    if patch is None and not isinstance(code, str):
         return jsonify({'error': 'Invalid code.'}), 400
+    if base_version is not None and (isinstance(base_version, bool)
+                                     or not isinstance(base_version, int)):
+        return jsonify({'error': 'Invalid base_version.'}), 400
+    if patch is not None and (not snippet_id or base_version is None or not isinstance(patch, list)
+                              or not isinstance(data.get('length'), int)):
+        return jsonify({'error': 'A patch needs id, base_version, a list of hunks and length.'}), 400
 
-    if snippet_id:
-        snippet = CodeSnippet.query.filter_by(id=snippet_id, user_id=current_user.id).first()
-        if not snippet:
-            return jsonify({'error': 'Snippet not found.'}), 404
-        snippet.title = title
-        snippet.code = code
-    else:
-        snippet = CodeSnippet(user_id=current_user.id, title=title, code=code)
-        db.session.add(snippet)
-
-    db.session.commit()
-    return jsonify({'id': snippet.id, 'title': snippet.title, 'message': 'Saved!'})
+    try:
+        if snippet_id:
+            snippet = CodeSnippet.query.filter_by(id=snippet_id, user_id=current_user.id).first()
+            if not snippet:
+                return jsonify({'error': 'Snippet not found.'}), 404
+            if patch is not None:
+                versions.check(snippet, base_version)
+                code = versions.apply_patch(snippet.code or '', patch, data['length'])
+            if snippet.title != title:
+                fragments.bump(current_user.id)
+            snippet.title = title
+        else:
+            snippet = CodeSnippet(user_id=current_user.id, title=title)
+        version = versions.save(snippet, code, base_version)
+        changes.record(current_user.id, 'snippet', snippet.id)
+        db.session.commit()
+    except versions.VersionConflict as exc:
+        db.session.rollback()
+        return jsonify({'error': str(exc), 'conflict': True, 'version': exc.head}), 409
+    except versions.PatchError as exc:
+        db.session.rollback()
+        return jsonify({'error': f'Patch rejected: {exc}', 'conflict': True}), 409
+    except IntegrityError:
+        # Another save of the same version won the race.
+        db.session.rollback()
+        return jsonify({'error': 'The snippet was saved elsewhere at the same time.',
+                        'conflict': True}), 409
+    if not snippet_id:
+        invalidate_user_stats(current_user.id)
+    return jsonify({'id': snippet.id, 'title': snippet.title, 'version': version,
+                    'message': 'Saved!'})
 
 
 @editor_bp.route('/snippets/<int:snippet_id>', methods=['GET'])
@@ -159,18 +441,74 @@ def save_snippet():
 def get_snippet(snippet_id):
     snippet = CodeSnippet.query.filter_by(id=snippet_id, user_id=current_user.id).first_or_404()
     return jsonify({'id': snippet.id, 'title': snippet.title, 'code': snippet.code,
-                    'language': snippet.language})
+                    'language': snippet.language, 'version': versions.head_version(snippet)})
 
 
 @editor_bp.route('/snippets/<int:snippet_id>', methods=['DELETE'])
 @login_required
 def delete_snippet(snippet_id):
     snippet = CodeSnippet.query.filter_by(id=snippet_id, user_id=current_user.id).first_or_404()
+    snippet.versions.delete(synchronize_session=False)   # one statement, not one per version
+    changes.record(current_user.id, 'snippet', snippet.id, deleted=True)
     db.session.delete(snippet)
     db.session.commit()
+    invalidate_user_stats(current_user.id)
     return jsonify({'message': 'Deleted.'})
 
 
+@editor_bp.route('/snippets/<int:snippet_id>/versions', methods=['GET'])
+@login_required
+def list_snippet_versions(snippet_id):
+    snippet = CodeSnippet.query.filter_by(id=snippet_id, user_id=current_user.id).first_or_404()
+    return jsonify({'id': snippet.id, 'versions': versions.history(snippet)})
+
+
+@editor_bp.route('/snippets/<int:snippet_id>/versions/<int:version>', methods=['GET'])
+@login_required
+def get_snippet_version(snippet_id, version):
+    snippet = CodeSnippet.query.filter_by(id=snippet_id, user_id=current_user.id).first_or_404()
+    code = versions.content(snippet, version)
+    if code is None:
+        return jsonify({'error': 'That version is not kept.'}), 404
+    return jsonify({'id': snippet.id, 'version': version, 'code': code})
+
+
+@editor_bp.route('/snippets/<int:snippet_id>/versions/<int:version>/restore', methods=['POST'])
+@login_required
+def restore_snippet_version(snippet_id, version):
+    """Save an old version's code as a new version; nothing is lost."""
+    snippet = CodeSnippet.query.filter_by(id=snippet_id, user_id=current_user.id).first_or_404()
+    code = versions.content(snippet, version)
+    if code is None:
+        return jsonify({'error': 'That version is not kept.'}), 404
+    try:
+        new_version = versions.save(snippet, code)
+        changes.record(current_user.id, 'snippet', snippet.id)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'The snippet was saved elsewhere at the same time.',
+                        'conflict': True}), 409
+    return jsonify({'id': snippet.id, 'version': new_version, 'code': code,
+                    'message': f'Restored version {version}.'})
+
+
+RUN_FIELDS = {
+    'id': RunHistory.id, 'code': RunHistory.code, 'stdin': RunHistory.stdin,
+    'stdout': RunHistory.stdout, 'stderr': RunHistory.stderr,
+    'exit_code': RunHistory.exit_code, 'ran_at': RunHistory.ran_at,
+    'preview': func.substr(RunHistory.code, 1, 120),
+}
+
+
+@editor_bp.route('/history', methods=['GET'])
+@login_required
+def list_history():
+    """Runs, newest first; see listing.py for the parameters."""
+    return listing.respond('run', RunHistory, RUN_FIELDS, ['preview', 'exit_code', 'ran_at'],
+                           RunHistory.ran_at)
+
+
 @editor_bp.route('/history/<int:history_id>', methods=['GET'])
 @login_required
 def get_history_item(history_id):
@@ -186,13 +524,63 @@ def get_history_item(history_id):
     })
 
 
-@editor_bp.route('/packages')
+# ── Package environments ───────────────────────────────────────────────────────
+
+@editor_bp.before_request
+def _envs_enabled():
+    if request.endpoint and request.endpoint.startswith('editor.env_') \
+            and not current_app.config['ENVS_ENABLED']:
+        return jsonify({'error': 'Package environments are disabled on this server.'}), 404
+
+
+@editor_bp.route('/env', methods=['GET'])
 @login_required
-def packages():
-    """List installed Python packages."""
+def env_status():
+    return jsonify(envs.describe(current_user.id, current_app.config))
+
+
+@editor_bp.route('/env', methods=['POST'])
+@login_required
+def env_create():
+    """Resolve the posted requirements and switch the user to that environment."""
+    data = request.get_json(force=True, silent=True) or {}
+    requirements = data.get('requirements', '')
+    if not isinstance(requirements, str):
+        return jsonify({'error': 'Invalid input.'}), 400
+    try:
+        with metrics.timed('subprocess'):
+            result = envs.create(current_user.id, requirements, current_app.config)
+    except envs.EnvError as exc:
+        return jsonify({'error': str(exc)}), 400
+    kernels.shutdown(current_user.id)   # the next cell starts in the new environment
+    return jsonify(result)
+
+
+@editor_bp.route('/env', methods=['DELETE'])
+@login_required
+def env_remove():
+    """Go back to the server's packages."""
+    envs.remove(current_user.id, current_app.config)
+    kernels.shutdown(current_user.id)
+    return jsonify({'active': False})
+
+
+@lru_cache(maxsize=1)
+def installed_packages():
+    """Installed distributions, scanned once per process (they only change on deploy)."""
     import importlib.metadata
     pkgs = []
     for dist in sorted(importlib.metadata.distributions(),
                        key=lambda d: d.metadata['Name'].lower()):
         pkgs.append({'name': dist.metadata['Name'], 'version': dist.metadata['Version']})
-    return render_template('editor/packages.html', packages=pkgs)
+    return tuple(pkgs)
+
+
+@editor_bp.route('/packages')
+@login_required
+def packages():
+    """List installed Python packages, and the user's own environment."""
+    config = current_app.config
+    return render_template('editor/packages.html', packages=installed_packages(),
+                           envs_enabled=config['ENVS_ENABLED'],
+                           user_env=envs.describe(current_user.id, config))
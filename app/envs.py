@@ -0,0 +1,421 @@
+"""
+Per-user package environments built from a local wheelhouse.
+
+A user's requirements are resolved offline by pip (``--dry-run --report``
+against ``ENV_WHEELHOUSE``, nothing is installed) into a lock: every
+distribution pinned with its wheel's sha256. The lock, plus the
+interpreter it is for, hashes to the environment's directory under
+``ENV_ROOT/envs``, so users asking for the same packages share one
+environment and switching back to an earlier set is instant.
+
+Building an environment never runs pip: each wheel is unpacked (and
+byte-compiled) once into ``ENV_ROOT/store/<sha256>``, and the venv's
+site-packages is filled with hardlinks into the store, so a new
+environment costs a venv skeleton plus a few thousand ``link()`` calls.
+Store files are read-only and environments are immutable — changing
+packages means asking for a new lock. With ``ENV_INHERIT_PACKAGES`` the
+server's own packages stay importable underneath the user's.
+
+With ``ENV_INDEX_URL`` set, missing wheels are first downloaded into the
+wheelhouse; otherwise only what is already there can be installed.
+"""
+import compileall
+import configparser
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import site
+import stat
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import time
+import venv
+import zipfile
+from contextlib import contextmanager
+from . import governor, metrics
+
+LOCK_FILE = 'pyhost.lock'       # written last: an environment without it is incomplete
+PRUNE_LOCK = '.prune.lock'      # shared by builders, exclusive while pruning
+PRUNE_GRACE = 3600              # seconds a new environment or store entry is safe from prune
+REQUIREMENT = re.compile(
+    r'^[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?'       # name
+    r'(?:\[[A-Za-z0-9._-]+(?:\s*,\s*[A-Za-z0-9._-]+)*\])?'  # extras
+    r'(?:\s*(?:===|==|~=|!=|<=|>=|<|>)\s*[A-Za-z0-9.*+!_-]+'
+    r'(?:\s*,\s*(?:===|==|~=|!=|<=|>=|<|>)\s*[A-Za-z0-9.*+!_-]+)*)?$'
+)
+PIP_TIMEOUT = 300
+SCRIPT_TEMPLATE = '''#!{python}
+import sys
+from {module} import {head}
+if __name__ == '__main__':
+    sys.exit({call}())
+'''
+
+
+class EnvError(Exception):
+    """The requirements could not be resolved or installed."""
+
+
+def _root(config, *parts):
+    return os.path.join(config['ENV_ROOT'], *parts)
+
+
+@contextmanager
+def _prune_lock(config, mode):
+    """Hold ``ENV_ROOT/.prune.lock``: shared while building and recording, exclusive to prune."""
+    os.makedirs(_root(config), exist_ok=True)
+    with open(_root(config, PRUNE_LOCK), 'a') as f:
+        fcntl.flock(f, mode)
+        yield
+
+
+def parse_requirements(text, limit):
+    """The requirement lines in *text*; raises EnvError for anything but ``name[extras] specs``."""
+    reqs = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        if not REQUIREMENT.match(line):
+            raise EnvError(f'Not a plain requirement: {line!r}')
+        reqs.append(line)
+    if len(reqs) > limit:
+        raise EnvError(f'At most {limit} requirements per environment.')
+    return reqs
+
+
+# ── Resolving ─────────────────────────────────────────────────────────────────
+
+def _pip(args, config, timeout=PIP_TIMEOUT):
+    env = {**governor.shell_env(), 'PIP_CONFIG_FILE': os.devnull,
+           'PIP_DISABLE_PIP_VERSION_CHECK': '1', 'PIP_NO_INPUT': '1'}
+    try:
+        proc = subprocess.run([sys.executable, '-m', 'pip', *args], capture_output=True,
+                              text=True, env=env, timeout=timeout, cwd=tempfile.gettempdir())
+    except subprocess.TimeoutExpired:
+        raise EnvError('pip did not finish in time.')
+    if proc.returncode != 0:
+        lines = [l for l in proc.stderr.splitlines() if l.strip()]
+        raise EnvError('\n'.join(lines[-8:]) or f'pip exited with {proc.returncode}.')
+    return proc.stdout
+
+
+def resolve(reqs, config):
+    """Pin *reqs* and their dependencies to wheels in the wheelhouse.
+
+    Returns ``[{'name', 'version', 'wheel', 'sha256'}]`` sorted by name.
+    """
+    wheelhouse = config['ENV_WHEELHOUSE']
+    os.makedirs(wheelhouse, exist_ok=True)
+    if config['ENV_INDEX_URL']:
+        _pip(['download', '--only-binary', ':all:', '--dest', wheelhouse,
+              '--index-url', config['ENV_INDEX_URL'], '--find-links', wheelhouse, *reqs], config)
+    report = json.loads(_pip(['install', '--dry-run', '--ignore-installed', '--quiet',
+                              '--no-index', '--find-links', wheelhouse, '--only-binary', ':all:',
+                              '--report', '-', *reqs], config))
+    pins = []
+    for item in report['install']:
+        url = item['download_info']['url']
+        if not url.startswith('file://'):
+            raise EnvError(f'{url} is not in the wheelhouse.')
+        pins.append({'name': item['metadata']['name'], 'version': item['metadata']['version'],
+                     'wheel': url[len('file://'):],
+                     'sha256': item['download_info']['archive_info']['hashes']['sha256']})
+    return sorted(pins, key=lambda p: p['name'].lower())
+
+
+def lock_text(pins):
+    lines = [f'# {sys.implementation.cache_tag} {sysconfig.get_platform()} {sys.version.split()[0]}']
+    lines += [f"{p['name']}=={p['version']} --hash=sha256:{p['sha256']}" for p in pins]
+    return '\n'.join(lines) + '\n'
+
+
+def lock_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:24]
+
+
+# ── Wheel store ───────────────────────────────────────────────────────────────
+
+def _make_read_only(top):
+    for dirpath, _, filenames in os.walk(top):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            os.chmod(path, stat.S_IMODE(os.lstat(path).st_mode) & ~0o222)
+
+
+def _unpack(pin, config):
+    """The store directory for *pin*'s wheel, unpacked and byte-compiled on first use."""
+    target = _root(config, 'store', pin['sha256'])
+    if os.path.isdir(target):
+        return target
+    os.makedirs(_root(config, 'store'), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.unpack-', dir=_root(config, 'store'))
+    try:
+        with open(pin['wheel'], 'rb') as f:
+            if hashlib.sha256(f.read()).hexdigest() != pin['sha256']:
+                raise EnvError(f"{os.path.basename(pin['wheel'])} changed since it was resolved.")
+        with zipfile.ZipFile(pin['wheel']) as wheel:
+            for member in wheel.namelist():
+                if member.startswith('/') or '..' in member.split('/'):
+                    raise EnvError(f'Unsafe path {member!r} in {os.path.basename(pin["wheel"])}.')
+            wheel.extractall(tmp)
+        # <name>.data/purelib and platlib belong in site-packages itself.
+        for data in [d for d in os.listdir(tmp) if d.endswith('.data')]:
+            for scheme in ('purelib', 'platlib'):
+                src = os.path.join(tmp, data, scheme)
+                if os.path.isdir(src):
+                    shutil.copytree(src, tmp, dirs_exist_ok=True)
+                    shutil.rmtree(src)
+        compileall.compile_dir(tmp, quiet=2, rx=re.compile(r'\.data/'))
+        _make_read_only(tmp)
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            if not os.path.isdir(target):   # anything but losing a race to another worker
+                raise
+    finally:
+        if os.path.isdir(tmp):
+            _rmtree(tmp)
+    return target
+
+
+def _link_tree(src, dst):
+    for dirpath, dirnames, filenames in os.walk(src):
+        rel = os.path.relpath(dirpath, src)
+        if rel.split(os.sep)[0].endswith('.data'):
+            dirnames[:] = []
+            continue
+        os.makedirs(os.path.join(dst, rel), exist_ok=True)
+        for name in filenames:
+            source, target = os.path.join(dirpath, name), os.path.join(dst, rel, name)
+            try:
+                os.link(source, target)
+            except FileExistsError:
+                continue    # a file shipped by two wheels: first one wins, like pip
+            except OSError:
+                shutil.copy2(source, target)   # store on another filesystem
+
+
+def _install_scripts(store_dir, bin_dir, python):
+    """Console scripts from entry_points.txt, and any scripts the wheel ships."""
+    for info in [d for d in os.listdir(store_dir) if d.endswith('.dist-info')]:
+        parser = configparser.ConfigParser(delimiters=('=',), interpolation=None)
+        parser.optionxform = str
+        parser.read(os.path.join(store_dir, info, 'entry_points.txt'))
+        for section in ('console_scripts', 'gui_scripts'):
+            if not parser.has_section(section):
+                continue
+            for name, target in parser.items(section):
+                module, _, attr = target.split('[')[0].strip().partition(':')
+                if not attr or '/' in name:
+                    continue
+                path = os.path.join(bin_dir, name)
+                with open(path, 'w') as f:
+                    f.write(SCRIPT_TEMPLATE.format(python=python, module=module.strip(),
+                                                   head=attr.strip().split('.')[0],
+                                                   call=attr.strip()))
+                os.chmod(path, 0o755)
+    for data in [d for d in os.listdir(store_dir) if d.endswith('.data')]:
+        scripts = os.path.join(store_dir, data, 'scripts')
+        for name in os.listdir(scripts) if os.path.isdir(scripts) else ():
+            with open(os.path.join(scripts, name), 'rb') as f:
+                body = f.read()
+            if body.startswith(b'#!python'):
+                body = b'#!' + python.encode() + body[len(b'#!python'):]
+            path = os.path.join(bin_dir, name)
+            with open(path, 'wb') as f:
+                f.write(body)
+            os.chmod(path, 0o755)
+
+
+# ── Environments ──────────────────────────────────────────────────────────────
+
+def _site_packages(env_dir):
+    return os.path.join(env_dir, 'lib', f'python{sys.version_info[0]}.{sys.version_info[1]}',
+                        'site-packages')
+
+
+def _build(env_dir, pins, text, config):
+    if os.path.isdir(env_dir):
+        _rmtree(env_dir)    # left half-built by a crash
+    venv.EnvBuilder(symlinks=True, with_pip=False).create(env_dir)
+    site_dir = _site_packages(env_dir)
+    python = os.path.join(env_dir, 'bin', 'python')
+    if config['ENV_INHERIT_PACKAGES']:
+        with open(os.path.join(site_dir, '_pyhost_base.pth'), 'w') as f:
+            for path in site.getsitepackages():
+                f.write(f'import site; site.addsitedir({path!r})\n')
+    for pin in pins:
+        store_dir = _unpack(pin, config)
+        _link_tree(store_dir, site_dir)
+        _install_scripts(store_dir, os.path.join(env_dir, 'bin'), python)
+    # Environments are shared by everyone with the same lock: keep pip out of them.
+    for dirpath, _, _ in os.walk(site_dir):
+        os.chmod(dirpath, 0o555)
+    with open(os.path.join(env_dir, LOCK_FILE), 'w') as f:
+        f.write(text)
+
+
+def ensure(pins, config):
+    """The environment for *pins*, built unless one with the same lock exists.
+
+    Returns ``(env_dir, built)``.
+    """
+    text = lock_text(pins)
+    digest = lock_hash(text)
+    env_dir = _root(config, 'envs', digest)
+    if os.path.isfile(os.path.join(env_dir, LOCK_FILE)):
+        return env_dir, False
+    os.makedirs(_root(config, 'envs'), exist_ok=True)
+    with open(_root(config, 'envs', f'.{digest}.building'), 'w') as guard:
+        fcntl.flock(guard, fcntl.LOCK_EX)   # one builder per lock, across workers
+        if os.path.isfile(os.path.join(env_dir, LOCK_FILE)):
+            return env_dir, False
+        _build(env_dir, pins, text, config)
+    return env_dir, True
+
+
+def create(user_id, requirements, config):
+    """Resolve *requirements*, build or reuse the environment and make it the user's."""
+    reqs = parse_requirements(requirements, config['ENV_MAX_REQUIREMENTS'])
+    if not reqs:
+        raise EnvError('List at least one package.')
+    started = time.perf_counter()
+    pins = resolve(reqs, config)
+    with _prune_lock(config, fcntl.LOCK_SH):   # until the user points at it, nothing else does
+        env_dir, built = ensure(pins, config)
+        _write_user(user_id, {'env': os.path.basename(env_dir), 'requirements': '\n'.join(reqs)}, config)
+    metrics.ENV_BUILDS.inc(outcome='built' if built else 'reused')
+    return {**describe(user_id, config), 'built': built,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1)}
+
+
+def _user_file(user_id, config):
+    return _root(config, 'users', f'{int(user_id)}.json')
+
+
+def _write_user(user_id, data, config):
+    os.makedirs(_root(config, 'users'), exist_ok=True)
+    path = _user_file(user_id, config)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+
+def _read_user(user_id, config):
+    try:
+        with open(_user_file(user_id, config)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove(user_id, config):
+    """Go back to the server's packages; the environment stays for other users."""
+    try:
+        os.unlink(_user_file(user_id, config))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def path(user_id, config):
+    """The user's environment directory, or None."""
+    if not config['ENVS_ENABLED']:
+        return None
+    data = _read_user(user_id, config)
+    if not data:
+        return None
+    env_dir = _root(config, 'envs', os.path.basename(data['env']))
+    return env_dir if os.path.isfile(os.path.join(env_dir, LOCK_FILE)) else None
+
+
+def describe(user_id, config):
+    """What the environments page shows: the requirements and the pinned packages."""
+    data = _read_user(user_id, config) if config['ENVS_ENABLED'] else None
+    env_dir = path(user_id, config)
+    if not data or env_dir is None:
+        return {'active': False}
+    with open(os.path.join(env_dir, LOCK_FILE)) as f:
+        lines = [l for l in f.read().splitlines() if l and not l.startswith('#')]
+    packages = [dict(zip(('name', 'version'), l.split(' ')[0].split('==', 1))) for l in lines]
+    return {'active': True, 'env': os.path.basename(env_dir),
+            'requirements': data['requirements'], 'packages': packages}
+
+
+def activate(user_id, config, base_env=None):
+    """``(python, env)`` for running the user's code in their environment.
+
+    Without one that is the server's interpreter and *base_env* unchanged.
+    """
+    env_dir = path(user_id, config)
+    if env_dir is None:
+        return sys.executable, base_env
+    env = dict(os.environ if base_env is None else base_env)
+    env['VIRTUAL_ENV'] = env_dir
+    env['PATH'] = os.path.join(env_dir, 'bin') + os.pathsep + env.get('PATH', os.defpath)
+    env.pop('PYTHONHOME', None)
+    return os.path.join(env_dir, 'bin', 'python'), env
+
+
+# ── Maintenance ───────────────────────────────────────────────────────────────
+
+def _rmtree(top):
+    def make_writable(func, target, exc):
+        os.chmod(os.path.dirname(target), 0o755)
+        if os.path.isdir(target):
+            os.chmod(target, 0o755)
+        func(target)
+    if sys.version_info >= (3, 12):
+        shutil.rmtree(top, onexc=make_writable)
+    else:       # onerror is deprecated from 3.12
+        shutil.rmtree(top, onerror=make_writable)
+
+
+def prune(config):
+    """Delete environments no user points at, and store entries no environment uses.
+
+    Runs with builds locked out (see :func:`create`), and keeps anything
+    made in the last :data:`PRUNE_GRACE` seconds. Returns
+    ``(envs_removed, wheels_removed)``.
+    """
+    with _prune_lock(config, fcntl.LOCK_EX):
+        return _prune(config, time.time() - PRUNE_GRACE)
+
+
+def _prune(config, cutoff):
+    in_use = set()
+    users = _root(config, 'users')
+    for name in os.listdir(users) if os.path.isdir(users) else ():
+        if name.endswith('.json') and name[:-len('.json')].isdigit():
+            data = _read_user(name[:-len('.json')], config)
+            if data:
+                in_use.add(os.path.basename(data['env']))
+    envs_removed, hashes = 0, set()
+    envs_dir = _root(config, 'envs')
+    for name in os.listdir(envs_dir) if os.path.isdir(envs_dir) else ():
+        env_dir = os.path.join(envs_dir, name)
+        if name.startswith('.') or not os.path.isdir(env_dir):
+            continue
+        lock = os.path.join(env_dir, LOCK_FILE)
+        if not os.path.isfile(lock):
+            continue    # left half-built by a crash; the next build of it starts over
+        if name not in in_use and os.stat(lock).st_mtime < cutoff:
+            _rmtree(env_dir)
+            envs_removed += 1
+            continue
+        with open(lock) as f:
+            hashes.update(re.findall(r'--hash=sha256:([0-9a-f]{64})', f.read()))
+    wheels_removed = 0
+    store = _root(config, 'store')
+    for name in os.listdir(store) if os.path.isdir(store) else ():
+        entry = os.path.join(store, name)
+        if not name.startswith('.') and name not in hashes and os.stat(entry).st_mtime < cutoff:
+            _rmtree(entry)
+            wheels_removed += 1
+    return envs_removed, wheels_removed
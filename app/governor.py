@@ -0,0 +1,187 @@
+"""
+Resource governance for terminal shells.
+
+Every shell is started with a scrubbed environment, a nice level and
+per-process rlimits (address space, file size, open files, core dumps and
+optionally CPU seconds). When ``TERMINAL_CGROUP_ROOT`` points at a
+writable cgroup v2 directory, each shell also gets its own child cgroup
+with a CPU weight, a memory ceiling and a process cap; detached shells
+drop to an idle CPU weight and quota until a client reattaches.
+
+:class:`UsageMeter` samples CPU, memory and process count for a shell —
+from the cgroup when there is one, otherwise by walking ``/proc`` for the
+shell's session — and backs the usage badge in the terminal UI.
+"""
+import os
+import resource
+import time
+
+# Only these variables are inherited from the server; in particular the
+# shell must not see SECRET_KEY, DATABASE_URL and friends.
+ENV_PASSTHROUGH = ('PATH', 'LANG', 'LC_ALL', 'LC_CTYPE', 'TZ')
+
+CGROUP_PERIOD = 100000   # µs; cpu.max quotas are expressed against this
+MB = 1024 * 1024
+
+
+def shell_env():
+    return {k: os.environ[k] for k in ENV_PASSTHROUGH if k in os.environ}
+
+
+def _rlimits(config):
+    limits = [(resource.RLIMIT_CORE, 0)]
+    if config['TERMINAL_RLIMIT_AS_MB']:
+        limits.append((resource.RLIMIT_AS, config['TERMINAL_RLIMIT_AS_MB'] * MB))
+    if config['TERMINAL_RLIMIT_FSIZE_MB']:
+        limits.append((resource.RLIMIT_FSIZE, config['TERMINAL_RLIMIT_FSIZE_MB'] * MB))
+    if config['TERMINAL_RLIMIT_NOFILE']:
+        limits.append((resource.RLIMIT_NOFILE, config['TERMINAL_RLIMIT_NOFILE']))
+    if config['TERMINAL_RLIMIT_CPU']:
+        limits.append((resource.RLIMIT_CPU, config['TERMINAL_RLIMIT_CPU']))
+    return limits
+
+
+def make_preexec(config, cgroup=None):
+    """Build the ``preexec_fn`` that confines a freshly forked shell."""
+    limits = _rlimits(config)
+    niceness = config['TERMINAL_NICE']
+    procs_file = os.path.join(cgroup, 'cgroup.procs') if cgroup else None
+
+    def preexec():
+        # Runs in the child between fork and exec: keep it to plain syscalls.
+        if procs_file:
+            with open(procs_file, 'w') as f:
+                f.write('0')
+        if niceness:
+            os.nice(niceness)
+        for which, value in limits:
+            soft, hard = resource.getrlimit(which)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(which, (value, value))
+
+    return preexec
+
+
+# ── cgroup v2 ─────────────────────────────────────────────────────────────────
+
+def _write(cgroup, name, value):
+    try:
+        with open(os.path.join(cgroup, name), 'w') as f:
+            f.write(str(value))
+        return True
+    except OSError:
+        return False
+
+
+def _read(cgroup, name):
+    try:
+        with open(os.path.join(cgroup, name)) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def create_cgroup(config, name):
+    """Create a child cgroup for one shell; None if cgroups are unavailable."""
+    root = config['TERMINAL_CGROUP_ROOT']
+    if not root:
+        return None
+    path = os.path.join(root, name)
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return None
+    _write(path, 'cpu.weight', config['TERMINAL_CPU_WEIGHT'])
+    if config['TERMINAL_MEMORY_MAX_MB']:
+        _write(path, 'memory.max', config['TERMINAL_MEMORY_MAX_MB'] * MB)
+    if config['TERMINAL_PIDS_MAX']:
+        _write(path, 'pids.max', config['TERMINAL_PIDS_MAX'])
+    return path
+
+
+def set_idle(cgroup, idle, config):
+    """Throttle a detached shell's CPU share; restore it on reattach."""
+    if not cgroup:
+        return
+    if idle:
+        _write(cgroup, 'cpu.weight', config['TERMINAL_IDLE_CPU_WEIGHT'])
+        quota = int(CGROUP_PERIOD * config['TERMINAL_IDLE_CPU_PERCENT'] / 100)
+        _write(cgroup, 'cpu.max', f'{max(quota, 1000)} {CGROUP_PERIOD}')
+    else:
+        _write(cgroup, 'cpu.weight', config['TERMINAL_CPU_WEIGHT'])
+        _write(cgroup, 'cpu.max', f'max {CGROUP_PERIOD}')
+
+
+def release_cgroup(cgroup):
+    """Remove an emptied cgroup; False while processes are still inside."""
+    if not cgroup:
+        return True
+    try:
+        os.rmdir(cgroup)
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError:
+        _write(cgroup, 'cgroup.kill', 1)
+        return False
+
+
+# ── Usage sampling ────────────────────────────────────────────────────────────
+
+_CLK_TCK = os.sysconf('SC_CLK_TCK')
+_PAGE = os.sysconf('SC_PAGE_SIZE')
+
+
+def _proc_usage(session_id):
+    """(cpu_seconds, rss_bytes, nprocs) for every process in *session_id*."""
+    cpu = rss = count = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # fields[0] is the state (field 3 of stat); session is field 6.
+        if int(fields[3]) != session_id:
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / _CLK_TCK
+        rss += int(fields[21]) * _PAGE
+        count += 1
+    return cpu, rss, count
+
+
+def _cgroup_usage(cgroup):
+    stat = _read(cgroup, 'cpu.stat') or ''
+    usec = next((int(line.split()[1]) for line in stat.splitlines()
+                 if line.startswith('usage_usec')), 0)
+    memory = int((_read(cgroup, 'memory.current') or '0').strip() or 0)
+    pids = int((_read(cgroup, 'pids.current') or '0').strip() or 0)
+    return usec / 1e6, memory, pids
+
+
+class UsageMeter:
+    """Turns cumulative CPU time into a percentage between samples."""
+
+    def __init__(self, pid, cgroup=None):
+        self.pid = pid
+        self.cgroup = cgroup
+        self._last = None
+
+    def sample(self):
+        if self.cgroup:
+            cpu, memory, procs = _cgroup_usage(self.cgroup)
+        else:
+            cpu, memory, procs = _proc_usage(self.pid)   # the shell leads its own session
+        now = time.monotonic()
+        percent = 0.0
+        if self._last:
+            then, last_cpu = self._last
+            if now > then:
+                percent = max(0.0, (cpu - last_cpu) / (now - then) * 100)
+        self._last = (now, cpu)
+        return {'cpu_percent': round(percent, 1),
+                'memory_mb': round(memory / MB, 1),
+                'processes': procs}
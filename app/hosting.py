@@ -1,15 +1,24 @@
 import os
 import uuid
+import zipfile
 from datetime import datetime
-from flask import (Blueprint, render_template, request, redirect,
-                   url_for, flash, send_from_directory, abort, current_app)
+from flask import (Blueprint, Response, render_template, request, redirect, jsonify,
+                   url_for, flash, abort, current_app)
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
-from . import db
-from .models import HostedFile
+from . import db, listing, metrics, previews, storage
+from .models import FilePreview, HostedFile
+from .stats import get_user_stats, invalidate_user_stats
 
 hosting_bp = Blueprint('hosting', __name__, url_prefix='/hosting')
 
+PAGE_SIZE = 50
+MAX_BULK = 1000            # files per bulk delete or archive request
+ID_CHUNK = 500             # ids per IN (...) clause, under SQLite's variable limit
+ZIP_CHUNK = 64 * 1024      # bytes read per write into the streamed archive
+COMPRESSIBLE = ('text/', 'application/json', 'application/xml', 'application/javascript',
+                'application/x-ndjson', 'image/svg+xml', 'application/csv')
+
 
 def user_upload_dir(user_id):
     folder = os.path.join(current_app.config['UPLOAD_FOLDER'], str(user_id))
@@ -20,11 +29,18 @@ def user_upload_dir(user_id):
 @hosting_bp.route('/')
 @login_required
 def index():
-    files = (HostedFile.query
-             .filter_by(user_id=current_user.id)
-             .order_by(HostedFile.uploaded_at.desc())
-             .all())
-    return render_template('hosting/index.html', files=files)
+    try:
+        cursor = listing.decode_cursor(request.args['cursor'], HostedFile.uploaded_at) \
+            if request.args.get('cursor') else None
+    except (ValueError, TypeError):
+        return redirect(url_for('hosting.index'))
+    query = HostedFile.query.options(db.joinedload(HostedFile.preview)) \
+        .filter_by(user_id=current_user.id)
+    files, next_cursor = listing.paginate(query, HostedFile, HostedFile.uploaded_at, cursor, PAGE_SIZE)
+    previews.ensure(current_app._get_current_object(), files)
+    return render_template('hosting/index.html', files=files, next_cursor=next_cursor,
+                           first_page=cursor is None,
+                           file_count=get_user_stats(current_user.id)['file_count'])
 
 
 @hosting_bp.route('/upload', methods=['POST'])
@@ -55,13 +71,11 @@ def upload():
     if ext in BLOCKED_EXTENSIONS:
         flash(f'File type "{ext}" is not allowed for security reasons.', 'danger')
         return redirect(url_for('hosting.index'))
-    stored_name = f'{uuid.uuid4().hex}{ext}'
 
     folder = user_upload_dir(current_user.id)
-    save_path = os.path.join(folder, stored_name)
-    file.save(save_path)
-
-    size = os.path.getsize(save_path)
+    with metrics.timed('storage'):
+        stored_name, size = storage.save(file.stream, folder, f'{uuid.uuid4().hex}{ext}',
+                                         original_name, file.mimetype, current_app.config)
 
     hosted = HostedFile(
         user_id=current_user.id,
@@ -70,9 +84,13 @@ def upload():
         size=size,
         mimetype=file.mimetype or 'application/octet-stream',
         uploaded_at=datetime.utcnow(),
+        preview=FilePreview(status='pending' if previews.kind(original_name) else 'none'),
     )
     db.session.add(hosted)
     db.session.commit()
+    invalidate_user_stats(current_user.id)
+    if hosted.preview.status == 'pending':
+        previews.submit(current_app._get_current_object(), hosted)
 
     flash(f'"{original_name}" uploaded successfully.', 'success')
     return redirect(url_for('hosting.index'))
@@ -85,9 +103,8 @@ def download(file_id):
     if hosted.user_id != current_user.id:
         abort(403)
     folder = user_upload_dir(current_user.id)
-    return send_from_directory(folder, hosted.filename,
-                               as_attachment=True,
-                               download_name=hosted.original_name)
+    return storage.send(os.path.join(folder, hosted.filename), hosted.original_name,
+                        hosted.mimetype, hosted.size)
 
 
 @hosting_bp.route('/delete/<int:file_id>', methods=['POST'])
@@ -104,5 +121,170 @@ def delete(file_id):
 
     db.session.delete(hosted)
     db.session.commit()
+    invalidate_user_stats(current_user.id)
     flash(f'"{hosted.original_name}" has been deleted.', 'info')
     return redirect(url_for('hosting.index'))
+
+
+# ── Previews ───────────────────────────────────────────────────────────────────
+
+@hosting_bp.route('/previews')
+@login_required
+def preview_status():
+    """Preview state of the files in ``ids`` (comma-separated), for the page to poll."""
+    try:
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i][:PAGE_SIZE]
+    except ValueError:
+        return jsonify({'error': 'Invalid ids.'}), 400
+    rows = FilePreview.query.join(HostedFile) \
+        .filter(HostedFile.user_id == current_user.id, FilePreview.file_id.in_(ids)).all() if ids else []
+    return jsonify({str(row.file_id): previews.describe(row) for row in rows})
+
+
+@hosting_bp.route('/derived/<name>')
+@login_required
+def derived(name):
+    """A thumbnail or table preview, by content hash."""
+    return previews.serve(name, current_user.id, current_app.config)
+
+
+# ── Bulk operations ────────────────────────────────────────────────────────────
+
+def _selected_files(require_ids):
+    """The current user's files named by ``ids`` (form fields or a JSON list).
+
+    Without ids, every file of the user unless *require_ids*. Returns None
+    if the ids are malformed or too many.
+    """
+    if request.is_json:
+        ids = (request.get_json(silent=True) or {}).get('ids') or []
+    else:
+        ids = request.values.getlist('ids')
+    try:
+        ids = sorted({int(i) for i in ids})
+    except (TypeError, ValueError):
+        return None
+    if len(ids) > MAX_BULK or (require_ids and not ids):
+        return None
+    query = HostedFile.query.filter_by(user_id=current_user.id)
+    if not ids:
+        return query.order_by(HostedFile.uploaded_at.desc()).limit(MAX_BULK).all()
+    files = []
+    for start in range(0, len(ids), ID_CHUNK):
+        files += query.filter(HostedFile.id.in_(ids[start:start + ID_CHUNK])).all()
+    return files
+
+
+def _bulk_error(message):
+    if request.is_json:
+        return jsonify({'error': message}), 400
+    flash(message, 'warning')
+    return redirect(url_for('hosting.index'))
+
+
+@hosting_bp.route('/delete', methods=['POST'])
+@login_required
+def delete_many():
+    """Delete the selected files in one transaction; then remove them from disk."""
+    files = _selected_files(require_ids=True)
+    if not files:
+        return _bulk_error(f'Select between 1 and {MAX_BULK} files to delete.')
+    ids = [f.id for f in files]
+    filenames = [f.filename for f in files]
+    for start in range(0, len(ids), ID_CHUNK):
+        FilePreview.query.filter(FilePreview.file_id.in_(ids[start:start + ID_CHUNK])) \
+            .delete(synchronize_session=False)
+        HostedFile.query.filter(HostedFile.user_id == current_user.id,
+                                HostedFile.id.in_(ids[start:start + ID_CHUNK])) \
+            .delete(synchronize_session=False)
+    db.session.commit()
+    invalidate_user_stats(current_user.id)
+
+    # After the commit: a failure leaves an orphaned file, never a row without one.
+    folder = user_upload_dir(current_user.id)
+    with metrics.timed('storage'):
+        for filename in filenames:
+            try:
+                os.remove(os.path.join(folder, filename))
+            except FileNotFoundError:
+                pass
+    if request.is_json:
+        return jsonify({'deleted': ids})
+    flash(f'{len(ids)} file{"s" if len(ids) != 1 else ""} deleted.', 'info')
+    return redirect(url_for('hosting.index'))
+
+
+class _ZipSink:
+    """Unseekable file object collecting what zipfile writes, for a streamed response."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def _unique_names(files):
+    """Archive member names: original names, numbered when two files share one."""
+    seen = set()
+    for f in files:
+        stem, ext = os.path.splitext(f.original_name)
+        name, n = f.original_name, 1
+        while name in seen:
+            n += 1
+            name = f'{stem} ({n}){ext}'
+        seen.add(name)
+        yield name, f
+
+
+def _zip_stream(entries):
+    """Yield a ZIP of *entries* (name, path, size, mtime, compress) as it is written.
+
+    zipfile falls back to data descriptors on an unseekable file, so memory
+    stays at one read chunk however many files go in.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        for name, path, size, mtime, compress in entries:
+            try:
+                src = storage.open_decoded(path)
+            except FileNotFoundError:
+                continue
+            info = zipfile.ZipInfo(name, date_time=mtime.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            info.file_size = size
+            info.external_attr = 0o644 << 16
+            with src, archive.open(info, 'w') as dst:
+                while chunk := src.read(ZIP_CHUNK):
+                    dst.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+@hosting_bp.route('/archive', methods=['GET', 'POST'])
+@login_required
+def archive():
+    """Download the selected files (all of them without ``ids``) as one ZIP, built on the fly."""
+    files = _selected_files(require_ids=False)
+    if files is None:
+        return _bulk_error(f'Select at most {MAX_BULK} files to download.')
+    if not files:
+        return _bulk_error('There are no files to download.')
+    folder = user_upload_dir(current_user.id)
+    # Plain tuples: the generator runs after the request's database session is gone.
+    entries = [(name, os.path.join(folder, f.filename), f.size, f.uploaded_at or datetime.utcnow(),
+                (f.mimetype or '').startswith(COMPRESSIBLE) or storage.encoding(f.filename) is not None)
+               for name, f in _unique_names(files)]
+    response = Response(_zip_stream(entries), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="pyhost-files.zip"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,119 @@
+"""
+The editor kernel process: runs cells one after another in one namespace.
+
+Started by :mod:`app.kernels` as a plain script, so it never imports the
+app. Requests and replies are JSON lines on the stdin/stdout it was started
+with; fds 0-2 are then pointed at /dev/null so user code cannot corrupt the
+channel, and every cell gets in-memory ``sys.stdin``/``stdout``/``stderr``.
+A trailing expression is echoed like in a REPL. SIGINT interrupts the
+running cell and is ignored between cells. Images shown with
+``pyhost.display()`` or ``plt.show()`` come back base64-encoded in the
+reply, next to the cell's output.
+"""
+import ast
+import base64
+import io
+import json
+import os
+import signal
+import sys
+import time
+import traceback
+
+MAX_OUTPUT = 1_000_000   # characters kept per stream per cell
+SANDBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sandbox')
+
+_busy = False
+
+
+def _on_sigint(signum, frame):
+    if _busy:
+        raise KeyboardInterrupt
+
+
+def _channel():
+    requests, replies = os.dup(0), os.dup(1)
+    null = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(null, fd)
+    os.close(null)
+    return os.fdopen(requests, 'r', encoding='utf-8'), os.fdopen(replies, 'w', encoding='utf-8')
+
+
+def _compile(code):
+    tree = ast.parse(code, '<cell>', 'exec')
+    last = None
+    if tree.body and isinstance(tree.body[-1], ast.Expr):
+        last = compile(ast.Expression(tree.body.pop().value), '<cell>', 'eval')
+    return compile(tree, '<cell>', 'exec'), last
+
+
+def _print_exception(err):
+    etype, value, tb = sys.exc_info()
+    while tb is not None and tb.tb_frame.f_code.co_filename != '<cell>':
+        tb = tb.tb_next   # the kernel's own frames (and ast.parse's, for syntax errors)
+    exc = traceback.TracebackException(etype, value, tb)
+    exc.stack = traceback.StackSummary.from_list(f for f in exc.stack if f.filename != __file__)
+    err.writelines(exc.format())
+
+
+def _run(code, stdin, namespace, pyhost):
+    global _busy
+    out, err = io.StringIO(), io.StringIO()
+    sys.stdin, sys.stdout, sys.stderr = io.StringIO(stdin), out, err
+    images = []
+    pyhost._sink = lambda mime, data: images.append(data)
+    pyhost.reset()
+    status = 'ok'
+    try:
+        _busy = True
+        body, last = _compile(code)
+        exec(body, namespace)
+        if last is not None:
+            value = eval(last, namespace)
+            if value is not None:
+                namespace['_'] = value
+                if pyhost.is_image(value):
+                    pyhost.display(value)
+                else:
+                    print(repr(value))
+        pyhost.flush_figures()
+    except KeyboardInterrupt:
+        status = 'interrupted'
+        _print_exception(err)
+    except SystemExit as exc:
+        if exc.code not in (None, 0):
+            status = 'error'
+            print(exc.code, file=err)
+    except BaseException:
+        status = 'error'
+        _print_exception(err)
+    finally:
+        _busy = False
+        sys.stdin, sys.stdout, sys.stderr = sys.__stdin__, sys.__stdout__, sys.__stderr__
+    return status, out.getvalue()[:MAX_OUTPUT], err.getvalue()[:MAX_OUTPUT], images
+
+
+def main():
+    signal.signal(signal.SIGINT, _on_sigint)
+    sys.path.insert(0, SANDBOX_DIR)   # started with -I, so PYTHONPATH is ignored
+    import pyhost
+    requests, replies = _channel()
+    namespace = {'__name__': '__main__', '__builtins__': __builtins__}
+    count = 0
+    for line in requests:
+        request = json.loads(line)
+        count += 1
+        start = time.perf_counter()
+        status, stdout, stderr, images = _run(request['code'], request.get('stdin', ''),
+                                              namespace, pyhost)
+        replies.write(json.dumps({
+            'status': status, 'stdout': stdout, 'stderr': stderr, 'execution_count': count,
+            'display': [base64.b64encode(data).decode('ascii') for data in images],
+            'duration_ms': round((time.perf_counter() - start) * 1000, 1),
+        }) + '\n')
+        replies.flush()
+
+
+if __name__ == '__main__':
+    main()
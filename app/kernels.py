@@ -0,0 +1,245 @@
+"""
+Stateful editor kernels: one long-lived interpreter per user.
+
+A kernel is a ``kernelproc.py`` subprocess that keeps its namespace between
+runs, so a user re-running the last lines of a script does not reload data
+or re-import libraries. Kernels get the scrubbed shell environment, their
+own session and working directory, and an address-space cap; a cell that
+runs past the timeout is interrupted, and a kernel that ignores the
+interrupt is killed. Idle kernels are reaped after ``KERNEL_IDLE_TTL``, and
+when ``KERNEL_MAX`` are running the least recently used idle one makes room.
+
+Kernels live in the worker process that started them; multi-node
+deployments rely on the ``pyhost_node`` cookie to keep a user on one node.
+"""
+import atexit
+import json
+import os
+import resource
+import select
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from . import governor
+
+KERNEL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kernelproc.py')
+INTERRUPT_GRACE = 2.0   # seconds an interrupted cell gets to unwind before the kernel is killed
+REAP_INTERVAL = 30      # seconds between idle-kernel sweeps
+READ_SIZE = 65536
+
+_kernels: dict = {}
+_lock = threading.Lock()
+
+
+class KernelBusy(Exception):
+    """The user's kernel is already running a cell."""
+
+
+class KernelUnavailable(Exception):
+    """Every kernel slot on this node is busy."""
+
+
+def _make_preexec(memory_mb):
+    def preexec():
+        # Runs in the child between fork and exec: keep it to plain syscalls.
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        if memory_mb:
+            limit = memory_mb * governor.MB
+            soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+            if hard != resource.RLIM_INFINITY:
+                limit = min(limit, hard)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    return preexec
+
+
+class Kernel:
+    def __init__(self, user_id, memory_mb, python=sys.executable, env=None):
+        self.user_id = user_id
+        self.python = python
+        self.workdir = tempfile.mkdtemp(prefix='pyhost-kernel-')
+        self.proc = subprocess.Popen(
+            [python, '-I', KERNEL_SCRIPT],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            cwd=self.workdir, env={**(env or governor.shell_env()), 'MPLBACKEND': 'module://pyhost'},
+            start_new_session=True, preexec_fn=_make_preexec(memory_mb),
+        )
+        self.busy = threading.Lock()
+        self.last_used = time.monotonic()
+        self._buffer = b''
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def _read_reply(self, timeout):
+        """The next reply line, or None on timeout or if the kernel exited."""
+        fd = self.proc.stdout.fileno()
+        deadline = time.monotonic() + timeout
+        while b'\n' not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                return None
+            chunk = os.read(fd, READ_SIZE)
+            if not chunk:
+                return None
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return json.loads(line)
+
+    def execute(self, code, stdin, timeout):
+        """Run *code* as the next cell; returns output, exit_code, timings and ``display`` images.
+
+        The kernel must be reserved by :func:`get`; this releases it.
+        """
+        try:
+            try:
+                self.proc.stdin.write(json.dumps({'code': code, 'stdin': stdin}).encode('utf-8') + b'\n')
+                self.proc.stdin.flush()
+                reply = self._read_reply(timeout)
+            except (OSError, ValueError):     # ValueError: pipes closed by kill()
+                reply = None
+            timed_out = reply is None and self.alive()
+            if timed_out:
+                self.interrupt()
+                reply = self._read_reply(INTERRUPT_GRACE)
+            if reply is None:
+                self.kill()
+                note = (f'⏱ Execution timed out after {timeout} seconds; the kernel was restarted.'
+                        if timed_out else
+                        f'Kernel died (exit {self.proc.returncode}); its variables were lost.')
+                return {'stdout': '', 'stderr': note, 'exit_code': -1 if timed_out else 1,
+                        'execution_count': 0, 'duration_ms': None, 'restarted': True,
+                        'display': []}
+            exit_code = {'ok': 0, 'error': 1}.get(reply['status'], -1 if timed_out else 130)
+            stderr = reply['stderr']
+            if timed_out:
+                stderr += (f'\n⏱ Execution timed out after {timeout} seconds and was interrupted; '
+                           'variables defined so far are kept.')
+            return {'stdout': reply['stdout'], 'stderr': stderr, 'exit_code': exit_code,
+                    'execution_count': reply['execution_count'],
+                    'duration_ms': reply['duration_ms'], 'restarted': False,
+                    'display': reply.get('display', [])}
+        finally:
+            self.last_used = time.monotonic()
+            self.busy.release()
+
+    def interrupt(self):
+        if self.alive():
+            os.kill(self.proc.pid, signal.SIGINT)
+
+    def kill(self):
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)   # the kernel and anything it spawned
+        except ProcessLookupError:
+            pass
+        self.proc.wait()
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+# ── Registry ──────────────────────────────────────────────────────────────────
+
+def _make_room(max_kernels):
+    # Caller holds _lock.
+    if len(_kernels) < max_kernels:
+        return
+    idle = [k for k in _kernels.values() if not k.busy.locked()]
+    if not idle:
+        raise KernelUnavailable('All kernels on this server are busy; try again shortly.')
+    victim = min(idle, key=lambda k: k.last_used)
+    del _kernels[victim.user_id]
+    victim.kill()
+
+
+def get(user_id, config, interpreter=(sys.executable, None)):
+    """The user's kernel, reserved for one :meth:`Kernel.execute`, which must follow.
+
+    It is started if it is missing, has died or runs another interpreter.
+    Reserving it here, under the registry lock, keeps another user's
+    :func:`_make_room` and the reaper from killing it before the cell runs.
+    *interpreter* is ``(python, env)``, as returned by :func:`app.envs.activate`.
+    """
+    python, env = interpreter
+    with _lock:
+        kernel = _kernels.get(user_id)
+        if kernel is not None and not kernel.busy.acquire(blocking=False):
+            raise KernelBusy('The kernel is still running the previous cell.')
+        if kernel is not None and (not kernel.alive() or kernel.python != python):
+            del _kernels[user_id]
+            kernel.kill()
+            kernel = None
+        if kernel is None:
+            _make_room(config['KERNEL_MAX'])
+            kernel = _kernels[user_id] = Kernel(user_id, config['KERNEL_MEMORY_MB'], python, env)
+            kernel.busy.acquire()
+        kernel.last_used = time.monotonic()
+        return kernel
+
+
+def interrupt(user_id):
+    """Interrupt the running cell, if any; returns whether there was one."""
+    with _lock:
+        kernel = _kernels.get(user_id)
+    if kernel is None or not kernel.busy.locked():
+        return False
+    kernel.interrupt()
+    return True
+
+
+def shutdown(user_id):
+    """Kill the user's kernel; the next run starts a fresh one."""
+    with _lock:
+        kernel = _kernels.pop(user_id, None)
+    if kernel is not None:
+        kernel.kill()
+    return kernel is not None
+
+
+def shutdown_all():
+    with _lock:
+        kernels = list(_kernels.values())
+        _kernels.clear()
+    for kernel in kernels:
+        kernel.kill()
+
+
+def status(user_id):
+    with _lock:
+        kernel = _kernels.get(user_id)
+    if kernel is None or not kernel.alive():
+        return {'running': False}
+    return {'running': True, 'busy': kernel.busy.locked(),
+            'idle_s': round(time.monotonic() - kernel.last_used)}
+
+
+def stats():
+    with _lock:
+        kernels = list(_kernels.values())
+    return {'kernels': len(kernels), 'busy': sum(1 for k in kernels if k.busy.locked())}
+
+
+def _reap_idle(idle_ttl):
+    while True:
+        time.sleep(REAP_INTERVAL)
+        now = time.monotonic()
+        with _lock:
+            stale = [k for k in _kernels.values()
+                     if not k.alive() or (not k.busy.locked() and now - k.last_used > idle_ttl)]
+            for kernel in stale:
+                del _kernels[kernel.user_id]
+        for kernel in stale:
+            kernel.kill()
+
+
+def start_reaper(idle_ttl):
+    """Reap idle kernels in this process, and kill the rest when it exits."""
+    threading.Thread(target=_reap_idle, args=(idle_ttl,), daemon=True,
+                     name='kernel-reaper').start()
+    atexit.register(shutdown_all)
@@ -0,0 +1,154 @@
+"""
+Paginated, conditional JSON lists of a user's snippets, runs and chat sessions.
+
+The list endpoints share their query string:
+
+``limit``
+    Items per page (default 50, at most 200).
+``cursor``
+    The previous page's ``next_cursor``. Pages are keyset ranges, so a deep
+    page costs what the first one does and saves in between don't shift it.
+``fields``
+    Comma-separated item fields; only those columns are read. ``id`` is
+    always included.
+``since``
+    A ``version`` from an earlier response. Instead of a page the response
+    lists what changed after it, oldest first: the changed items, and
+    ``{"id": …, "deleted": true}`` for removed ones (see changes.py). With
+    ``more`` the client asks again from the returned version; ``reset``
+    means it is too far behind and has to reload the list.
+
+Every response carries the list's version in a weak ETag, and a matching
+``If-None-Match`` gets a 304 after one indexed lookup, before the list is
+queried — so polling an unchanged list costs next to nothing.
+"""
+import base64
+import hashlib
+import json
+from datetime import datetime
+from flask import current_app, jsonify, request
+from flask_login import current_user
+from sqlalchemy import and_, or_
+from . import changes, db
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def _limit(value):
+    limit = DEFAULT_LIMIT if value is None else int(value)
+    if limit < 1:
+        raise ValueError(limit)
+    return min(limit, MAX_LIMIT)
+
+
+def _fields(value, columns, default):
+    names = default if value is None else [name.strip() for name in value.split(',') if name.strip()]
+    if any(name not in columns for name in names):
+        raise ValueError(value)
+    return ['id'] + [name for name in dict.fromkeys(names) if name != 'id']
+
+
+def _json(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _encode_cursor(value, last_id):
+    raw = json.dumps([_json(value), last_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, order):
+    """``(order value, id)`` from a ``next_cursor``; raises ValueError if it is malformed."""
+    value, last_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    if isinstance(order.type, db.DateTime):
+        value = datetime.fromisoformat(value)
+    if not isinstance(last_id, int):
+        raise ValueError(cursor)
+    return value, last_id
+
+
+def respond(kind, model, columns, default_fields, order):
+    """The list response for the current user's *model* rows.
+
+    *columns* maps field names to columns or SQL expressions; pages are
+    sorted on *order*, newest first, with ties broken by id. *kind* names
+    the list in the change log.
+    """
+    args = request.args
+    try:
+        limit = _limit(args.get('limit'))
+        fields = _fields(args.get('fields'), columns, default_fields)
+        after = int(args['since']) if 'since' in args else None
+        cursor = decode_cursor(args['cursor'], order) if args.get('cursor') else None
+    except (ValueError, TypeError, KeyError):
+        return jsonify({'error': 'Invalid limit, cursor, fields or since.'}), 400
+
+    user_id = current_user.id
+    version = changes.version(user_id, kind)
+    etag = f'{user_id}.{kind}.{version}.{hashlib.blake2b(request.query_string, digest_size=6).hexdigest()}'
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        selected = [columns[name].label(name) for name in fields]
+        if after is None:
+            body = _page(model, selected, fields, order, user_id, cursor, limit)
+        else:
+            body = _changes(kind, model, selected, fields, user_id, after, limit)
+        body.setdefault('version', version)
+        response = jsonify(body)
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True     # always revalidate; a 304 is cheap
+    return response
+
+
+def paginate(query, model, order, cursor, limit, key=None):
+    """The page of *query* after *cursor*, newest *order* first, and the next cursor.
+
+    *cursor* is a decoded cursor or None. *key* gives a row's ``(order
+    value, id)``; by default rows are *model* instances. The next cursor is
+    None on the last page.
+    """
+    if cursor is not None:
+        value, last_id = cursor
+        query = query.filter(or_(order < value, and_(order == value, model.id < last_id)))
+    rows = query.order_by(order.desc(), model.id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+    if len(rows) <= limit:
+        return page, None
+    if key is None:
+        return page, _encode_cursor(getattr(page[-1], order.key), page[-1].id)
+    return page, _encode_cursor(*key(page[-1]))
+
+
+def _page(model, selected, fields, order, user_id, cursor, limit):
+    query = db.session.query(model.id.label('_id'), order.label('_order'), *selected) \
+        .filter(model.user_id == user_id)
+    page, next_cursor = paginate(query, model, order, cursor, limit,
+                                 key=lambda row: (row._mapping['_order'], row._mapping['_id']))
+    return {'items': [{name: _json(row._mapping[name]) for name in fields} for row in page],
+            'next_cursor': next_cursor}
+
+
+def _changes(kind, model, selected, fields, user_id, after, limit):
+    entries = changes.since(user_id, kind, after, limit + 1)
+    if entries is None:
+        return {'reset': True}
+    more = len(entries) > limit
+    entries = entries[:limit]
+    ids = [object_id for _, object_id, deleted in entries if not deleted]
+    rows = {}
+    if ids:
+        rows = {row._mapping['id']: row._mapping for row in db.session.query(*selected)
+                .filter(model.user_id == user_id, model.id.in_(ids))}
+    items = []
+    for _, object_id, deleted in entries:
+        if deleted:
+            items.append({'id': object_id, 'deleted': True})
+        elif object_id in rows:      # otherwise removed meanwhile; its tombstone is newer
+            items.append({name: _json(rows[object_id][name]) for name in fields})
+    body = {'changes': items, 'more': more}
+    if entries:
+        body['version'] = entries[-1][0]
+    return body
@@ -0,0 +1,364 @@
+"""
+Request timing, Prometheus metrics and an on-demand profiler.
+
+Every request's wall time is split into database, provider HTTP,
+subprocess, storage and template time and returned in a ``Server-Timing``
+header. The same numbers feed per-endpoint latency histograms which,
+with provider time-to-first-byte, the code-runner queue and the PTY
+multiplexer counters, are served in the Prometheus text format at
+``/metrics``. Metrics are kept in-process; every node runs one worker, so
+each node is scraped on its own.
+
+Users named in ``PROFILER_ADMINS`` can profile a single request by adding
+``?_profile=1``: the response is replaced by the report (pyinstrument when
+installed, otherwise cProfile).
+"""
+import hmac
+import io
+import threading
+import time
+from contextlib import contextmanager
+from flask import Blueprint, Response, abort, current_app, g, has_request_context, request
+from flask import before_render_template, template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    from pyinstrument import Profiler
+except ImportError:   # optional dependency
+    Profiler = None
+
+metrics_bp = Blueprint('metrics', __name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PHASES = ('db', 'provider', 'subprocess', 'storage', 'template')
+PROFILE_TOP = 60        # functions listed in a cProfile report
+LOCAL_ADDRS = ('127.0.0.1', '::1')
+
+_registry = []
+_collectors = []
+
+
+# ── Metric types ──────────────────────────────────────────────────────────────
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the block as in progress while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in items:
+            labels = dict(zip(self.labels, key))
+            for bound, count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket', {**labels, 'le': _number(bound)}, count
+            yield f'{self.name}_bucket', {**labels, 'le': '+Inf'}, counts[-2]
+            yield f'{self.name}_count', labels, counts[-2]
+            yield f'{self.name}_sum', labels, counts[-1]
+
+
+def collector(fn):
+    """Register ``fn() -> [(name, kind, help, value)]``, called on every scrape."""
+    _collectors.append(fn)
+    return fn
+
+
+REQUEST_LATENCY = Histogram('pyhost_request_duration_seconds',
+                            'Request wall time by endpoint.', ('endpoint', 'method'))
+REQUESTS = Counter('pyhost_requests_total', 'Requests by endpoint and status.',
+                   ('endpoint', 'method', 'status'))
+PHASE_SECONDS = Counter('pyhost_request_phase_seconds_total',
+                        'Request time spent in each phase, by endpoint.', ('endpoint', 'phase'))
+PROVIDER_LATENCY = Histogram('pyhost_provider_duration_seconds',
+                             'AI provider call duration.', ('provider',))
+PROVIDER_TTFB = Histogram('pyhost_provider_ttfb_seconds',
+                          'AI provider time to first byte.', ('provider',))
+ENV_BUILDS = Counter('pyhost_env_requests_total',
+                     'Package environments requested, by outcome (built or reused).', ('outcome',))
+UPLOAD_BYTES = Counter('pyhost_upload_bytes_total',
+                       'Hosted-file bytes by stage (received, or stored on disk after compression).',
+                       ('stage',))
+PREVIEW_JOBS = Counter('pyhost_preview_jobs_total',
+                       'Hosted-file preview jobs, by outcome (ready, none, error, dropped).', ('outcome',))
+CODE_RUNS = Gauge('pyhost_code_runs_in_progress', 'Editor runs executing or waiting.')
+
+
+# ── Per-request timing ────────────────────────────────────────────────────────
+
+def record(phase, seconds):
+    """Add *seconds* to *phase* of the current request, if it is being timed."""
+    if has_request_context():
+        timings = g.get('_timings')
+        if timings is not None:
+            timings[phase] += seconds
+
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
+
+
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('_query_start')
+    if starts:
+        record('db', time.perf_counter() - starts.pop())
+
+
+def _before_render(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('_render_starts', []).append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    starts = g.get('_render_starts') if has_request_context() else None
+    if starts:
+        start = starts.pop()
+        if not starts:   # nested renders are already inside the outer one
+            record('template', time.perf_counter() - start)
+
+
+def _on_provider_call(provider, seconds, ttfb):
+    PROVIDER_LATENCY.observe(seconds, provider=provider)
+    if ttfb is not None:
+        PROVIDER_TTFB.observe(ttfb, provider=provider)
+    record('provider', seconds)
+
+
+def _start_request():
+    g._request_start = time.perf_counter()
+    g._timings = dict.fromkeys(PHASES, 0.0)
+    if request.args.get('_profile') == '1' and _may_profile():
+        g._profiler = _start_profiler()
+
+
+def _finish_request(response):
+    profiler = g.pop('_profiler', None)
+    if profiler is not None:
+        response = _profile_report(profiler)
+    start = g.pop('_request_start', None)
+    timings = g.pop('_timings', None)
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_LATENCY.observe(total, endpoint=endpoint, method=request.method)
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    for phase, spent in timings.items():
+        if spent:
+            PHASE_SECONDS.inc(spent, endpoint=endpoint, phase=phase)
+    if current_app.config['SERVER_TIMING']:
+        parts = [f'{phase};dur={spent * 1000:.1f}' for phase, spent in timings.items() if spent]
+        parts.append(f'total;dur={total * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(parts)
+    return response
+
+
+def _teardown_request(exc):
+    # after_request did not run (the response was never built): free the profiler.
+    profiler = g.pop('_profiler', None)
+    if profiler is not None:
+        _profile_report(profiler)
+
+
+# ── Profiler ──────────────────────────────────────────────────────────────────
+
+_profile_lock = threading.Lock()
+
+
+def _may_profile():
+    admins = current_app.config['PROFILER_ADMINS']
+    return bool(admins) and current_user.is_authenticated and current_user.username in admins
+
+
+def _start_profiler():
+    # One profile at a time: cProfile and pyinstrument both hook the interpreter.
+    if not _profile_lock.acquire(blocking=False):
+        abort(503, 'Another request is being profiled.')
+    if Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def _profile_report(profiler):
+    try:
+        if Profiler is not None:
+            profiler.stop()
+            return Response(profiler.output_html(), mimetype='text/html')
+        import pstats
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        return Response(out.getvalue(), mimetype='text/plain')
+    finally:
+        _profile_lock.release()
+
+
+# ── Exposition ────────────────────────────────────────────────────────────────
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _sample_line(name, labels, value):
+    if labels:
+        pairs = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        return f'{name}{{{pairs}}} {_number(value)}'
+    return f'{name} {_number(value)}'
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        if metric.kind == 'gauge' and not metric.labels and not metric._values:
+            lines.append(_sample_line(metric.name, {}, 0))
+        lines.extend(_sample_line(*sample) for sample in metric.samples())
+    for fn in _collectors:
+        for name, kind, help, value in fn():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(_sample_line(name, {}, value))
+    return '\n'.join(lines) + '\n'
+
+
+@collector
+def _terminal_metrics():
+    from . import ptymux
+    from .terminal import session_stats
+    mux, sessions = ptymux.stats(), session_stats()
+    return [
+        ('pyhost_pty_sessions', 'gauge', 'PTYs served by the multiplexer.', mux['sessions']),
+        ('pyhost_pty_attached_sessions', 'gauge', 'Shells with a connected client.', sessions['attached']),
+        ('pyhost_pty_scrollback_bytes', 'gauge', 'Scrollback memory held.', sessions['scrollback_bytes']),
+        ('pyhost_pty_bytes_streamed_total', 'counter', 'PTY output sent to clients.', mux['bytes_total']),
+        ('pyhost_pty_frames_total', 'counter', 'PTY frames sent to clients.', mux['frames_total']),
+        ('pyhost_pty_loop_busy_seconds_total', 'counter', 'Time PTY loops spent outside select().',
+         mux['busy_seconds']),
+    ]
+
+
+@collector
+def _kernel_metrics():
+    from . import kernels
+    counts = kernels.stats()
+    return [
+        ('pyhost_editor_kernels', 'gauge', 'Stateful editor kernels running.', counts['kernels']),
+        ('pyhost_editor_kernels_busy', 'gauge', 'Kernels executing a cell.', counts['busy']),
+    ]
+
+
+def require_scraper():
+    """Abort unless the request may read node internals: ``METRICS_TOKEN``, or loopback without one."""
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(401)
+    elif request.remote_addr not in LOCAL_ADDRS:
+        abort(404)
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    require_scraper()
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Time every request of *app* and serve ``/metrics``."""
+    from chatcore import observe
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor)
+    observe(_on_provider_call)
+    app.register_blueprint(metrics_bp)
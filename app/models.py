@@ -3,6 +3,14 @@ from flask_login import UserMixin
 from . import db
 
 
+def human_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
 
@@ -11,12 +19,14 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
 
-    # AI Provider API keys (encrypted at rest ideally; stored as text here)
-    openai_key = db.Column(db.Text, nullable=True)
-    anthropic_key = db.Column(db.Text, nullable=True)
-    google_key = db.Column(db.Text, nullable=True)
-    groq_key = db.Column(db.Text, nullable=True)
-    mistral_key = db.Column(db.Text, nullable=True)
+    # AI Provider API keys (encrypted at rest ideally; stored as text here).
+    # Deferred: only the AI and profile pages need them, so the per-request
+    # user load skips them and the first access fetches the whole group.
+    openai_key = db.deferred(db.Column(db.Text, nullable=True), group='api_keys')
+    anthropic_key = db.deferred(db.Column(db.Text, nullable=True), group='api_keys')
+    google_key = db.deferred(db.Column(db.Text, nullable=True), group='api_keys')
+    groq_key = db.deferred(db.Column(db.Text, nullable=True), group='api_keys')
+    mistral_key = db.deferred(db.Column(db.Text, nullable=True), group='api_keys')
 
     files = db.relationship('HostedFile', backref='owner', lazy=True, cascade='all, delete-orphan')
     chat_sessions = db.relationship('ChatSession', backref='owner', lazy=True, cascade='all, delete-orphan')
@@ -33,31 +43,44 @@ class HostedFile(db.Model):
     __tablename__ = 'hosted_files'
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     filename = db.Column(db.String(256), nullable=False)       # stored filename (uuid-based)
     original_name = db.Column(db.String(256), nullable=False)  # original upload name
     size = db.Column(db.Integer, nullable=False)               # bytes
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     mimetype = db.Column(db.String(128), nullable=True)
 
+    preview = db.relationship('FilePreview', backref='file', uselist=False,
+                              cascade='all, delete-orphan')
+
     def __repr__(self):
         return f'<HostedFile {self.original_name}>'
 
     @property
     def size_human(self):
-        size = self.size
-        for unit in ('B', 'KB', 'MB', 'GB'):
-            if size < 1024:
-                return f'{size:.1f} {unit}'
-            size /= 1024
-        return f'{size:.1f} TB'
+        return human_size(self.size)
+
+
+class FilePreview(db.Model):
+    """What previews.py derived from a hosted file, by the file's content hash."""
+    __tablename__ = 'file_previews'
+
+    file_id = db.Column(db.Integer, db.ForeignKey('hosted_files.id'), primary_key=True)
+    status = db.Column(db.String(8), nullable=False, default='pending')   # pending, ready, none, error
+    sha256 = db.Column(db.String(64), nullable=True, index=True)
+    thumb = db.Column(db.Boolean, nullable=False, default=False)
+    table = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<FilePreview {self.file_id} {self.status}>'
 
 
 class ChatSession(db.Model):
     __tablename__ = 'chat_sessions'
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     model_name = db.Column(db.String(64), nullable=False)
     title = db.Column(db.String(120), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -92,22 +115,47 @@ class CodeSnippet(db.Model):
     __tablename__ = 'code_snippets'
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     title = db.Column(db.String(120), nullable=False)
     code = db.Column(db.Text, nullable=False)
     language = db.Column(db.String(32), default='python')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    versions = db.relationship('SnippetVersion', backref='snippet', lazy='dynamic',
+                               cascade='all, delete-orphan')
+
     def __repr__(self):
         return f'<CodeSnippet {self.title}>'
 
 
+class SnippetVersion(db.Model):
+    """One saved state of a snippet (see versions.py).
+
+    The newest row is the ``head`` and has no data (the code is in
+    ``CodeSnippet.code``); older ones hold a ``delta`` that turns the next
+    version back into this one, or every few versions the ``full`` text.
+    """
+    __tablename__ = 'snippet_versions'
+    __table_args__ = (db.UniqueConstraint('snippet_id', 'version'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    snippet_id = db.Column(db.Integer, db.ForeignKey('code_snippets.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(8), nullable=False, default='head')   # head, delta or full
+    data = db.Column(db.Text, nullable=True)
+    size = db.Column(db.Integer, nullable=False)                     # characters in this version
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SnippetVersion {self.snippet_id} v{self.version}>'
+
+
 class RunHistory(db.Model):
     __tablename__ = 'run_history'
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     code = db.Column(db.Text, nullable=False)
     stdin = db.Column(db.Text, nullable=True)
     stdout = db.Column(db.Text, nullable=True)
@@ -117,3 +165,24 @@ class RunHistory(db.Model):
 
     def __repr__(self):
         return f'<RunHistory {self.id}>'
+
+
+class Change(db.Model):
+    """The latest change to one of a user's snippets, runs or chat sessions (see changes.py).
+
+    ``id`` is the user's list version; ``op`` is ``put``, ``delete`` or
+    ``floor`` (tombstones up to ``object_id`` have been pruned).
+    """
+    __tablename__ = 'changes'
+    __table_args__ = (db.Index('ix_changes_user_kind_id', 'user_id', 'kind', 'id'),
+                      db.Index('ix_changes_user_kind_object', 'user_id', 'kind', 'object_id'),
+                      {'sqlite_autoincrement': True})    # ids must never be reused
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    kind = db.Column(db.String(16), nullable=False)      # snippet, run or session
+    object_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(8), nullable=False, default='put')
+
+    def __repr__(self):
+        return f'<Change {self.id} {self.kind} {self.object_id} {self.op}>'
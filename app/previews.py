@@ -0,0 +1,294 @@
+"""
+Thumbnails and table previews for hosted files, made in the background.
+
+An upload only records a ``pending`` :class:`~app.models.FilePreview` and
+queues a job (:func:`submit`), which never waits: with the queue full the
+row just stays pending. A pool worker hashes the file and writes what can
+be derived from it under ``PREVIEW_CACHE_DIR``, named by that hash — a
+WebP thumbnail of an image, or the first rows and column types of a CSV,
+TSV, JSON (lines) or Parquet table as JSON — and skips the work when a
+file with the same content already has them. The hosting page re-queues
+files whose job was lost (:func:`ensure`), which also covers files
+uploaded before previews existed.
+
+Artifacts are served by hash with an immutable ``Cache-Control``
+(:func:`serve`), only to users who own a file with that content.
+"""
+import functools
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import abort, send_file, url_for
+from . import db, metrics, storage
+from .models import FilePreview, HostedFile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:           # no thumbnails
+    Image = None
+
+try:
+    import pandas as pd
+except ImportError:           # no table previews
+    pd = None
+
+IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+TABLE_EXTS = {'.csv', '.tsv', '.json', '.jsonl', '.ndjson', '.parquet'}
+ARTIFACTS = {'thumb.webp': 'image/webp', 'table.json': 'application/json'}
+THUMB_SIZE = 320              # longest side, pixels
+PREVIEW_ROWS = 50
+PREVIEW_COLUMNS = 50
+QUEUE_PER_WORKER = 16         # queued jobs per worker before new ones are left pending
+STALE_AFTER = timedelta(minutes=2)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_executor = None
+_slots = None
+_inflight = set()
+_lock = threading.Lock()
+
+
+def kind(filename):
+    """``'image'``, ``'table'`` or None: what can be previewed for *filename* here."""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in IMAGE_EXTS and Image is not None:
+        return 'image'
+    if ext in TABLE_EXTS and pd is not None:
+        return 'table'
+    return None
+
+
+# ── Worker-side functions (must be importable top-level callables) ───────────
+
+def _artifact_path(cache_dir, sha256, suffix):
+    return os.path.join(cache_dir, sha256[:2], f'{sha256}.{suffix}')
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _thumbnail(f):
+    with Image.open(f) as image:
+        image.draft('RGB', (THUMB_SIZE * 2, THUMB_SIZE * 2))   # JPEG: decode at a smaller scale
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.getbands()
+                                  else 'RGB')
+        buf = io.BytesIO()
+        image.save(buf, format='WEBP', quality=80)
+        return buf.getvalue()
+
+
+def _count_lines(f):
+    return sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+
+
+def _table(path, ext):
+    with storage.open_decoded(path) as f:
+        if ext in ('.csv', '.tsv'):
+            frame = pd.read_csv(f, sep='\t' if ext == '.tsv' else ',', nrows=PREVIEW_ROWS)
+        elif ext in ('.jsonl', '.ndjson'):
+            frame = pd.read_json(f, lines=True, nrows=PREVIEW_ROWS)
+        elif ext == '.parquet':
+            frame = pd.read_parquet(f if f.seekable() else io.BytesIO(f.read()))
+        else:
+            frame = pd.read_json(f)
+        rows = len(frame)
+    if ext in ('.csv', '.tsv', '.jsonl', '.ndjson'):
+        with storage.open_decoded(path) as f:
+            lines = _count_lines(f)
+        # approximate: quoted newlines count
+        rows = max(lines - 1, rows) if ext in ('.csv', '.tsv') else lines
+    head = frame.iloc[:PREVIEW_ROWS, :PREVIEW_COLUMNS]
+    preview = {
+        'columns': [{'name': str(name), 'dtype': str(dtype)} for name, dtype in head.dtypes.items()],
+        'rows': json.loads(head.to_json(orient='values', date_format='iso', default_handler=str)),
+        'row_count': rows,
+        'column_count': frame.shape[1],
+    }
+    return json.dumps(preview, separators=(',', ':')).encode()
+
+
+def _derive(path, ext, cache_dir):
+    """Hash *path* (decoded) and write its artifacts if missing; returns ``(sha256, thumb, table)``."""
+    digest = hashlib.sha256()
+    with storage.open_decoded(path) as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    sha256 = digest.hexdigest()
+    if ext in IMAGE_EXTS:
+        target = _artifact_path(cache_dir, sha256, 'thumb.webp')
+        if not os.path.exists(target):
+            with storage.open_decoded(path) as f:
+                _write(target, _thumbnail(f if f.seekable() else io.BytesIO(f.read())))
+        return sha256, True, False
+    target = _artifact_path(cache_dir, sha256, 'table.json')
+    if not os.path.exists(target):
+        _write(target, _table(path, ext))
+    return sha256, False, True
+
+
+# ── Queue ─────────────────────────────────────────────────────────────────────
+
+def start(app):
+    """Fork the worker pool (a thread when ``PREVIEW_WORKERS`` is 0); until then jobs stay pending.
+
+    Like the password pool, call it before the process starts any threads.
+    """
+    global _executor, _slots
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    workers = app.config['PREVIEW_WORKERS']
+    if workers > 0:
+        _executor = ProcessPoolExecutor(max_workers=workers)
+        _executor.submit(int).result()
+    else:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preview')
+    _slots = threading.BoundedSemaphore(max(workers, 1) * QUEUE_PER_WORKER)
+
+
+def run(fn, *args, timeout):
+    """Call *fn* on the worker pool and wait up to *timeout* seconds for its result.
+
+    For other image work that should stay out of the web process (see
+    display.py). Raises RuntimeError without a pool and TimeoutError.
+    """
+    if _executor is None:
+        raise RuntimeError('The preview pool is not running.')
+    return _executor.submit(fn, *args).result(timeout=timeout)
+
+
+def submit(app, hosted):
+    """Queue a job for *hosted*, whose pending FilePreview is committed; True if queued."""
+    key = (hosted.id, hosted.filename)      # ids can be reused after a delete
+    with _lock:
+        if key in _inflight:
+            return True
+        if _executor is None or not _slots.acquire(blocking=False):
+            metrics.PREVIEW_JOBS.inc(outcome='dropped')
+            return False
+        _inflight.add(key)
+    path = os.path.join(app.config['UPLOAD_FOLDER'], str(hosted.user_id), hosted.filename)
+    ext = os.path.splitext(hosted.original_name)[1].lower()
+    try:
+        future = _executor.submit(_derive, path, ext, app.config['PREVIEW_CACHE_DIR'])
+    except RuntimeError:      # pool shut down or broken
+        _done(key)
+        metrics.PREVIEW_JOBS.inc(outcome='dropped')
+        return False
+    future.add_done_callback(functools.partial(_finish, app, key))
+    return True
+
+
+def _done(key):
+    with _lock:
+        _inflight.discard(key)
+    _slots.release()
+
+
+def _finish(app, key, future):
+    _done(key)
+    file_id, filename = key
+    try:
+        sha256, thumb, table = future.result()
+        status = 'ready' if thumb or table else 'none'
+    except Exception as exc:      # mostly files that aren't what their name says
+        app.logger.warning('Preview of hosted file %s failed: %r', file_id, exc)
+        sha256, thumb, table, status = None, False, False, 'error'
+    metrics.PREVIEW_JOBS.inc(outcome=status)
+    with app.app_context():
+        try:
+            row = db.session.get(FilePreview, file_id)
+            if row is not None and row.file.filename == filename:   # else deleted meanwhile
+                row.status, row.sha256, row.thumb, row.table = status, sha256, thumb, table
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.warning('Could not record preview of hosted file %s', file_id, exc_info=True)
+
+
+def ensure(app, files):
+    """Give each of *files* a FilePreview and queue the ones without a live job."""
+    now = datetime.utcnow()
+    queue, changed = [], False
+    for hosted in files:
+        row = hosted.preview
+        if row is None:
+            hosted.preview = row = FilePreview(status='pending' if kind(hosted.original_name) else 'none')
+            changed = True
+        elif not (row.status == 'pending' and now - (row.updated_at or now) > STALE_AFTER
+                  and (hosted.id, hosted.filename) not in _inflight):
+            continue
+        if row.status == 'pending':
+            row.updated_at = now
+            queue.append(hosted)
+            changed = True
+    if changed:
+        db.session.commit()
+    for hosted in queue:
+        submit(app, hosted)
+
+
+# ── Serving ───────────────────────────────────────────────────────────────────
+
+def describe(row):
+    """JSON-ready state of a FilePreview: status and artifact URLs."""
+    if row is None:
+        return {'status': 'none', 'thumb': None, 'table': None}
+    return {
+        'status': row.status,
+        'thumb': url_for('hosting.derived', name=f'{row.sha256}.thumb.webp') if row.thumb else None,
+        'table': url_for('hosting.derived', name=f'{row.sha256}.table.json') if row.table else None,
+    }
+
+
+def serve(name, user_id, config):
+    """Response for artifact *name* (``<sha256>.<suffix>``) if *user_id* owns such a file."""
+    sha256, _, suffix = name.partition('.')
+    if suffix not in ARTIFACTS or len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256):
+        abort(404)
+    flag = FilePreview.thumb if suffix == 'thumb.webp' else FilePreview.table
+    owned = db.session.query(FilePreview.file_id).join(HostedFile) \
+        .filter(FilePreview.sha256 == sha256, flag.is_(True), HostedFile.user_id == user_id).first()
+    path = _artifact_path(config['PREVIEW_CACHE_DIR'], sha256, suffix)
+    if owned is None or not os.path.isfile(path):
+        abort(404)
+    response = send_file(path, mimetype=ARTIFACTS[suffix], max_age=IMMUTABLE_MAX_AGE, conditional=True)
+    response.cache_control.public = False
+    response.cache_control.private = True     # per-owner: keep it out of shared caches
+    response.cache_control.immutable = True
+    return response
+
+
+def prune(config):
+    """Delete artifacts no hosted file refers to any more; returns how many.
+
+    Files written in the last hour are kept: their job may not have
+    recorded its result yet.
+    """
+    referenced = {sha256 for (sha256,) in db.session.query(FilePreview.sha256).distinct()
+                  if sha256}
+    cutoff = time.time() - 3600
+    removed = 0
+    for dirpath, _, filenames in os.walk(config['PREVIEW_CACHE_DIR']):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                if filename.split('.', 1)[0] not in referenced and os.stat(path).st_mtime < cutoff:
+                    os.unlink(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
@@ -1,7 +1,9 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for
 from flask_login import login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from chatcore.identity import invalidate_user
+from chatcore.passwords import HasherBusy, hash_password, verify_password
 from . import db
+from .auth import BUSY_MSG
 from .models import User
 
 profile_bp = Blueprint('profile', __name__, url_prefix='/profile')
@@ -43,16 +45,19 @@ def index():
             new_pw = request.form.get('new_password', '')
             confirm_pw = request.form.get('confirm_password', '')
 
-            if not check_password_hash(current_user.password_hash, current_pw):
-                flash('Current password is incorrect.', 'danger')
-            elif len(new_pw) < 6:
-                flash('New password must be at least 6 characters.', 'danger')
-            elif new_pw != confirm_pw:
-                flash('New passwords do not match.', 'danger')
-            else:
-                current_user.password_hash = generate_password_hash(new_pw)
-                db.session.commit()
-                flash('Password changed successfully.', 'success')
+            try:
+                if not verify_password(current_user.password_hash, current_pw):
+                    flash('Current password is incorrect.', 'danger')
+                elif len(new_pw) < 6:
+                    flash('New password must be at least 6 characters.', 'danger')
+                elif new_pw != confirm_pw:
+                    flash('New passwords do not match.', 'danger')
+                else:
+                    current_user.password_hash = hash_password(new_pw)
+                    db.session.commit()
+                    flash('Password changed successfully.', 'success')
+            except HasherBusy:
+                flash(BUSY_MSG, 'danger')
 
         elif action == 'update_api_keys':
             fields = ['openai_key', 'anthropic_key', 'google_key', 'groq_key', 'mistral_key']
@@ -63,6 +68,7 @@ def index():
             db.session.commit()
             flash('API keys updated successfully.', 'success')
 
+        invalidate_user(current_user.id)
         return redirect(url_for('profile.index'))
 
     return render_template('profile/index.html')
@@ -0,0 +1,168 @@
+"""
+PTY output framing for the web terminal.
+
+Raw ``read()`` chunks from a PTY are tiny and frequent; emitting one
+Socket.IO event per chunk floods the client and burns server CPU on event
+overhead. :class:`FrameBuffer` coalesces chunks into frames bounded by a
+time interval and a byte budget, and never splits a UTF-8 sequence across
+frames. :class:`FlowControl` counts frames the client has not yet
+acknowledged so the multiplexer (``ptymux``) can stop draining the PTY
+when the browser falls behind; the kernel's PTY buffer then blocks the
+writing process.
+"""
+import codecs
+import collections
+import threading
+import time
+
+FRAME_INTERVAL = 0.02        # seconds a partial frame may wait before it is sent
+FRAME_MAX_BYTES = 64 * 1024  # frames are flushed as soon as they reach this size
+MAX_INFLIGHT_FRAMES = 8      # unacknowledged frames before reading is paused
+
+
+def incomplete_utf8_tail(buf):
+    """Length of a trailing UTF-8 sequence in *buf* that is not yet complete."""
+    for i in range(1, min(4, len(buf)) + 1):
+        byte = buf[-i]
+        if byte & 0xC0 == 0x80:      # continuation byte, keep looking back
+            continue
+        if byte >= 0xC0:             # lead byte: how long should the sequence be?
+            need = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return i if need > i else 0
+        return 0                     # ASCII
+    return 0
+
+
+class FrameBuffer:
+    """Accumulates PTY output and hands it out in coalesced frames.
+
+    In binary mode frames are ``bytes`` cut at UTF-8 character boundaries;
+    otherwise they are ``str`` produced by an incremental decoder, so
+    multibyte characters split across reads survive either way.
+    """
+
+    def __init__(self, interval=FRAME_INTERVAL, max_bytes=FRAME_MAX_BYTES, binary=True):
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.binary = binary
+        self._buf = bytearray()
+        self._since = None
+        self._decoder = None if binary else codecs.getincrementaldecoder('utf-8')('replace')
+
+    def __len__(self):
+        return len(self._buf)
+
+    def feed(self, data):
+        if not data:
+            return
+        if self._since is None:
+            self._since = time.monotonic()
+        self._buf += data
+
+    def ready(self, now=None):
+        if not self._buf:
+            return False
+        if len(self._buf) >= self.max_bytes:
+            return True
+        return (now or time.monotonic()) - self._since >= self.interval
+
+    def timeout(self, now=None):
+        """Seconds until the pending frame is due, or None if nothing is pending."""
+        if not self._buf:
+            return None
+        return max(0.0, self._since + self.interval - (now or time.monotonic()))
+
+    def take(self, final=False):
+        """Remove and return the pending frame (empty if nothing can be sent)."""
+        if self.binary:
+            keep = 0 if final else incomplete_utf8_tail(self._buf)
+            frame = bytes(self._buf[:len(self._buf) - keep])
+            del self._buf[:len(self._buf) - keep]
+        else:
+            frame = self._decoder.decode(bytes(self._buf), final)
+            self._buf.clear()
+        self._since = time.monotonic() if self._buf else None
+        return frame
+
+
+class FlowControl:
+    """Tracks frames emitted to a client that it has not acknowledged yet.
+
+    ``on_resume`` is called (from whichever thread delivered the ack) when
+    the count drops back below the limit.
+    """
+
+    def __init__(self, max_inflight=MAX_INFLIGHT_FRAMES):
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.on_resume = None
+        self._lock = threading.Lock()
+
+    def sent(self):
+        with self._lock:
+            self.inflight += 1
+
+    def ack(self, *_):
+        self._release(lambda n: max(0, n - 1))
+
+    def reset(self):
+        self._release(lambda n: 0)
+
+    @property
+    def blocked(self):
+        return self.inflight >= self.max_inflight
+
+    def _release(self, update):
+        with self._lock:
+            was_blocked = self.blocked
+            self.inflight = update(self.inflight)
+            resumed = was_blocked and not self.blocked
+        if resumed and self.on_resume:
+            self.on_resume()
+
+
+class Scrollback:
+    """Memory-bounded ring buffer of recent output, addressed by byte offset.
+
+    ``end`` counts every byte ever appended, so a client that knows how much
+    it has received can ask for just the part it missed.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.end = 0
+        self._chunks = collections.deque()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def start(self):
+        return self.end - self._size
+
+    def append(self, data):
+        if not data:
+            return
+        self._chunks.append(data)
+        self._size += len(data)
+        self.end += len(data)
+        while self._size > self.capacity:
+            head = self._chunks.popleft()
+            excess = self._size - self.capacity
+            if len(head) > excess:
+                # Trim inside the chunk, skipping to the next UTF-8 lead byte.
+                cut = excess
+                while cut < len(head) and head[cut] & 0xC0 == 0x80:
+                    cut += 1
+                self._chunks.appendleft(head[cut:])
+                self._size -= cut
+            else:
+                self._size -= len(head)
+
+    def since(self, offset):
+        """Bytes after absolute *offset*, or everything retained if it is too old."""
+        data = b''.join(self._chunks)
+        if offset is None or offset < self.start or offset > self.end:
+            return data
+        return data[offset - self.start:]
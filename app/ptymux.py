@@ -0,0 +1,256 @@
+"""
+Selector-based PTY multiplexer.
+
+Instead of one blocking reader thread per terminal, a small fixed set of
+event loops (one by default, ``TERMINAL_MUX_LOOPS`` for per-core loops)
+watch every PTY master fd with ``selectors``. Each loop reads whatever is
+readable, coalesces it through the channel's ``FrameBuffer``, emits due
+frames, pauses fds whose client has too many unacknowledged frames and
+reaps channels whose process has exited. An exception from one channel
+(usually its emit callback) is logged and closes that channel only.
+"""
+import logging
+import os
+import selectors
+import signal
+import threading
+import time
+from .ptyio import FrameBuffer, FlowControl
+
+PTY_READ_SIZE = 65536
+ACK_TIMEOUT = 10      # seconds a paused channel waits for acks before resuming
+MAX_SELECT_WAIT = 1.0
+KILL_GRACE = 2.0      # seconds after hangup before a lingering process is killed
+
+log = logging.getLogger(__name__)   # under the Flask app's logger
+
+
+class Channel:
+    """One PTY attached to a loop, plus its framing and flow-control state."""
+
+    def __init__(self, proc, on_frame, on_exit, frames=None, flow=None):
+        self.proc = proc
+        self.fd = proc.fd
+        self.on_frame = on_frame
+        self.on_exit = on_exit
+        self.frames = frames or FrameBuffer()
+        self.flow = flow or FlowControl()
+        self.paused_at = None
+        self.bytes_out = 0
+        self.loop = None
+
+    def flush(self, final=False):
+        frame = self.frames.take(final)
+        if frame:
+            self.flow.sent()
+            self.bytes_out += len(frame)
+            self.loop.bytes_out += len(frame)
+            self.loop.frames_out += 1
+            self.on_frame(frame)
+
+
+class PtyLoop:
+    """A single selector thread serving many channels."""
+
+    def __init__(self, name='pty-mux'):
+        self.selector = selectors.DefaultSelector()
+        self.channels = {}
+        self.bytes_out = 0
+        self.frames_out = 0
+        self.bytes_per_sec = 0.0
+        self.busy_seconds = 0.0       # time spent outside select(), for metrics
+        self._reaping = []            # (proc, kill_deadline) awaiting waitpid
+        self._window = (time.monotonic(), 0)
+        self._pending = []            # (op, channel) handed over from other threads
+        self._pending_lock = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # ── Cross-thread API ──────────────────────────────────────────────────────
+
+    def add(self, channel):
+        channel.loop = self
+        channel.flow.on_resume = lambda: self._submit('resume', channel)
+        self._submit('add', channel)
+
+    def remove(self, channel):
+        self._submit('remove', channel)
+
+    def _submit(self, op, channel):
+        with self._pending_lock:
+            self._pending.append((op, channel))
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            pass
+
+    # ── Loop internals ────────────────────────────────────────────────────────
+
+    def _apply_pending(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        for op, ch in pending:
+            self._guard(ch, self._apply, op, ch)
+
+    def _apply(self, op, ch):
+        if op == 'add':
+            self.channels[ch.fd] = ch
+            self.selector.register(ch.fd, selectors.EVENT_READ, ch)
+        elif op == 'remove':
+            self._close(ch, notify=False)
+        elif op == 'resume' and ch.paused_at is not None and ch.fd in self.channels:
+            ch.paused_at = None
+            self.selector.register(ch.fd, selectors.EVENT_READ, ch)
+
+    def _guard(self, ch, step, *args):
+        """Run one channel's *step*; if it raises, log it and close that channel only."""
+        try:
+            step(*args)
+        except Exception:
+            log.exception('Terminal channel on fd %s failed; closing it', ch.fd)
+            try:
+                self._close(ch)
+            except Exception:
+                log.exception('Closing terminal channel on fd %s failed', ch.fd)
+
+    def _pause(self, ch):
+        ch.paused_at = time.monotonic()
+        self.selector.unregister(ch.fd)
+
+    def _close(self, ch, notify=True):
+        if self.channels.pop(ch.fd, None) is None:
+            return
+        try:
+            if ch.paused_at is None:
+                try:
+                    self.selector.unregister(ch.fd)
+                except (KeyError, ValueError):
+                    pass     # its registration is what failed
+            ch.flush(final=True)
+        finally:
+            # Closing the master hangs up the shell. PtyProcess.close() would
+            # sleep between signals, so reaping is done without blocking instead.
+            try:
+                ch.proc.fileobj.close()
+            except OSError:
+                pass
+            ch.proc.closed = True
+            self._reaping.append((ch.proc, time.monotonic() + KILL_GRACE))
+        if notify:
+            ch.on_exit()
+
+    def _reap(self, now):
+        still_running = []
+        for proc, deadline in self._reaping:
+            try:
+                if not proc.isalive():
+                    continue
+                if now > deadline:
+                    os.kill(proc.pid, signal.SIGKILL)
+            except (OSError, ProcessLookupError):
+                continue
+            still_running.append((proc, deadline))
+        self._reaping = still_running
+
+    def _next_timeout(self):
+        now = time.monotonic()
+        waits = [MAX_SELECT_WAIT]
+        for ch in self.channels.values():
+            t = ch.frames.timeout(now)
+            if t is not None:
+                waits.append(t)
+        return min(waits)
+
+    def _run(self):
+        while True:
+            try:
+                self._tick()
+            except Exception:     # never let the loop die: every shell on it would freeze
+                log.exception('Terminal loop %s failed', self._thread.name)
+                time.sleep(0.1)
+
+    def _tick(self):
+        events = self.selector.select(self._next_timeout())
+        busy_from = time.perf_counter()
+        for key, _ in events:
+            ch = key.data
+            if ch is None:
+                self._apply_pending()
+            elif self.channels.get(ch.fd) is ch:   # else closed earlier in this batch
+                self._guard(ch, self._read, ch)
+
+        now = time.monotonic()
+        for ch in list(self.channels.values()):
+            if self.channels.get(ch.fd) is ch:
+                self._guard(ch, self._service, ch, now)
+        if self._reaping:
+            self._reap(now)
+        self._update_rate(now)
+        self.busy_seconds += time.perf_counter() - busy_from
+
+    def _read(self, ch):
+        try:
+            data = os.read(ch.fd, PTY_READ_SIZE)
+        except OSError:
+            data = b''   # EIO once the shell exits
+        if data:
+            ch.frames.feed(data)
+        else:
+            self._close(ch)
+
+    def _service(self, ch, now):
+        if ch.frames.ready(now):
+            ch.flush()
+        if ch.paused_at is None and ch.flow.blocked:
+            self._pause(ch)
+        elif ch.paused_at is not None and now - ch.paused_at > ACK_TIMEOUT:
+            ch.flow.reset()   # client stopped acknowledging; don't stall forever
+
+    def _update_rate(self, now):
+        start, base = self._window
+        if now - start >= 1.0:
+            self.bytes_per_sec = (self.bytes_out - base) / (now - start)
+            self._window = (now, self.bytes_out)
+
+
+_loops = []
+_loops_lock = threading.Lock()
+
+
+def init_loops(count=1):
+    with _loops_lock:
+        while len(_loops) < max(1, count):
+            _loops.append(PtyLoop(name=f'pty-mux-{len(_loops)}'))
+
+
+def attach(channel):
+    """Hand *channel* to the least-loaded loop."""
+    init_loops()
+    loop = min(_loops, key=lambda lp: len(lp.channels) + len(lp._pending))
+    loop.add(channel)
+    return channel
+
+
+def detach(channel):
+    if channel.loop is not None:
+        channel.loop.remove(channel)
+
+
+def stats():
+    return {
+        'loops': len(_loops),
+        'sessions': sum(len(lp.channels) for lp in _loops),
+        'bytes_total': sum(lp.bytes_out for lp in _loops),
+        'frames_total': sum(lp.frames_out for lp in _loops),
+        'bytes_per_sec': round(sum(lp.bytes_per_sec for lp in _loops), 1),
+        'busy_seconds': round(sum(lp.busy_seconds for lp in _loops), 3),
+    }
@@ -0,0 +1,148 @@
+"""
+Rich output for code run in the PyHost editor.
+
+    from pyhost import display
+    display(image)            # PIL image, numpy array, matplotlib figure, PNG/JPEG bytes or a file path
+
+Images travel to the server on a side channel — the file descriptor named
+by ``PYHOST_DISPLAY_FD``, or the kernel's reply pipe — never through
+stdout. This module is also the matplotlib backend (``MPLBACKEND=
+module://pyhost``): ``plt.show()`` displays every open figure, and figures
+still open when the program ends are displayed then.
+
+Only the standard library is imported up front; matplotlib, Pillow and
+numpy are used when the object being displayed comes from them.
+"""
+import atexit
+import json
+import os
+import sys
+
+MAX_ITEMS = 16                   # images per run (per cell in a kernel)
+MAX_BYTES = 16 * 1024 * 1024     # total image bytes per run
+FIGURE_DPI = 100
+
+_MAGIC = ((b'\x89PNG\r\n\x1a\n', 'image/png'), (b'\xff\xd8\xff', 'image/jpeg'),
+          (b'GIF87a', 'image/gif'), (b'GIF89a', 'image/gif'))
+
+_sent = {'items': 0, 'bytes': 0}
+
+
+def _write_fd(mime, data):
+    fd = os.environ.get('PYHOST_DISPLAY_FD')
+    if not fd:
+        return          # batch runs and plain scripts: nowhere to show images
+    record = json.dumps({'mime': mime, 'size': len(data)}).encode() + b'\n' + data
+    view = memoryview(record)
+    while view:
+        view = view[os.write(int(fd), view):]
+
+
+# The kernel replaces this with a per-cell collector.
+_sink = _write_fd
+
+
+def reset():
+    _sent.update(items=0, bytes=0)
+
+
+def _emit(mime, data):
+    if _sent['items'] >= MAX_ITEMS or _sent['bytes'] + len(data) > MAX_BYTES:
+        print(f'[pyhost] display limit reached ({MAX_ITEMS} images, '
+              f'{MAX_BYTES // (1024 * 1024)} MB); image dropped', file=sys.stderr)
+        return
+    _sent['items'] += 1
+    _sent['bytes'] += len(data)
+    _sink(mime, data)
+
+
+def _sniff(data):
+    for magic, mime in _MAGIC:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def _png(save, **kwargs):
+    import io
+    buf = io.BytesIO()
+    save(buf, format='png', **kwargs)
+    return buf.getvalue()
+
+
+def _image(obj):
+    """``(mime, bytes)`` for *obj*, or None if it is not something we can show."""
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        data = bytes(obj)
+        mime = _sniff(data)
+        return (mime, data) if mime else None
+    if isinstance(obj, (str, os.PathLike)) and os.path.isfile(obj):
+        with open(obj, 'rb') as f:
+            return _image(f.read())
+    module = type(obj).__module__ or ''
+    if module.startswith('PIL.'):
+        image = obj if obj.mode in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA') else obj.convert('RGBA')
+        return 'image/png', _png(image.save)
+    if module.startswith('matplotlib.') and hasattr(obj, 'savefig'):
+        return 'image/png', _png(obj.savefig, dpi=FIGURE_DPI, bbox_inches='tight')
+    if module == 'numpy' and getattr(obj, 'ndim', 0) in (2, 3):
+        from PIL import Image
+        array = obj
+        if array.dtype != 'uint8':
+            array = (array.clip(0, 1) * 255).astype('uint8') if array.dtype.kind == 'f' \
+                else array.clip(0, 255).astype('uint8')
+        return 'image/png', _png(Image.fromarray(array).save)
+    for method, mime in (('_repr_png_', 'image/png'), ('_repr_jpeg_', 'image/jpeg')):
+        data = getattr(obj, method, lambda: None)()
+        if data:
+            return mime, data
+    return None
+
+
+def is_image(obj):
+    """Whether a REPL should show *obj* as an image rather than its repr."""
+    module = type(obj).__module__ or ''
+    return (module.startswith('PIL.') and hasattr(obj, 'save')) \
+        or (module.startswith('matplotlib.') and hasattr(obj, 'savefig')) \
+        or hasattr(obj, '_repr_png_') or hasattr(obj, '_repr_jpeg_')
+
+
+def display(*objs):
+    """Show each object as an image in the output pane; anything else is printed."""
+    for obj in objs:
+        image = _image(obj)
+        if image is None:
+            print(repr(obj))
+        else:
+            _emit(*image)
+
+
+# ── matplotlib backend ────────────────────────────────────────────────────────
+
+def show(*args, **kwargs):
+    """``plt.show()``: display every open figure, then close them."""
+    from matplotlib._pylab_helpers import Gcf
+    for manager in Gcf.get_all_fig_managers():
+        display(manager.canvas.figure)
+    Gcf.destroy_all()
+
+
+def flush_figures():
+    """Display figures nobody called ``show()`` for (like a notebook would)."""
+    if 'matplotlib.pyplot' in sys.modules:
+        show()
+
+
+def __getattr__(name):
+    # matplotlib asks for FigureCanvas when it loads this module as its backend;
+    # importing Agg only then keeps `import pyhost` cheap.
+    # It then copies the module's globals, so the class has to become one.
+    if name == 'FigureCanvas':
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        globals()['FigureCanvas'] = FigureCanvasAgg
+        if _sink is _write_fd:
+            atexit.register(flush_figures)
+        return FigureCanvasAgg
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
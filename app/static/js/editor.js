@@ -20,6 +20,12 @@
       },
       'Ctrl-Enter': runCode,
       'Cmd-Enter': runCode,
+      'Shift-Enter': function (cm) {
+        if (kernelMode) runCell();
+        else return CodeMirror.Pass;
+      },
+      'Ctrl-Shift-Enter': function () { if (kernelMode) runSelection(); },
+      'Cmd-Shift-Enter': function () { if (kernelMode) runSelection(); },
       'Ctrl-S': saveCurrentSnippet,
     },
   });
@@ -58,7 +64,29 @@
   const snippetsToggle = document.getElementById('snippets-toggle');
   const editorSidebar  = document.getElementById('editor-sidebar');
 
+  // Kernel mode
+  const kernelToggle       = document.getElementById('kernel-toggle');
+  const kernelControls     = document.getElementById('kernel-controls');
+  const kernelCount        = document.getElementById('kernel-count');
+  const kernelInterruptBtn = document.getElementById('kernel-interrupt-btn');
+  const kernelRestartBtn   = document.getElementById('kernel-restart-btn');
+  const runCellBtn         = document.getElementById('run-cell-btn');
+  const runSelectionBtn    = document.getElementById('run-selection-btn');
+
   let currentSnippetId = null;
+  let kernelMode = false;
+
+  // What the server holds for the current snippet: saves send a patch
+  // against it instead of the whole file.
+  let savedVersion = null;
+  let savedText = null;
+
+  function setCurrentSnippet(id, title, version, text) {
+    currentSnippetId = id;
+    savedVersion = id ? version : null;
+    savedText = id ? text : null;
+    if (snippetNameEl) snippetNameEl.textContent = id ? title + '.py' : 'main.py';
+  }
 
   // ── Load from session storage (dashboard redirect) ────────────────────────
   const savedCode = sessionStorage.getItem('loadCode');
@@ -132,9 +160,53 @@
     }
   }
 
+  // Images the program showed come back as URLs; ask for a copy scaled to
+  // the pane (the server rounds ?w= up to a few fixed widths) and link the original.
+  function showImages(images) {
+    if (!images || !images.length) return;
+    if (outputEl.textContent === '(no output)') outputEl.textContent = '';
+    const pane = Math.ceil(outputEl.clientWidth * (window.devicePixelRatio || 1));
+    images.forEach(item => {
+      const link = document.createElement('a');
+      link.href = item.url;
+      link.target = '_blank';
+      link.rel = 'noopener';
+      const img = document.createElement('img');
+      img.className = 'display-output';
+      img.loading = 'lazy';
+      img.alt = 'Program output image';
+      img.src = item.width && item.width > pane ? `${item.url}?w=${pane}` : item.url;
+      if (item.width && item.height) {
+        img.width = item.width;
+        img.height = item.height;
+      }
+      link.appendChild(img);
+      outputEl.appendChild(link);
+    });
+  }
+
+  // Syntax errors come back from the server's pre-flight compile with a
+  // position; mark that line until the next run.
+  let errorLine = null;
+
+  function markSyntaxError(err, lineOffset) {
+    if (errorLine !== null) cm.removeLineClass(errorLine, 'background', 'cm-error-line');
+    errorLine = null;
+    if (!err || !err.line || lineOffset === null) return;
+    errorLine = cm.getLineHandle(lineOffset + err.line - 1);
+    if (!errorLine) return;
+    cm.addLineClass(errorLine, 'background', 'cm-error-line');
+    cm.setCursor({ line: lineOffset + err.line - 1, ch: Math.max(0, (err.column || 1) - 1) });
+  }
+
   function runCode() {
-    const code  = cm.getValue();
+    runSource(cm.getValue(), 0);
+  }
+
+  // lineOffset: where *code* starts in the editor (null if it isn't a line range)
+  function runSource(code, lineOffset) {
     const stdin = stdinEl ? stdinEl.value : '';
+    markSyntaxError(null, null);
 
     if (!code.trim()) {
       outputEl.textContent = '(nothing to run)';
@@ -148,13 +220,16 @@
 
     const t0 = Date.now();
 
-    fetch('/editor/run', {
+    fetch(kernelMode ? '/editor/kernel/run' : '/editor/run', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ code, stdin }),
     })
       .then(res => {
-        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        // Kernel errors (busy, no free slot) come back as JSON with a message.
+        if (!res.ok && !(res.headers.get('Content-Type') || '').includes('json')) {
+          throw new Error(`HTTP ${res.status}`);
+        }
         return res.json();
       })
       .then(data => {
@@ -164,6 +239,9 @@
           outputEl.classList.add('has-error');
         } else {
           showOutput(data.stdout, data.stderr, data.exit_code, elapsed);
+          showImages(data.display);
+          markSyntaxError(data.syntax_error, lineOffset);
+          if (kernelMode && 'execution_count' in data) showExecutionCount(data.execution_count);
         }
       })
       .catch(err => {
@@ -173,6 +251,67 @@
       .finally(() => setRunning(false));
   }
 
+  // ── Kernel mode ───────────────────────────────────────────────────────────
+  const CELL_MARKER = /^#\s*%%/;
+
+  function dedent(text) {
+    const lines = text.split('\n');
+    const indents = lines.filter(l => l.trim()).map(l => l.match(/^[ \t]*/)[0].length);
+    const strip = indents.length ? Math.min(...indents) : 0;
+    return lines.map(l => l.slice(strip)).join('\n');
+  }
+
+  // Cells are the blocks between lines starting with "# %%".
+  function runCell() {
+    const line = cm.getCursor().line;
+    let start = line, end = line;
+    while (start > 0 && !CELL_MARKER.test(cm.getLine(start))) start--;
+    while (end + 1 < cm.lineCount() && !CELL_MARKER.test(cm.getLine(end + 1))) end++;
+    runSource(cm.getRange({ line: start, ch: 0 }, { line: end, ch: cm.getLine(end).length }), start);
+    if (end + 1 < cm.lineCount()) cm.setCursor({ line: end + 1, ch: 0 });
+  }
+
+  function runSelection() {
+    const code = cm.somethingSelected() ? cm.getSelection() : cm.getLine(cm.getCursor().line);
+    runSource(dedent(code), null);
+  }
+
+  function showExecutionCount(count) {
+    if (!kernelCount) return;
+    kernelCount.textContent = count ? `[${count}]` : '';
+    kernelCount.classList.toggle('d-none', !count);
+  }
+
+  function setKernelMode(on) {
+    kernelMode = on;
+    localStorage.setItem('editor-kernel', on ? '1' : '0');
+    if (kernelControls) kernelControls.classList.toggle('d-none', !on);
+    document.querySelectorAll('.kernel-only').forEach(el => el.classList.toggle('d-none', !on));
+  }
+
+  if (kernelToggle) {
+    kernelToggle.checked = localStorage.getItem('editor-kernel') === '1';
+    setKernelMode(kernelToggle.checked);
+    kernelToggle.addEventListener('change', () => setKernelMode(kernelToggle.checked));
+  }
+
+  if (kernelInterruptBtn) kernelInterruptBtn.addEventListener('click', () => {
+    fetch('/editor/kernel/interrupt', { method: 'POST' }).catch(() => {});
+  });
+
+  if (kernelRestartBtn) kernelRestartBtn.addEventListener('click', () => {
+    fetch('/editor/kernel/restart', { method: 'POST' })
+      .then(() => {
+        showExecutionCount(0);
+        outputEl.textContent = 'Kernel restarted; variables cleared.';
+        outputEl.classList.remove('has-error');
+      })
+      .catch(() => {});
+  });
+
+  if (runCellBtn) runCellBtn.addEventListener('click', (e) => { e.preventDefault(); runCell(); });
+  if (runSelectionBtn) runSelectionBtn.addEventListener('click', (e) => { e.preventDefault(); runSelection(); });
+
   // ── Snippet management ────────────────────────────────────────────────────
   function openSaveModal(id, title) {
     if (!snippetModal) return;
@@ -183,12 +322,67 @@
     setTimeout(() => modalTitle.focus(), 300);
   }
 
+  // Ctrl-S saves a loaded snippet in place; otherwise it asks for a name.
   function saveCurrentSnippet() {
     const name = snippetNameEl ? snippetNameEl.textContent.replace('.py', '') : '';
-    openSaveModal(currentSnippetId, name === 'main' ? '' : name);
+    if (!currentSnippetId) {
+      openSaveModal(null, name === 'main' ? '' : name);
+      return;
+    }
+    if (runStatus) runStatus.textContent = 'Saving…';
+    saveSnippet(currentSnippetId, name)
+      .then(data => { if (runStatus) runStatus.textContent = `Saved v${data.version}`; })
+      .catch(err => { if (runStatus) runStatus.textContent = err.message; });
+  }
+
+  // One hunk from the end of the common prefix to the start of the common suffix.
+  function diffHunks(base, text) {
+    const max = Math.min(base.length, text.length);
+    let start = 0;
+    while (start < max && base.charCodeAt(start) === text.charCodeAt(start)) start++;
+    let end = 0;
+    while (end < max - start &&
+           base.charCodeAt(base.length - 1 - end) === text.charCodeAt(text.length - 1 - end)) end++;
+    if (start === base.length && start === text.length) return [];
+    return [[start, base.length - end, text.slice(start, text.length - end)]];
+  }
+
+  // full: send the whole text, against baseVersion (if any) rather than a patch
+  function saveSnippet(id, title, full = false, baseVersion = null) {
+    const code = cm.getValue();
+    const body = { id: id || null, title };
+    if (!full && id && id === currentSnippetId && savedVersion !== null) {
+      Object.assign(body, { base_version: savedVersion, patch: diffHunks(savedText, code), length: code.length });
+    } else {
+      body.code = code;
+      if (baseVersion !== null) body.base_version = baseVersion;
+    }
+    return fetch('/editor/snippets', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(body),
+    })
+      .then(r => r.json().then(data => ({ status: r.status, data })))
+      .then(({ status, data }) => {
+        if (status === 409 && body.patch && data.version === undefined) {
+          return saveSnippet(id, title, true, savedVersion);   // our base text was off; resend it all
+        }
+        if (status === 409 && data.version !== undefined &&
+            confirm(`${data.error}\nOverwrite it with the code in the editor?`)) {
+          return saveSnippet(id, title, true, data.version);
+        }
+        if (data.error) throw new Error(data.error);
+        setCurrentSnippet(data.id, data.title, data.version, code);
+        refreshSnippetList();
+        return data;
+      });
   }
 
-  if (saveSnippetBtn) saveSnippetBtn.addEventListener('click', (e) => { e.preventDefault(); saveCurrentSnippet(); });
+  if (saveSnippetBtn) saveSnippetBtn.addEventListener('click', (e) => {
+    e.preventDefault();
+    const name = snippetNameEl ? snippetNameEl.textContent.replace('.py', '') : '';
+    openSaveModal(currentSnippetId, name === 'main' ? '' : name);
+  });
   if (newSnippetBtn)  newSnippetBtn.addEventListener('click',  () => openSaveModal(null, ''));
 
   if (modalSaveBtn) {
@@ -202,29 +396,12 @@
       modalSaveBtn.disabled = true;
       modalSaveBtn.textContent = 'Saving…';
 
-      fetch('/editor/snippets', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          id: modalSnippetId.value || null,
-          title: title,
-          code: cm.getValue(),
-        }),
-      })
-        .then(r => r.json())
-        .then(data => {
-          if (data.error) {
-            modalError.textContent = data.error;
-            modalError.classList.remove('d-none');
-          } else {
-            currentSnippetId = data.id;
-            if (snippetNameEl) snippetNameEl.textContent = title + '.py';
-            snippetModal.hide();
-            refreshSnippetList();
-          }
+      saveSnippet(Number(modalSnippetId.value) || null, title)
+        .then(() => {
+          snippetModal.hide();
         })
         .catch(err => {
-          modalError.textContent = `Error: ${err.message}`;
+          modalError.textContent = err.message;
           modalError.classList.remove('d-none');
         })
         .finally(() => {
@@ -234,6 +411,74 @@
     });
   }
 
+  // ── Snippet history ───────────────────────────────────────────────────────
+  const historyModalEl = document.getElementById('snippetHistoryModal');
+  const historyModal   = historyModalEl ? new bootstrap.Modal(historyModalEl) : null;
+  const historyList    = document.getElementById('snippet-history-list');
+  const historyBtn     = document.getElementById('snippet-history-btn');
+
+  function showSnippetHistory() {
+    if (!historyModal) return;
+    if (!currentSnippetId) {
+      alert('Load or save a snippet first.');
+      return;
+    }
+    const id = currentSnippetId;
+    historyList.innerHTML = '<div class="text-secondary small p-3">Loading…</div>';
+    historyModal.show();
+    fetch(`/editor/snippets/${id}/versions`)
+      .then(r => r.json())
+      .then(data => {
+        if (!data.versions || !data.versions.length) {
+          historyList.innerHTML = '<div class="text-secondary small p-3">No saved versions yet.</div>';
+          return;
+        }
+        historyList.innerHTML = data.versions.map(v => `
+          <div class="d-flex align-items-center justify-content-between px-3 py-2 border-bottom border-secondary">
+            <span class="small">
+              <span class="font-monospace">v${v.version}</span>
+              <span class="text-secondary ms-2">${new Date(v.created_at + 'Z').toLocaleString()}</span>
+              <span class="text-secondary ms-2">${v.size} chars</span>
+              ${v.head ? '<span class="badge bg-success ms-2">current</span>' : ''}
+            </span>
+            ${v.head ? '' : `
+            <span class="d-flex gap-1">
+              <button class="btn btn-sm py-0 px-2 btn-outline-secondary view-version" data-version="${v.version}">View</button>
+              <button class="btn btn-sm py-0 px-2 btn-outline-warning restore-version" data-version="${v.version}">Restore</button>
+            </span>`}
+          </div>`).join('');
+        historyList.querySelectorAll('.view-version').forEach(btn => btn.addEventListener('click', () => {
+          fetch(`/editor/snippets/${id}/versions/${btn.dataset.version}`)
+            .then(r => r.json())
+            .then(v => {
+              if (v.error) throw new Error(v.error);
+              // Viewing detaches the editor from the snippet so Ctrl-S can't overwrite it by accident.
+              cm.setValue(v.code);
+              setCurrentSnippet(null);
+              historyModal.hide();
+            })
+            .catch(err => alert(err.message));
+        }));
+        historyList.querySelectorAll('.restore-version').forEach(btn => btn.addEventListener('click', () => {
+          fetch(`/editor/snippets/${id}/versions/${btn.dataset.version}/restore`, { method: 'POST' })
+            .then(r => r.json())
+            .then(v => {
+              if (v.error) throw new Error(v.error);
+              const title = snippetNameEl ? snippetNameEl.textContent.replace('.py', '') : '';
+              cm.setValue(v.code);
+              setCurrentSnippet(v.id, title, v.version, v.code);
+              refreshSnippetList();
+              if (runStatus) runStatus.textContent = v.message;
+              historyModal.hide();
+            })
+            .catch(err => alert(err.message));
+        }));
+      })
+      .catch(err => { historyList.textContent = err.message; });
+  }
+
+  if (historyBtn) historyBtn.addEventListener('click', (e) => { e.preventDefault(); showSnippetHistory(); });
+
   function escHtml(s) {
     return s
       .replace(/&/g, '&amp;')
@@ -243,35 +488,77 @@
       .replace(/'/g, '&#39;');
   }
 
+  // The sidebar's snippets, most recently saved first. They are kept current
+  // from the server's changes feed, so a refresh that finds nothing new is a 304.
+  const SIDEBAR_SNIPPETS = 50;
+  const snippetListEl = document.getElementById('snippet-list');
+  let snippetVersion = snippetListEl ? Number(snippetListEl.dataset.version || 0) : 0;
+  let snippetItems = snippetListEl
+    ? Array.from(snippetListEl.querySelectorAll('.snippet-item'))
+        .map(el => ({ id: Number(el.dataset.id), title: el.textContent.trim() }))
+    : [];
+
+  function renderSnippetList() {
+    if (!snippetListEl) return;
+    if (snippetItems.length === 0) {
+      snippetListEl.innerHTML = '<div class="text-secondary text-center py-4 small"><i class="bi bi-bookmark fs-3 d-block mb-1 opacity-25"></i>No snippets yet.</div>';
+      return;
+    }
+    snippetListEl.innerHTML = snippetItems.map(s => `
+      <div class="snippet-item rounded px-2 py-1 d-flex align-items-center justify-content-between" data-id="${s.id}">
+        <span class="small text-truncate text-light" style="max-width:160px">
+          <i class="bi bi-file-earmark-code me-1 text-success opacity-75"></i>${escHtml(s.title)}
+        </span>
+        <div class="d-flex gap-1">
+          <button class="btn btn-sm py-0 px-1 btn-outline-secondary load-snippet" data-id="${s.id}" title="Load">
+            <i class="bi bi-arrow-up-right" style="font-size:.7rem"></i>
+          </button>
+          <button class="btn btn-sm py-0 px-1 btn-outline-danger delete-snippet" data-id="${s.id}" title="Delete">
+            <i class="bi bi-trash" style="font-size:.7rem"></i>
+          </button>
+        </div>
+      </div>`).join('');
+    attachSnippetListeners();
+  }
+
+  function reloadSnippetList() {
+    return fetch(`/editor/snippets?fields=title&limit=${SIDEBAR_SNIPPETS}`)
+      .then(r => r.json())
+      .then(data => {
+        snippetItems = data.items;
+        snippetVersion = data.version;
+        renderSnippetList();
+      });
+  }
+
   function refreshSnippetList() {
-    fetch('/editor/snippets')
+    if (!snippetListEl) return Promise.resolve();
+    return fetch(`/editor/snippets?since=${snippetVersion}&fields=title`)
       .then(r => r.json())
-      .then(snippets => {
-        const list = document.getElementById('snippet-list');
-        if (!list) return;
-        if (snippets.length === 0) {
-          list.innerHTML = '<div class="text-secondary text-center py-4 small"><i class="bi bi-bookmark fs-3 d-block mb-1 opacity-25"></i>No snippets yet.</div>';
-          return;
-        }
-        list.innerHTML = snippets.map(s => `
-          <div class="snippet-item rounded px-2 py-1 d-flex align-items-center justify-content-between" data-id="${s.id}">
-            <span class="small text-truncate text-light" style="max-width:160px">
-              <i class="bi bi-file-earmark-code me-1 text-success opacity-75"></i>${escHtml(s.title)}
-            </span>
-            <div class="d-flex gap-1">
-              <button class="btn btn-sm py-0 px-1 btn-outline-secondary load-snippet" data-id="${s.id}" title="Load">
-                <i class="bi bi-arrow-up-right" style="font-size:.7rem"></i>
-              </button>
-              <button class="btn btn-sm py-0 px-1 btn-outline-danger delete-snippet" data-id="${s.id}" title="Delete">
-                <i class="bi bi-trash" style="font-size:.7rem"></i>
-              </button>
-            </div>
-          </div>`).join('');
-        attachSnippetListeners();
+      .then(data => {
+        if (data.reset) return reloadSnippetList();
+        const full = snippetItems.length >= SIDEBAR_SNIPPETS;
+        let removed = false;
+        data.changes.forEach(c => {
+          snippetItems = snippetItems.filter(s => s.id !== c.id);
+          if (c.deleted) removed = true;
+          else snippetItems.unshift(c);
+        });
+        snippetVersion = data.version;
+        // A full list that lost an item may have more to show: fetch it again.
+        if (removed && full) return reloadSnippetList();
+        snippetItems = snippetItems.slice(0, SIDEBAR_SNIPPETS);
+        if (data.changes.length) renderSnippetList();
+        if (data.more) return refreshSnippetList();
       })
       .catch(() => {});
   }
 
+  // Pick up saves made in other tabs when coming back to this one.
+  document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'visible') refreshSnippetList();
+  });
+
   function attachSnippetListeners() {
     document.querySelectorAll('.load-snippet').forEach(btn => {
       btn.addEventListener('click', () => {
@@ -279,8 +566,7 @@
           .then(r => r.json())
           .then(data => {
             cm.setValue(data.code);
-            currentSnippetId = data.id;
-            if (snippetNameEl) snippetNameEl.textContent = data.title + '.py';
+            setCurrentSnippet(data.id, data.title, data.version, cm.getValue());
             cm.focus();
           });
       });
@@ -305,8 +591,7 @@
         .then(data => {
           cm.setValue(data.code);
           if (stdinEl) stdinEl.value = data.stdin || '';
-          if (snippetNameEl) snippetNameEl.textContent = 'main.py';
-          currentSnippetId = null;
+          setCurrentSnippet(null);
           cm.focus();
         });
     });
@@ -331,8 +616,7 @@
   if (clearBtn) clearBtn.addEventListener('click', (e) => {
     e.preventDefault();
     cm.setValue('');
-    currentSnippetId = null;
-    if (snippetNameEl) snippetNameEl.textContent = 'main.py';
+    setCurrentSnippet(null);
     cm.focus();
   });
 
@@ -0,0 +1,71 @@
+"""
+Per-user dashboard aggregates.
+
+The dashboard used to issue one ``count()`` per table plus a history query
+on every load. The aggregates are now fetched in a single statement and
+kept in a TTL cache; blueprints that change a user's files, sessions,
+snippets or runs call :func:`invalidate_user_stats` after committing,
+which also drops the user's cached page fragments.
+"""
+from sqlalchemy import func, select
+from chatcore.cache import TTLCache
+from chatcore import fragments
+from . import db
+from .models import HostedFile, ChatSession, CodeSnippet, RunHistory, human_size
+
+STATS_CACHE_TTL = 300   # seconds
+RECENT_RUNS = 5
+
+_stats_cache = TTLCache(ttl=STATS_CACHE_TTL)
+
+
+def _count(model, user_id):
+    return (select(func.count(model.id))
+            .where(model.user_id == user_id)
+            .scalar_subquery())
+
+
+def _compute_user_stats(user_id):
+    storage = (select(func.coalesce(func.sum(HostedFile.size), 0))
+               .where(HostedFile.user_id == user_id)
+               .scalar_subquery())
+    file_count, session_count, snippet_count, storage_bytes = db.session.execute(
+        select(_count(HostedFile, user_id),
+               _count(ChatSession, user_id),
+               _count(CodeSnippet, user_id),
+               storage)
+    ).one()
+
+    runs = db.session.execute(
+        select(RunHistory.id, func.substr(RunHistory.code, 1, 120),
+               RunHistory.exit_code, RunHistory.ran_at)
+        .where(RunHistory.user_id == user_id)
+        .order_by(RunHistory.ran_at.desc())
+        .limit(RECENT_RUNS)
+    ).all()
+
+    return {
+        'file_count': file_count,
+        'session_count': session_count,
+        'snippet_count': snippet_count,
+        'storage_bytes': storage_bytes,
+        'storage_human': human_size(storage_bytes),
+        'recent_runs': [
+            {'id': r[0], 'code': r[1], 'exit_code': r[2], 'ran_at': r[3]}
+            for r in runs
+        ],
+    }
+
+
+def get_user_stats(user_id):
+    """Return the cached dashboard aggregates for *user_id*."""
+    stats = _stats_cache.get(user_id)
+    if stats is None:
+        stats = _compute_user_stats(user_id)
+        _stats_cache.set(user_id, stats)
+    return stats
+
+
+def invalidate_user_stats(user_id):
+    _stats_cache.pop(user_id)
+    fragments.bump(user_id)
@@ -0,0 +1,149 @@
+"""
+Compressed storage of hosted files.
+
+Uploads are written to ``UPLOAD_FOLDER`` as they stream in. Unless the
+name or type says the content is already compressed (images, archives,
+media, Parquet, …), the first chunk is test-compressed; text-like data —
+CSV, JSON, logs, notebooks — then goes through a zstd compressor (or gzip,
+see ``UPLOAD_COMPRESSION``) and the stored name gets ``.enc.zst``
+(``.enc.gz``).
+``HostedFile.size`` stays the size of the file as uploaded.
+
+Downloads of a compressed file are passed through as-is with a
+``Content-Encoding`` when the client accepts it, and otherwise decoded on
+the fly (:func:`send`). Everything else that reads stored files goes
+through :func:`open_decoded`. Files stored before compression existed have
+no suffix and are read as they are.
+"""
+import gzip
+import os
+import tempfile
+import warnings
+import zlib
+from flask import Response, request, send_file
+from . import metrics
+
+try:
+    import zstandard
+except ImportError:   # optional dependency
+    zstandard = None
+
+CHUNK = 1024 * 1024
+SAMPLE_RATIO = 0.8        # compress when the first chunk shrinks at least this much
+# Two dots: a stored name is a uuid plus at most one extension of the
+# user's, so an uploaded "data.gz" can't look like one we encoded.
+SUFFIXES = {'zstd': '.enc.zst', 'gzip': '.enc.gz'}
+COMPRESSED_EXTS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.heic', '.ico',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.whl', '.egg',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.epub',
+    '.mp3', '.mp4', '.m4a', '.ogg', '.webm', '.mov', '.mkv', '.flac',
+    '.woff', '.woff2', '.parquet', '.feather', '.npz', '.h5',
+}
+
+
+def init_app(app):
+    """Check ``UPLOAD_COMPRESSION``; zstd falls back to gzip without the zstandard package."""
+    method = app.config['UPLOAD_COMPRESSION']
+    if method not in ('zstd', 'gzip', 'none'):
+        raise ValueError(f'UPLOAD_COMPRESSION must be zstd, gzip or none, not {method!r}')
+    if method == 'zstd' and zstandard is None:
+        warnings.warn('UPLOAD_COMPRESSION is zstd but the zstandard package is not installed; '
+                      'falling back to gzip.', stacklevel=2)
+        app.config['UPLOAD_COMPRESSION'] = 'gzip'
+
+
+def encoding(filename):
+    """The ``Content-Encoding`` a stored file is in, or None."""
+    for name, suffix in SUFFIXES.items():
+        if filename.endswith(suffix):
+            return name
+    return None
+
+
+def _compressible(name, mimetype, sample):
+    if os.path.splitext(name)[1].lower() in COMPRESSED_EXTS:
+        return False
+    if (mimetype or '').split('/')[0] in ('video', 'audio'):
+        return False
+    return len(sample) > 512 and len(zlib.compress(sample, 1)) <= len(sample) * SAMPLE_RATIO
+
+
+def _compressor(method, f, level):
+    if method == 'zstd':
+        return zstandard.ZstdCompressor(level=level).stream_writer(f, closefd=False)
+    return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=level, mtime=0)
+
+
+def save(stream, folder, stored_name, original_name, mimetype, config):
+    """Write *stream* into *folder*; returns ``(stored name, size as uploaded)``.
+
+    The stored name is *stored_name* plus the suffix of the encoding used.
+    """
+    method = config['UPLOAD_COMPRESSION']
+    sample = stream.read(CHUNK)
+    if method != 'none' and _compressible(original_name, mimetype, sample):
+        stored_name += SUFFIXES[method]
+    else:
+        method = 'none'
+    fd, tmp = tempfile.mkstemp(dir=folder)
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if method == 'none':
+                out = f
+            else:
+                level = config['UPLOAD_ZSTD_LEVEL'] if method == 'zstd' else 6
+                out = _compressor(method, f, level)
+            chunk = sample
+            while chunk:
+                out.write(chunk)
+                size += len(chunk)
+                chunk = stream.read(CHUNK)
+            if out is not f:
+                out.close()
+        path = os.path.join(folder, stored_name)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    metrics.UPLOAD_BYTES.inc(size, stage='received')
+    metrics.UPLOAD_BYTES.inc(os.path.getsize(path), stage='stored')
+    return stored_name, size
+
+
+def open_decoded(path):
+    """*path* opened for reading its original bytes (not seekable when zstd-encoded)."""
+    method = encoding(path)
+    if method == 'zstd':
+        if zstandard is None:
+            raise RuntimeError(f'{path} is zstd-compressed but zstandard is not installed')
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    if method == 'gzip':
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _decoded_chunks(path):
+    with open_decoded(path) as f:
+        while chunk := f.read(CHUNK):
+            yield chunk
+
+
+def send(path, download_name, mimetype, size):
+    """Download response for the stored file at *path* (*size* bytes as uploaded)."""
+    method = encoding(path)
+    if method is None:
+        return send_file(path, mimetype=mimetype, as_attachment=True, download_name=download_name)
+    if request.accept_encodings[method]:
+        # The stored bytes are the response body; the client decodes them.
+        response = send_file(path, mimetype=mimetype, as_attachment=True,
+                             download_name=download_name)
+        response.headers['Content-Encoding'] = method
+    else:
+        response = Response(_decoded_chunks(path), mimetype=mimetype or 'application/octet-stream',
+                            direct_passthrough=True)
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+        response.content_length = size
+    response.vary.add('Accept-Encoding')
+    return response
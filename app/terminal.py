@@ -1,25 +1,85 @@
 """
 Web Terminal — xterm.js frontend + PTY backend via Flask-SocketIO.
 Each authenticated user gets their own sandboxed shell session.
+
+All PTYs are served by the selector loops in ``ptymux``; output is
+coalesced into frames (see ``ptyio``) and sent as binary Socket.IO events.
+The client acknowledges each frame once xterm.js has parsed it, and a PTY
+is paused while too many of its frames are unacknowledged.
+
+A shell outlives its socket: sessions are keyed by user plus a token the
+browser keeps in ``sessionStorage``, so a reload or network blip reattaches
+to the running shell and replays what was missed from a bounded scrollback
+buffer. Detached sessions are killed after an idle TTL, and both the
+per-user session count and the total scrollback memory are capped.
+
+Shells run under the limits in ``governor`` (rlimits, optional cgroup v2
+placement, idle throttling while detached).
+
+In a multi-node deployment a shell lives on one node. Session tokens start
+with the owning ``NODE_ID``; a socket that lands on the wrong node is told
+to set the ``pyhost_node`` routing cookie and reconnect, and the load
+balancer pins the request by that cookie. PTY traffic is emitted with
+``ignore_queue`` because the client is always connected to the owner.
 """
 import os
+import re
 import threading
-import ptyprocess
-from flask import Blueprint, render_template, request, redirect, url_for
+import time
+import uuid
+from flask import Blueprint, render_template, request, redirect, url_for, current_app, jsonify
 from flask_login import current_user
 from flask_socketio import SocketIO, emit
+from . import envs, governor, metrics, ptymux
+from .ptyio import FrameBuffer, FlowControl, Scrollback
 
 terminal_bp = Blueprint('terminal', __name__, url_prefix='/terminal')
 
 # socketio will be set by the app factory
 socketio = None
 
-PTY_READ_SIZE = 4096
+REAP_INTERVAL = 30   # seconds between idle-session sweeps
+TOKEN_RE = re.compile(r'([A-Za-z0-9]{1,32})-([0-9a-f]{32})')
+NODE_COOKIE = 'pyhost_node'
+
+
+class TerminalSession:
+    """A running shell, its scrollback and the socket currently attached to it.
+
+    ``lock`` orders scrollback appends against reattach replays, so a frame
+    is either part of the replay or sent live, never both.
+    """
+
+    def __init__(self, user_id, token, config):
+        self.user_id = user_id
+        self.token = token
+        self.config = config
+        self.scrollback = Scrollback(config['TERMINAL_SCROLLBACK_BYTES'])
+        self.idle_ttl = config['TERMINAL_IDLE_TTL']
+        self.lock = threading.Lock()
+        self.cgroup = None
+        self.meter = None
+        self.channel = None
+        self.sid = None
+        self.detached_at = time.monotonic()
 
-# Active PTY sessions: { sid -> PtyProcess }
+    @property
+    def key(self):
+        return (self.user_id, self.token)
+
+    @property
+    def proc(self):
+        return self.channel.proc if self.channel else None
+
+
+# Active sessions: { (user_id, token) -> TerminalSession }, plus { sid -> session }
 _sessions: dict = {}
+_by_sid: dict = {}
 _lock = threading.Lock()
 
+# cgroups of ended sessions, removed once their processes have exited
+_stale_cgroups: list = []
+
 
 def init_socketio(sio: SocketIO):
     global socketio
@@ -27,61 +87,195 @@ def init_socketio(sio: SocketIO):
     _register_events(sio)
 
 
+def start_background(loops=1):
+    """Start the PTY loops and the idle-session reaper in this process."""
+    ptymux.init_loops(loops)
+    socketio.start_background_task(_reap_idle_sessions)
+
+
+def _get_proc(sid):
+    with _lock:
+        session = _by_sid.get(sid)
+    return session.proc if session else None
+
+
+def _emit_local(event, payload, sid, callback=None):
+    # The client of a PTY is always connected to this node, so skip the queue.
+    socketio.emit(event, payload, to=sid, namespace='/terminal',
+                  callback=callback, ignore_queue=True)
+
+
+def _notice(sid, text):
+    _emit_local('terminal_notice', {'data': text}, sid)
+
+
+def _kill(session):
+    """Drop *session* from the registry and hang up its shell (caller holds _lock)."""
+    _sessions.pop(session.key, None)
+    if session.sid:
+        _by_sid.pop(session.sid, None)
+    if session.channel:
+        ptymux.detach(session.channel)
+    if session.cgroup:
+        _stale_cgroups.append(session.cgroup)
+
+
+def _make_room(user_id, config):
+    """Evict idle sessions until a new one fits; False if none can be evicted."""
+    per_user = config['TERMINAL_MAX_PER_USER']
+    max_total = max(1, config['TERMINAL_MEMORY_BUDGET'] // config['TERMINAL_SCROLLBACK_BYTES'])
+
+    def oldest_detached(candidates):
+        detached = [s for s in candidates if s.sid is None]
+        return min(detached, key=lambda s: s.detached_at) if detached else None
+
+    while True:
+        mine = [s for s in _sessions.values() if s.user_id == user_id]
+        if len(mine) >= per_user:
+            victim = oldest_detached(mine)
+        elif len(_sessions) >= max_total:
+            victim = oldest_detached(_sessions.values())
+        else:
+            return True
+        if victim is None:
+            return False
+        _kill(victim)
+
+
+def _spawn_shell(session):
+    import ptyprocess   # only needed once somebody opens a terminal
+    env = governor.shell_env()
+    env['TERM'] = 'xterm-256color'
+    env['PS1'] = r'\u@pyhost:\w\$ '
+    user_home = f'/tmp/pyhost_{current_user.id}'
+    os.makedirs(user_home, mode=0o700, exist_ok=True)
+    env['HOME'] = user_home
+    env['USER'] = current_user.username
+    env['LOGNAME'] = current_user.username
+    _, env = envs.activate(current_user.id, current_app.config, env)
+    return ptyprocess.PtyProcess.spawn(
+        ['/bin/bash', '--norc', '--noprofile'],
+        cwd=user_home,
+        env=env,
+        dimensions=(24, 80),
+        preexec_fn=governor.make_preexec(session.config, session.cgroup),
+    )
+
+
+def _start_session(token):
+    config = current_app.config
+    session = TerminalSession(current_user.id, token, config)
+    session.cgroup = governor.create_cgroup(config, f'term-{current_user.id}-{uuid.uuid4().hex[:12]}')
+    try:
+        proc = _spawn_shell(session)
+    except Exception:
+        governor.release_cgroup(session.cgroup)
+        raise
+    session.meter = governor.UsageMeter(proc.pid, session.cgroup)
+
+    frames = FrameBuffer(interval=config['TERMINAL_FRAME_INTERVAL'],
+                         max_bytes=config['TERMINAL_FRAME_BYTES'],
+                         binary=config['TERMINAL_BINARY_FRAMES'])
+    flow = FlowControl(max_inflight=config['TERMINAL_MAX_INFLIGHT'])
+
+    def on_frame(frame):
+        with session.lock:
+            session.scrollback.append(frame if frames.binary else frame.encode('utf-8'))
+            sid = session.sid
+        if sid is None:
+            flow.ack()   # nobody to wait for while detached
+            return
+        payload = frame if frames.binary else {'data': frame}
+        _emit_local('terminal_output', payload, sid, callback=flow.ack)
+
+    def on_exit():
+        with _lock:
+            sid = session.sid
+            _sessions.pop(session.key, None)
+            if sid:
+                _by_sid.pop(sid, None)
+            if session.cgroup:
+                _stale_cgroups.append(session.cgroup)
+        if sid:
+            _notice(sid, '\r\n[Session ended]\r\n')
+
+    session.channel = ptymux.Channel(proc, on_frame, on_exit, frames=frames, flow=flow)
+    return session
+
+
 def _register_events(sio: SocketIO):
 
     @sio.on('connect', namespace='/terminal')
-    def on_connect():
+    def on_connect(auth=None):
         if not current_user.is_authenticated:
             return False  # reject connection
         sid = request.sid
-
-        env = os.environ.copy()
-        env['TERM'] = 'xterm-256color'
-        env['PS1'] = r'\u@pyhost:\w\$ '
-        user_home = f'/tmp/pyhost_{current_user.id}'
-        os.makedirs(user_home, mode=0o700, exist_ok=True)
-        env['HOME'] = user_home
-        env['USER'] = current_user.username
-        env['LOGNAME'] = current_user.username
-
-        try:
-            proc = ptyprocess.PtyProcess.spawn(
-                ['/bin/bash', '--norc', '--noprofile'],
-                env=env,
-                dimensions=(24, 80),
-            )
-        except Exception as e:
-            emit('terminal_output', {'data': f'Error starting terminal: {e}\r\n'},
+        node_id = current_app.config['NODE_ID']
+        auth = auth if isinstance(auth, dict) else {}
+        token = str(auth.get('session') or '')
+        match = TOKEN_RE.fullmatch(token)
+        if match and match.group(1) != node_id:
+            # The shell lives on another node: send the client there.
+            emit('terminal_redirect', {'node': match.group(1), 'cookie': NODE_COOKIE},
                  namespace='/terminal')
             return
+        if not match:
+            token = f'{node_id}-{uuid.uuid4().hex}'
+        try:
+            offset = int(auth.get('offset'))
+        except (TypeError, ValueError):
+            offset = None
 
         with _lock:
-            _sessions[sid] = proc
-
-        def reader():
-            while True:
-                try:
-                    data = proc.read(PTY_READ_SIZE)
-                    sio.emit('terminal_output',
-                             {'data': data.decode('utf-8', errors='replace')},
-                             to=sid, namespace='/terminal')
-                except Exception:
-                    break
-            sio.emit('terminal_output', {'data': '\r\n[Session ended]\r\n'},
-                     to=sid, namespace='/terminal')
+            session = _sessions.get((current_user.id, token))
+            if session is not None:
+                if session.sid:
+                    # Same session opened elsewhere (e.g. duplicated tab): take it over.
+                    _by_sid.pop(session.sid, None)
+                    _notice(session.sid, '\r\n[Session attached elsewhere]\r\n')
+                _by_sid[sid] = session
+                resumed = True
+            elif not _make_room(current_user.id, current_app.config):
+                emit('terminal_notice', {'data': 'Too many open terminals. Close one and retry.\r\n'},
+                     namespace='/terminal')
+                return
+            else:
+                resumed = False
+
+        if not resumed:
+            try:
+                session = _start_session(token)
+            except Exception as e:
+                emit('terminal_notice', {'data': f'Error starting terminal: {e}\r\n'},
+                     namespace='/terminal')
+                return
             with _lock:
-                _sessions.pop(sid, None)
+                _sessions[session.key] = session
+                _by_sid[sid] = session
+            ptymux.attach(session.channel)
+            offset = None   # replay whatever the shell printed before we attached
 
-        t = threading.Thread(target=reader, daemon=True)
-        t.start()
+        # Replay what the client missed, then switch to live frames.
+        with session.lock:
+            replay = session.scrollback.since(offset)
+            emit('terminal_attached', {'session': token, 'resumed': resumed,
+                                       'offset': session.scrollback.end - len(replay)},
+                 namespace='/terminal', ignore_queue=True)
+            if replay:
+                emit('terminal_output',
+                     replay if session.channel.frames.binary
+                     else {'data': replay.decode('utf-8', 'replace')},
+                     namespace='/terminal', ignore_queue=True)
+            session.sid = sid
+            session.detached_at = None
+        if resumed:
+            governor.set_idle(session.cgroup, False, session.config)
 
     @sio.on('terminal_input', namespace='/terminal')
     def on_input(data):
         if not current_user.is_authenticated:
             return
-        sid = request.sid
-        with _lock:
-            proc = _sessions.get(sid)
+        proc = _get_proc(request.sid)
         if proc and proc.isalive():
             try:
                 proc.write(data.get('data', '').encode('utf-8', errors='replace'))
@@ -92,9 +286,7 @@ def _register_events(sio: SocketIO):
     def on_resize(data):
         if not current_user.is_authenticated:
             return
-        sid = request.sid
-        with _lock:
-            proc = _sessions.get(sid)
+        proc = _get_proc(request.sid)
         if proc and proc.isalive():
             try:
                 rows = int(data.get('rows', 24))
@@ -103,20 +295,76 @@ def _register_events(sio: SocketIO):
             except Exception:
                 pass
 
+    @sio.on('terminal_usage', namespace='/terminal')
+    def on_usage():
+        """Ack with the shell's CPU %, memory and process count."""
+        with _lock:
+            session = _by_sid.get(request.sid)
+        if session is None or session.meter is None:
+            return None
+        try:
+            return session.meter.sample()
+        except OSError:
+            return None
+
+    @sio.on('terminal_kill', namespace='/terminal')
+    def on_kill():
+        with _lock:
+            session = _by_sid.get(request.sid)
+            if session:
+                _kill(session)
+        if session:
+            emit('terminal_notice', {'data': '\r\n[Session closed]\r\n'}, namespace='/terminal')
+
     @sio.on('disconnect', namespace='/terminal')
     def on_disconnect():
-        sid = request.sid
+        # Keep the shell running; it can be reattached until the idle TTL expires.
         with _lock:
-            proc = _sessions.pop(sid, None)
-        if proc and proc.isalive():
-            try:
-                proc.terminate(force=True)
-            except Exception:
-                pass
+            session = _by_sid.pop(request.sid, None)
+        if session is None:
+            return
+        with session.lock:
+            if session.sid == request.sid:
+                session.sid = None
+                session.detached_at = time.monotonic()
+        session.channel.flow.reset()
+        governor.set_idle(session.cgroup, True, session.config)
+
+
+def _reap_idle_sessions():
+    while True:
+        socketio.sleep(REAP_INTERVAL)
+        now = time.monotonic()
+        with _lock:
+            for session in list(_sessions.values()):
+                if session.sid is None and now - session.detached_at > session.idle_ttl:
+                    _kill(session)
+            _stale_cgroups[:] = [cg for cg in _stale_cgroups if not governor.release_cgroup(cg)]
+
+
+def session_stats():
+    with _lock:
+        sessions = list(_sessions.values())
+    return {
+        'retained': len(sessions),
+        'attached': sum(1 for s in sessions if s.sid),
+        'scrollback_bytes': sum(len(s.scrollback) for s in sessions),
+    }
 
 
 @terminal_bp.route('/')
 def index():
     if not current_user.is_authenticated:
         return redirect(url_for('auth.login'))
-    return render_template('terminal/index.html')
+    response = current_app.make_response(render_template('terminal/index.html'))
+    if request.cookies.get(NODE_COOKIE) is None:
+        response.set_cookie(NODE_COOKIE, current_app.config['NODE_ID'], samesite='Lax')
+    return response
+
+
+@terminal_bp.route('/stats')
+def stats():
+    """Multiplexer load and retained-session counts for this node (guarded like /metrics)."""
+    metrics.require_scraper()
+    return jsonify({'node': current_app.config['NODE_ID'],
+                    **ptymux.stats(), **session_stats()})
@@ -0,0 +1,167 @@
+"""
+Snippet version history with delta saves.
+
+The editor saves a snippet by sending a patch against the version it last
+loaded or saved: ``[[start, end, text], ...]`` replacing ``base[start:end]``,
+with offsets in UTF-16 code units (JavaScript string indices) and the
+length of the result as a check. A patch against anything but the current
+head is a conflict, so two tabs cannot silently overwrite each other.
+
+Every save adds a :class:`~app.models.SnippetVersion`. The head row has no
+data — the code lives in ``CodeSnippet.code`` as before — and when a new
+version arrives the previous head is turned into a reverse line delta (new
+→ old), or into a full checkpoint every :data:`CHECKPOINT_EVERY` versions,
+so reading an old version applies at most that many deltas. Only the
+newest :data:`MAX_VERSIONS` are kept.
+"""
+import difflib
+import json
+from sqlalchemy import func
+from . import db
+from .models import SnippetVersion
+
+CHECKPOINT_EVERY = 20
+MAX_VERSIONS = 200
+
+
+class PatchError(ValueError):
+    """The patch does not apply to the base text."""
+
+
+class VersionConflict(Exception):
+    """The patch was made against a version that is no longer the head."""
+
+    def __init__(self, head):
+        super().__init__(f'The snippet was saved elsewhere; it is now at version {head}.')
+        self.head = head
+
+
+# ── Patches and deltas ────────────────────────────────────────────────────────
+
+def apply_patch(base, patch, length):
+    """*base* with *patch* applied; raises PatchError if it does not fit."""
+    units = base.encode('utf-16-le', 'surrogatepass')
+    out, pos = [], 0
+    try:
+        for start, end, text in patch:
+            if not (isinstance(start, int) and isinstance(end, int) and isinstance(text, str)) \
+                    or not pos <= start <= end <= len(units) // 2:
+                raise PatchError('Hunks must be in order and inside the text.')
+            out += [units[pos * 2:start * 2], text.encode('utf-16-le', 'surrogatepass')]
+            pos = end
+    except (TypeError, ValueError) as exc:
+        raise PatchError(str(exc) or 'Malformed patch.')
+    out.append(units[pos * 2:])
+    result = b''.join(out)
+    if len(result) // 2 != length:
+        raise PatchError('Patched text has the wrong length.')
+    return result.decode('utf-16-le', 'surrogatepass')
+
+
+def reverse_delta(new, old):
+    """JSON ops that turn *new* back into *old*: ``[[i1, i2, old_text], ...]`` on new's lines."""
+    new_lines, old_lines = new.splitlines(True), old.splitlines(True)
+    matcher = difflib.SequenceMatcher(None, new_lines, old_lines, autojunk=False)
+    ops = [[i1, i2, ''.join(old_lines[j1:j2])]
+           for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+    return json.dumps(ops, separators=(',', ':'))
+
+
+def apply_delta(new, delta):
+    lines = new.splitlines(True)
+    for i1, i2, text in reversed(json.loads(delta)):
+        lines[i1:i2] = text.splitlines(True)
+    return ''.join(lines)
+
+
+# ── History ───────────────────────────────────────────────────────────────────
+
+def _head_row(snippet):
+    return snippet.versions.filter_by(kind='head').order_by(SnippetVersion.version.desc()).first()
+
+
+def head_version(snippet):
+    """The snippet's current version number, without writing anything."""
+    row = _head_row(snippet)
+    if row is not None:
+        return row.version
+    latest = db.session.query(func.max(SnippetVersion.version)) \
+        .filter_by(snippet_id=snippet.id).scalar() or 0
+    return latest + 1
+
+
+def check(snippet, base_version):
+    """The head row; raises VersionConflict unless *base_version* is None or the head.
+
+    Snippets saved before versioning get their head row here.
+    """
+    row = _head_row(snippet)
+    if row is None:
+        row = SnippetVersion(snippet=snippet, version=head_version(snippet), kind='head',
+                             size=len(snippet.code or ''))
+        db.session.add(row)
+    if base_version is not None and base_version != row.version:
+        raise VersionConflict(row.version)
+    return row
+
+
+def save(snippet, code, base_version=None):
+    """Make *code* the snippet's new head; returns the head version.
+
+    Raises VersionConflict if *base_version* is given and is not the head.
+    An unchanged text adds no version.
+    """
+    if snippet.id is None:
+        snippet.code = code
+        db.session.add(snippet)
+        db.session.flush()
+    current = check(snippet, base_version)
+    old = snippet.code or ''
+    if code == old:
+        return current.version
+    if current.version % CHECKPOINT_EVERY == 0:
+        current.kind, current.data = 'full', old
+    else:
+        delta = reverse_delta(code, old)
+        current.kind, current.data = ('delta', delta) if len(delta) < len(old) else ('full', old)
+    snippet.code = code
+    version = current.version + 1
+    db.session.add(SnippetVersion(snippet=snippet, version=version, kind='head', size=len(code)))
+    if version > MAX_VERSIONS:
+        snippet.versions.filter(SnippetVersion.version <= version - MAX_VERSIONS) \
+            .delete(synchronize_session=False)
+    return version
+
+
+def content(snippet, version):
+    """The snippet's code as of *version*, or None if that version is not kept."""
+    current = head_version(snippet)
+    if version == current:
+        return snippet.code
+    if version > current or snippet.versions.filter_by(version=version).count() == 0:
+        return None
+    checkpoint = snippet.versions.filter(SnippetVersion.kind == 'full',
+                                         SnippetVersion.version >= version) \
+        .order_by(SnippetVersion.version).first()
+    if checkpoint is not None and checkpoint.version == version:
+        return checkpoint.data
+    if checkpoint is not None:
+        text, upper = checkpoint.data, checkpoint.version
+    else:
+        text, upper = snippet.code, current
+    rows = snippet.versions.filter(SnippetVersion.version >= version,
+                                   SnippetVersion.version < upper) \
+        .order_by(SnippetVersion.version.desc())
+    for row in rows:
+        text = row.data if row.kind == 'full' else apply_delta(text, row.data)
+    return text
+
+
+def history(snippet, limit=MAX_VERSIONS):
+    """Kept versions, newest first, without their data."""
+    rows = db.session.query(SnippetVersion.version, SnippetVersion.kind, SnippetVersion.size,
+                            SnippetVersion.created_at) \
+        .filter_by(snippet_id=snippet.id).order_by(SnippetVersion.version.desc()).limit(limit)
+    return [{'version': version, 'head': kind == 'head', 'checkpoint': kind == 'full',
+             'size': size, 'created_at': created_at.isoformat()}
+            for version, kind, size, created_at in rows]
@@ -0,0 +1,185 @@
+"""
+Micro-benchmarks for the hot paths, run with pytest-benchmark.
+
+    pip install pytest-benchmark
+    pytest benchmarks/bench_micro.py --benchmark-save=base     # on the old commit
+    pytest benchmarks/bench_micro.py --benchmark-compare \
+        --benchmark-compare-fail=median:20% --benchmark-json=micro.json
+
+"cold" variants drop the relevant cache before every round; "warm" ones
+measure the cached path.
+"""
+import pytest
+
+SEED_FILES = 50
+SEED_SNIPPETS = 50
+SEED_SESSIONS = 20
+SEED_RUNS = 20
+SEED_PROMPTS = 10
+
+
+# ── Editor ────────────────────────────────────────────────────────────────────
+
+def test_run_code(benchmark, client):
+    resp = benchmark(client.post, '/editor/run', json={'code': 'print(sum(range(1000)))'})
+    assert resp.get_json()['stdout'] == '499500\n'
+
+
+def test_run_syntax_error(benchmark, client):
+    """Rejected by the in-process pre-flight compile; no subprocess."""
+    resp = benchmark(client.post, '/editor/run', json={'code': 'print("unclosed"'})
+    assert resp.get_json()['syntax_error']['line'] == 1
+
+
+def test_run_batch(benchmark, client):
+    """100 stdin/expected cases in one request."""
+    cases = [{'stdin': f'{i}\n', 'expected': f'{i * i}\n'} for i in range(100)]
+    resp = benchmark(client.post, '/editor/run/batch',
+                     json={'code': 'n = int(input())\nprint(n * n)\n', 'cases': cases})
+    assert resp.get_json()['passed'] == 100
+
+
+def test_kernel_run(benchmark, client):
+    """A cell in a warm kernel that reuses state from an earlier cell."""
+    client.post('/editor/kernel/run', json={'code': 'data = list(range(100000))'})
+    resp = benchmark(client.post, '/editor/kernel/run', json={'code': 'sum(data)'})
+    client.post('/editor/kernel/restart')
+    assert resp.get_json()['stdout'] == '4999950000\n'
+
+
+def test_prune_run_history(benchmark, pyhost, pyhost_user):
+    from app import db
+    from app.editor import MAX_HISTORY, prune_run_history
+    from app.models import RunHistory
+
+    def add_runs():
+        db.session.add_all(RunHistory(user_id=pyhost_user, code='print(1)', exit_code=0)
+                           for _ in range(5))
+        db.session.commit()
+
+    def prune():
+        prune_run_history(pyhost_user)
+        db.session.commit()
+
+    with pyhost.app_context():
+        benchmark.pedantic(prune, setup=add_runs, rounds=100)
+        assert RunHistory.query.filter_by(user_id=pyhost_user).count() == MAX_HISTORY
+
+
+# ── Dashboard ─────────────────────────────────────────────────────────────────
+
+@pytest.fixture(scope='module')
+def seeded_user(pyhost, pyhost_user):
+    from app import db
+    from app.models import ChatSession, CodeSnippet, HostedFile, RunHistory
+    with pyhost.app_context():
+        db.session.add_all(HostedFile(user_id=pyhost_user, filename=f'{i}.bin', original_name=f'{i}.bin',
+                                      size=1024 * i, mimetype='application/octet-stream')
+                           for i in range(SEED_FILES))
+        db.session.add_all(CodeSnippet(user_id=pyhost_user, title=f'snippet {i}', code='print(1)\n' * 20)
+                           for i in range(SEED_SNIPPETS))
+        db.session.add_all(ChatSession(user_id=pyhost_user, model_name='gpt-4o', title=f'chat {i}')
+                           for i in range(SEED_SESSIONS))
+        db.session.add_all(RunHistory(user_id=pyhost_user, code='print(1)\n' * 20, exit_code=0)
+                           for _ in range(SEED_RUNS))
+        db.session.commit()
+    return pyhost_user
+
+
+def test_dashboard_stats_cold(benchmark, pyhost, seeded_user):
+    from app.stats import get_user_stats, invalidate_user_stats
+    with pyhost.app_context():
+        stats = benchmark.pedantic(get_user_stats, args=(seeded_user,),
+                                   setup=lambda: invalidate_user_stats(seeded_user), rounds=200)
+    assert stats['file_count'] >= SEED_FILES
+
+
+def test_dashboard_stats_warm(benchmark, pyhost, seeded_user):
+    from app.stats import get_user_stats
+    with pyhost.app_context():
+        get_user_stats(seeded_user)
+        benchmark(get_user_stats, seeded_user)
+
+
+def test_dashboard_page(benchmark, client, seeded_user):
+    resp = benchmark(client.get, '/dashboard')
+    assert resp.status_code == 200
+
+
+# ── Page rendering ────────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize('path', ['/ai/', '/editor/'])
+def test_page_cold(benchmark, pyhost, client, seeded_user, path):
+    """Sidebar fragments re-rendered (and re-queried) on every request."""
+    from chatcore import fragments
+
+    def bump():
+        with pyhost.app_context():
+            fragments.bump(seeded_user)
+
+    resp = benchmark.pedantic(client.get, args=(path,), setup=bump, rounds=100)
+    assert resp.status_code == 200
+
+
+@pytest.mark.parametrize('path', ['/ai/', '/editor/'])
+def test_page_warm(benchmark, client, seeded_user, path):
+    client.get(path)
+    resp = benchmark(client.get, path)
+    assert resp.status_code == 200
+
+
+# ── JSON lists ────────────────────────────────────────────────────────────────
+
+def test_snippet_list(benchmark, client, seeded_user):
+    resp = benchmark(client.get, '/editor/snippets')
+    assert len(resp.get_json()['items']) == SEED_SNIPPETS
+
+
+def test_snippet_list_not_modified(benchmark, client, seeded_user):
+    """A poll that revalidates an unchanged list: one lookup, no list query."""
+    etag = client.get('/editor/snippets').headers['ETag']
+    resp = benchmark(client.get, '/editor/snippets', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+
+
+def test_packages_page(benchmark, client):
+    resp = benchmark(client.get, '/editor/packages')
+    assert resp.status_code == 200
+
+
+# ── BigBangBoom ───────────────────────────────────────────────────────────────
+
+@pytest.fixture(scope='module')
+def bbb_user(bbb):
+    from bigbangboom.app import db
+    from bigbangboom.app.models import TrainingPrompt, User
+    with bbb.app_context():
+        user = User(username='bench', email='bench@bench.local', password_hash='-')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add_all(TrainingPrompt(user_id=user.id, title=f'prompt {i}',
+                                          content='Answer as a senior engineer. ' * 20)
+                           for i in range(SEED_PROMPTS))
+        db.session.commit()
+        return user.id
+
+
+def test_build_system_prompt_cold(benchmark, bbb, bbb_user):
+    from bigbangboom.app import db
+    from bigbangboom.app.bigbangboom import _build_system_prompt, invalidate_system_prompt
+    from bigbangboom.app.models import User
+    with bbb.app_context():
+        user = db.session.get(User, bbb_user)
+        prompt = benchmark.pedantic(_build_system_prompt, args=(user,),
+                                    setup=lambda: invalidate_system_prompt(bbb_user), rounds=200)
+    assert prompt.count('[Training instruction') == SEED_PROMPTS
+
+
+def test_build_system_prompt_warm(benchmark, bbb, bbb_user):
+    from bigbangboom.app import db
+    from bigbangboom.app.bigbangboom import _build_system_prompt
+    from bigbangboom.app.models import User
+    with bbb.app_context():
+        user = db.session.get(User, bbb_user)
+        _build_system_prompt(user)
+        benchmark(_build_system_prompt, user)
@@ -0,0 +1,56 @@
+"""
+Fixtures for the pytest-benchmark micro-benchmarks in ``bench_micro.py``.
+
+Both apps are built once per session against throwaway SQLite databases,
+with password hashing inline and no background workers.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'bench-password'
+
+
+@pytest.fixture(scope='session')
+def pyhost(tmp_path_factory):
+    db_dir = tmp_path_factory.mktemp('pyhost')
+    os.environ.update(DATABASE_URL=f'sqlite:///{db_dir}/pyhost.db', SECRET_KEY='bench',
+                      PASSWORD_HASH_WORKERS='0', SERVER_TIMING='0')
+    from app import create_app, init_db
+    app = create_app(preload=True)
+    app.config['UPLOAD_FOLDER'] = str(db_dir / 'uploads')
+    init_db(app)
+    return app
+
+
+@pytest.fixture(scope='session')
+def client(pyhost):
+    """A test client logged in as the benchmark user."""
+    client = pyhost.test_client()
+    client.post('/auth/register', data={'username': 'bench', 'email': 'bench@bench.local',
+                                        'password': PASSWORD, 'confirm_password': PASSWORD})
+    resp = client.post('/auth/login', data={'identifier': 'bench', 'password': PASSWORD})
+    assert resp.status_code == 302, 'benchmark login failed'
+    return client
+
+
+@pytest.fixture(scope='session')
+def pyhost_user(pyhost, client):
+    from app.models import User
+    with pyhost.app_context():
+        return User.query.filter_by(username='bench').one().id
+
+
+@pytest.fixture(scope='session')
+def bbb(tmp_path_factory):
+    db_dir = tmp_path_factory.mktemp('bbb')
+    os.environ.update(BBB_DATABASE_URL=f'sqlite:///{db_dir}/bbb.db', BBB_SECRET_KEY='bench',
+                      BBB_PASSWORD_HASH_WORKERS='0')
+    from bigbangboom.app import create_app, init_db
+    app = create_app(preload=True)
+    init_db(app)
+    return app
@@ -0,0 +1,240 @@
+"""
+HTTP load harness for a running PyHost node.
+
+Drives the editor runner, AI chat, file upload/download and web terminals
+with closed-loop virtual users for a fixed time and writes per-scenario
+latency percentiles and throughput as JSON. Chat traffic needs the server
+pointed at a mock provider:
+
+    python benchmarks/mock_llm.py --port 8900 --ttfb-ms 300   # prints *_BASE_URL exports
+    # start the server with those exports, then:
+    python benchmarks/load.py --url http://127.0.0.1:5000 --users 10 \
+        --duration 30 --out load.json
+    python benchmarks/load.py ... --baseline load.json --tolerance 0.2
+
+With ``--baseline`` the run fails (exit 1) when any scenario's p95 latency
+grows, or its throughput drops, by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from terminal_load import login, run_client
+
+SCENARIOS = ('editor', 'chat', 'files', 'terminal')
+RUN_CODE = 'total = sum(i * i for i in range(10000))\nprint(total)\n'
+DOWNLOAD_LINK = re.compile(r'/hosting/download/(\d+)')
+
+
+class Recorder:
+    """Latencies and errors per operation, shared by every virtual user."""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, op, seconds, ok):
+        with self._lock:
+            if ok:
+                self.samples.setdefault(op, []).append(seconds)
+            else:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+    def timed(self, op, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = fn(*args, **kwargs)
+            ok = resp.status_code < 400
+        except requests.RequestException:
+            resp, ok = None, False
+        self.record(op, time.perf_counter() - start, ok)
+        return resp if ok else None
+
+    def summary(self, duration):
+        ops = {}
+        for op in sorted(set(self.samples) | set(self.errors)):
+            times = sorted(self.samples.get(op, []))
+            entry = {'requests': len(times), 'errors': self.errors.get(op, 0),
+                     'rps': round(len(times) / duration, 2)}
+            if times:
+                entry.update(mean_ms=round(statistics.fmean(times) * 1000, 1),
+                             p50_ms=round(percentile(times, 50) * 1000, 1),
+                             p95_ms=round(percentile(times, 95) * 1000, 1),
+                             p99_ms=round(percentile(times, 99) * 1000, 1))
+            ops[op] = entry
+        return ops
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def clone_session(http):
+    # requests.Session is not thread-safe: give every virtual user its own.
+    session = requests.Session()
+    session.cookies.update(http.cookies)
+    return session
+
+
+# ── Scenarios ─────────────────────────────────────────────────────────────────
+
+def editor_user(url, http, rec, deadline):
+    while time.monotonic() < deadline:
+        rec.timed('editor_run', http.post, f'{url}/editor/run', json={'code': RUN_CODE})
+
+
+def chat_user(url, http, rec, deadline, model):
+    resp = http.post(f'{url}/ai/session/new', data={'model_id': model}, allow_redirects=False)
+    session_id = resp.headers.get('Location', '').rsplit('/', 1)[-1]
+    if not session_id.isdigit():
+        rec.record('chat_send', 0, False)
+        return
+    while time.monotonic() < deadline:
+        rec.timed('chat_send', http.post, f'{url}/ai/session/{session_id}/send',
+                  json={'message': 'Summarise the benefits of connection pooling.'})
+
+
+def files_user(url, http, rec, deadline, payload):
+    while time.monotonic() < deadline:
+        uploaded = rec.timed('upload', http.post, f'{url}/hosting/upload',
+                             files={'file': ('bench.bin', payload)}, allow_redirects=False)
+        if uploaded is None:
+            continue
+        match = DOWNLOAD_LINK.search(http.get(f'{url}/hosting/').text)   # newest first
+        if match:
+            rec.timed('download', http.get, f'{url}/hosting/download/{match.group(1)}')
+
+
+def delete_uploads(url, http):
+    for file_id in set(DOWNLOAD_LINK.findall(http.get(f'{url}/hosting/').text)):
+        http.post(f'{url}/hosting/delete/{file_id}', allow_redirects=False)
+
+
+def terminal_scenario(url, http, rec, clients, nbytes):
+    cookies = '; '.join(f'{k}={v}' for k, v in http.cookies.items())
+    results = [{} for _ in range(clients)]
+    threads = [threading.Thread(target=run_client, args=(url, cookies, nbytes, 60, r))
+               for r in results]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for r in results:
+        ok = 'error' not in r and 'connect_s' in r
+        rec.record('terminal_connect', r.get('connect_s', 0), ok)
+        if ok and r.get('stream_s'):
+            rec.record('terminal_stream', r['stream_s'], True)
+
+
+# ── Driver ────────────────────────────────────────────────────────────────────
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(current, baseline, tolerance):
+    """Human-readable regressions of *current* against *baseline*."""
+    regressions = []
+    for op, base in baseline.get('operations', {}).items():
+        now = current['operations'].get(op)
+        if not now or 'p95_ms' not in now or 'p95_ms' not in base:
+            continue
+        if now['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{op}: p95 {base['p95_ms']} -> {now['p95_ms']} ms")
+        if base['rps'] and now['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{op}: throughput {base['rps']} -> {now['rps']} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--users', type=int, default=10, help='virtual users per HTTP scenario')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per run')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--model', default='gpt-4o', help='chat model to create sessions with')
+    parser.add_argument('--file-kb', type=int, default=256)
+    parser.add_argument('--terminals', type=int, default=5)
+    parser.add_argument('--terminal-bytes', type=int, default=200000)
+    parser.add_argument('--username', default='loadbench')
+    parser.add_argument('--password', default='loadbench-password')
+    parser.add_argument('--out', help='write the JSON results here')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    url = args.url.rstrip('/')
+    http = login(url, args.username, args.password)
+    if 'chat' in scenarios:
+        # Any key works against the mock provider.
+        http.post(f'{url}/profile/', allow_redirects=False,
+                  data={'action': 'update_api_keys', 'openai_key': 'mock', 'anthropic_key': 'mock',
+                        'google_key': 'mock', 'groq_key': 'mock', 'mistral_key': 'mock'})
+
+    rec = Recorder()
+    payload = os.urandom(args.file_kb * 1024)
+    deadline = time.monotonic() + args.duration
+    started = time.monotonic()
+    workers = []
+    for name in scenarios:
+        for _ in range(args.users if name != 'terminal' else 0):
+            target, extra = {'editor': (editor_user, ()),
+                             'chat': (chat_user, (args.model,)),
+                             'files': (files_user, (payload,))}[name]
+            workers.append(threading.Thread(
+                target=target, args=(url, clone_session(http), rec, deadline, *extra)))
+    if 'terminal' in scenarios:
+        workers.append(threading.Thread(
+            target=terminal_scenario, args=(url, http, rec, args.terminals, args.terminal_bytes)))
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.monotonic() - started
+    if 'files' in scenarios:
+        delete_uploads(url, http)
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'config': {'url': url, 'users': args.users, 'duration_s': args.duration,
+                   'scenarios': scenarios, 'file_kb': args.file_kb, 'terminals': args.terminals},
+        'elapsed_s': round(elapsed, 2),
+        'operations': rec.summary(elapsed),
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
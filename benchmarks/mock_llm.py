@@ -0,0 +1,335 @@
+"""
+Local stand-in for the AI providers.
+
+Speaks the OpenAI chat completions API, the same API as served by Groq and
+Mistral, Anthropic's messages API and Gemini's ``generateContent`` /
+``streamGenerateContent``, streaming (server-sent events in each
+provider's own shape) or not. Replies are generated at a configurable
+token rate after a configurable time to first byte, and a share of
+requests can be answered with 429/5xx errors or left hanging to trigger
+client timeouts, so the chat paths can be measured and tuned offline.
+
+Each provider is served under its own prefix; point the apps at it with
+the ``*_BASE_URL`` variables printed on startup.
+
+    python benchmarks/mock_llm.py --port 8900 --ttfb-ms 300 --tokens-per-s 80 \
+        --error-rate 0.05 --error-status 429,503 --hang-rate 0.01
+
+``GET /_config`` shows the current behaviour and ``POST /_config`` with a
+JSON object of the same keys changes it at runtime; ``GET /stats`` counts
+requests by provider and outcome.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ('the quick brown fox jumps over a lazy dog while the mock server '
+         'streams tokens at a steady pace for benchmarking').split()
+
+# provider -> (env variable, path prefix the chatcore caller appends to)
+PREFIXES = {
+    'openai':    ('OPENAI_BASE_URL', '/openai/v1'),
+    'anthropic': ('ANTHROPIC_BASE_URL', '/anthropic'),
+    'google':    ('GEMINI_BASE_URL', '/google'),
+    'groq':      ('GROQ_BASE_URL', '/groq/openai/v1'),
+    'mistral':   ('MISTRAL_BASE_URL', '/mistral/v1'),
+}
+GEMINI_PATH = re.compile(r'/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)')
+
+DEFAULTS = {
+    'ttfb_ms': 0.0,          # delay before the first byte of any reply
+    'jitter_ms': 0.0,        # uniform random extra delay added to the TTFB
+    'tokens': 32,            # words per reply
+    'tokens_per_s': 0.0,     # generation speed; 0 = instant
+    'error_rate': 0.0,       # share of requests answered with an error
+    'error_status': [429, 500, 503],
+    'hang_rate': 0.0,        # share of requests that never answer in time
+    'hang_s': 120.0,
+}
+
+
+class Config:
+    """Mock behaviour, shared by every handler thread and changeable at runtime."""
+
+    def __init__(self, **values):
+        self._lock = threading.Lock()
+        self._values = dict(DEFAULTS)
+        self.update(values)
+
+    def update(self, values):
+        with self._lock:
+            for key, value in values.items():
+                if key not in DEFAULTS:
+                    raise KeyError(key)
+                if key == 'error_status':
+                    value = [int(s) for s in (value.split(',') if isinstance(value, str) else value)]
+                else:
+                    value = type(DEFAULTS[key])(value)
+                self._values[key] = value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+# ── Response shapes ───────────────────────────────────────────────────────────
+
+def reply_tokens(n):
+    return [WORDS[i % len(WORDS)] + ('' if i == n - 1 else ' ') for i in range(n)]
+
+
+def openai_response(provider, model, text, n):
+    body = {
+        'id': f'chatcmpl-{uuid.uuid4().hex[:24]}', 'object': 'chat.completion',
+        'created': int(time.time()), 'model': model,
+        'choices': [{'index': 0, 'finish_reason': 'stop',
+                     'message': {'role': 'assistant', 'content': text}}],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': n, 'total_tokens': n},
+    }
+    if provider == 'groq':
+        body['x_groq'] = {'id': f'req_{uuid.uuid4().hex[:26]}'}
+    return body
+
+
+def openai_chunks(provider, model, tokens):
+    base = {'id': f'chatcmpl-{uuid.uuid4().hex[:24]}', 'object': 'chat.completion.chunk',
+            'created': int(time.time()), 'model': model}
+    yield None, {**base, 'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': ''},
+                                      'finish_reason': None}]}
+    for token in tokens:
+        yield None, {**base, 'choices': [{'index': 0, 'delta': {'content': token},
+                                          'finish_reason': None}]}
+    final = {**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+    if provider == 'mistral':
+        final['usage'] = {'prompt_tokens': 0, 'completion_tokens': len(tokens),
+                          'total_tokens': len(tokens)}
+    yield None, final
+    yield None, '[DONE]'
+
+
+def anthropic_response(model, text, n):
+    return {
+        'id': f'msg_{uuid.uuid4().hex[:24]}', 'type': 'message', 'role': 'assistant',
+        'model': model, 'content': [{'type': 'text', 'text': text}],
+        'stop_reason': 'end_turn', 'stop_sequence': None,
+        'usage': {'input_tokens': 0, 'output_tokens': n},
+    }
+
+
+def anthropic_chunks(model, tokens):
+    message = anthropic_response(model, '', 0)
+    message['content'], message['stop_reason'] = [], None
+    yield 'message_start', {'type': 'message_start', 'message': message}
+    yield 'content_block_start', {'type': 'content_block_start', 'index': 0,
+                                  'content_block': {'type': 'text', 'text': ''}}
+    for token in tokens:
+        yield 'content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                      'delta': {'type': 'text_delta', 'text': token}}
+    yield 'content_block_stop', {'type': 'content_block_stop', 'index': 0}
+    yield 'message_delta', {'type': 'message_delta',
+                            'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                            'usage': {'output_tokens': len(tokens)}}
+    yield 'message_stop', {'type': 'message_stop'}
+
+
+def gemini_response(model, text, n, finished=True):
+    body = {
+        'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}, 'index': 0}],
+        'modelVersion': model,
+    }
+    if finished:
+        body['candidates'][0]['finishReason'] = 'STOP'
+        body['usageMetadata'] = {'promptTokenCount': 0, 'candidatesTokenCount': n,
+                                 'totalTokenCount': n}
+    return body
+
+
+def gemini_chunks(model, tokens):
+    for i, token in enumerate(tokens):
+        yield None, gemini_response(model, token, len(tokens), finished=i == len(tokens) - 1)
+
+
+def error_body(provider, status):
+    message = {429: 'Rate limit exceeded (injected by mock).',
+               500: 'Internal server error (injected by mock).',
+               502: 'Bad gateway (injected by mock).',
+               503: 'Service overloaded (injected by mock).'}.get(status, f'Error {status} (injected by mock).')
+    if provider == 'anthropic':
+        kind = {429: 'rate_limit_error', 503: 'overloaded_error'}.get(status, 'api_error')
+        return {'type': 'error', 'error': {'type': kind, 'message': message}}
+    if provider == 'google':
+        state = {429: 'RESOURCE_EXHAUSTED', 503: 'UNAVAILABLE'}.get(status, 'INTERNAL')
+        return {'error': {'code': status, 'message': message, 'status': state}}
+    kind = 'rate_limit_exceeded' if status == 429 else 'server_error'
+    return {'error': {'message': message, 'type': kind, 'code': kind}}
+
+
+# ── Server ────────────────────────────────────────────────────────────────────
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+    stats = None
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count(self, provider, outcome):
+        with self.stats_lock:
+            self.stats[f'{provider}:{outcome}'] = self.stats.get(f'{provider}:{outcome}', 0) + 1
+            self.stats['requests'] = self.stats.get('requests', 0) + 1
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with self.stats_lock:
+                return self._send_json(200, dict(self.stats))
+        if self.path == '/_config':
+            return self._send_json(200, self.config.snapshot())
+        self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        try:
+            body = self._read_json()
+        except ValueError:
+            return self._send_json(400, {'error': {'message': 'invalid JSON'}})
+        path = self.path.split('?', 1)[0]
+        if path == '/_config':
+            try:
+                self.config.update(body)
+            except (KeyError, TypeError, ValueError) as exc:
+                return self._send_json(400, {'error': {'message': f'bad setting: {exc}'}})
+            return self._send_json(200, self.config.snapshot())
+
+        provider = next((p for p, (_, prefix) in PREFIXES.items()
+                         if path.startswith(prefix + '/')), None)
+        route = path[len(PREFIXES[provider][1]):] if provider else path
+        gemini = GEMINI_PATH.fullmatch(route)
+        if provider is None or not (route == '/chat/completions' and provider in ('openai', 'groq', 'mistral')
+                                    or route == '/v1/messages' and provider == 'anthropic'
+                                    or gemini and provider == 'google'):
+            return self._send_json(404, {'error': {'message': f'unknown endpoint {path}'}})
+
+        cfg = self.config.snapshot()
+        roll = random.random()
+        if roll < cfg['hang_rate']:
+            self._count(provider, 'hang')
+            time.sleep(cfg['hang_s'])
+            self.close_connection = True
+            return
+        time.sleep((cfg['ttfb_ms'] + random.uniform(0, cfg['jitter_ms'])) / 1000)
+        if roll < cfg['hang_rate'] + cfg['error_rate'] and cfg['error_status']:
+            status = random.choice(cfg['error_status'])
+            self._count(provider, str(status))
+            return self._send_json(status, error_body(provider, status),
+                                   {'Retry-After': '1'} if status == 429 else None)
+
+        model = gemini.group(1) if gemini else body.get('model', 'mock')
+        tokens = reply_tokens(max(1, cfg['tokens']))
+        delay = 1 / cfg['tokens_per_s'] if cfg['tokens_per_s'] > 0 else 0
+        streaming = gemini.group(2) == 'streamGenerateContent' if gemini else bool(body.get('stream'))
+        self._count(provider, 'stream' if streaming else 'ok')
+
+        if streaming:
+            if provider == 'anthropic':
+                events = anthropic_chunks(model, tokens)
+            elif provider == 'google':
+                events = gemini_chunks(model, tokens)
+            else:
+                events = openai_chunks(provider, model, tokens)
+            return self._stream(events, delay)
+
+        time.sleep(delay * len(tokens))
+        text = ''.join(tokens)
+        if provider == 'anthropic':
+            return self._send_json(200, anthropic_response(model, text, len(tokens)))
+        if provider == 'google':
+            return self._send_json(200, gemini_response(model, text, len(tokens)))
+        self._send_json(200, openai_response(provider, model, text, len(tokens)))
+
+    def _stream(self, events, delay):
+        # No Content-Length: the body ends when the connection closes.
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for i, (event, data) in enumerate(events):
+            if i and delay:
+                time.sleep(delay)
+            payload = data if isinstance(data, str) else json.dumps(data)
+            chunk = (f'event: {event}\n' if event else '') + f'data: {payload}\n\n'
+            try:
+                self.wfile.write(chunk.encode())
+                self.wfile.flush()
+            except OSError:
+                return   # client gave up
+
+
+def serve(host='127.0.0.1', port=8900, **settings):
+    """Start the server on a background thread and return it.
+
+    *settings* are :data:`DEFAULTS` keys; the live :class:`Config` is
+    ``server.config``.
+    """
+    config = Config(**settings)
+    handler = type('Handler', (MockHandler,), {'config': config, 'stats': {}})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, name='mock-llm', daemon=True).start()
+    return server
+
+
+def base_urls(url):
+    """``{env variable: base URL}`` pointing every provider at the mock at *url*."""
+    return {env: url + prefix for env, prefix in PREFIXES.values()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--ttfb-ms', '--latency-ms', dest='ttfb_ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--tokens', type=int, default=DEFAULTS['tokens'], help='words per reply')
+    parser.add_argument('--tokens-per-s', type=float, default=0, help='0 = instant')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--error-status', default='429,500,503')
+    parser.add_argument('--hang-rate', type=float, default=0)
+    parser.add_argument('--hang-s', type=float, default=DEFAULTS['hang_s'])
+    args = parser.parse_args()
+
+    settings = {k: v for k, v in vars(args).items() if k not in ('host', 'port')}
+    server = serve(args.host, args.port, **settings)
+    url = f'http://{args.host}:{server.server_address[1]}'
+    for env, value in base_urls(url).items():
+        print(f'export {env}={value}', flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Startup-time benchmark.
+
+Builds each app in a fresh interpreter under ``python -X importtime`` and
+reports import time, ``create_app`` time and the slowest top-level
+imports as JSON. With ``--budget-ms`` the exit status is non-zero when
+the median total for any app goes over budget, which is how CI uses it.
+
+    python benchmarks/startup_time.py --runs 5 --budget-ms 1500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Both projects ship a package called ``app``; each is built from its own root.
+TARGETS = {
+    'pyhost': ROOT,
+    'bigbangboom': os.path.join(ROOT, 'bigbangboom'),
+}
+
+PROBE = (
+    'import time, sys\n'
+    't0 = time.perf_counter()\n'
+    'import app\n'
+    't1 = time.perf_counter()\n'
+    'app.create_app(preload=True)\n'
+    't2 = time.perf_counter()\n'
+    'print((t1 - t0) * 1000, (t2 - t1) * 1000)\n'
+)
+
+
+def parse_importtime(stderr, root='app'):
+    """{module: cumulative_us} for the direct dependencies of *root*'s modules.
+
+    ``-X importtime`` prints each import after everything it pulled in,
+    indented by depth, so children are collected until their top-level
+    parent shows up. Imports made by ``site`` and friends are ignored.
+    """
+    found, pending = {}, []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        module = name.strip()
+        if depth == 1:
+            pending.append((module, int(cumulative)))
+        elif depth == 0:
+            if module == root or module.startswith(root + '.'):
+                for child, us in pending:
+                    if not child.startswith(root + '.'):
+                        found[child] = found.get(child, 0) + us
+            pending = []
+    return found
+
+
+def measure(cwd, scratch):
+    env = dict(os.environ,
+               PYTHONDONTWRITEBYTECODE='',
+               SECRET_KEY='startup-bench', BBB_SECRET_KEY='startup-bench',
+               DATABASE_URL=f'sqlite:///{scratch}/pyhost.db',
+               BBB_DATABASE_URL=f'sqlite:///{scratch}/bbb.db')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-W', 'ignore', '-c', PROBE],
+                          cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    import_ms, create_ms = (float(v) for v in proc.stdout.split())
+    return import_ms, create_ms, parse_importtime(proc.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, help='fail if a median total exceeds this')
+    parser.add_argument('--top', type=int, default=10, help='slowest dependencies to list')
+    parser.add_argument('--out', help='write JSON results here as well as to stdout')
+    args = parser.parse_args()
+
+    report = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        for name, cwd in TARGETS.items():
+            measure(cwd, scratch)   # warm the bytecode cache
+            runs = [measure(cwd, scratch) for _ in range(args.runs)]
+            imports = runs[-1][2]
+            slowest = sorted(imports.items(), key=lambda kv: kv[1], reverse=True)[:args.top]
+            import_ms = statistics.median(r[0] for r in runs)
+            create_ms = statistics.median(r[1] for r in runs)
+            report[name] = {
+                'import_ms': round(import_ms, 1),
+                'create_app_ms': round(create_ms, 1),
+                'total_ms': round(import_ms + create_ms, 1),
+                'slowest_dependencies_ms': {mod: round(us / 1000, 1) for mod, us in slowest},
+            }
+
+    over = [name for name, r in report.items()
+            if args.budget_ms is not None and r['total_ms'] > args.budget_ms]
+    if args.budget_ms is not None:
+        report['budget_ms'] = args.budget_ms
+        report['over_budget'] = over
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+Terminal load benchmark.
+
+Opens N concurrent web terminals against a running PyHost node (or a
+balancer in front of several), has each shell print a fixed amount of
+output and reports connect latency and streaming throughput as JSON.
+
+    python benchmarks/terminal_load.py --url http://127.0.0.1:5000 \
+        --clients 50 --bytes 1000000 --out results.json
+
+The benchmark user opens every terminal, so start the server with
+``TERMINAL_MAX_PER_USER`` at least ``--clients``.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+import requests
+import socketio
+
+DONE_MARKER = '__BENCH_DONE__'
+
+
+def login(url, username, password):
+    """Return a requests session logged in as *username*, registering it if needed."""
+    http = requests.Session()
+    form = {'identifier': username, 'password': password}
+    resp = http.post(f'{url}/auth/login', data=form, allow_redirects=False)
+    if resp.status_code != 302:
+        http.post(f'{url}/auth/register', allow_redirects=False,
+                  data={'username': username, 'email': f'{username}@bench.local',
+                        'password': password, 'confirm_password': password})
+        resp = http.post(f'{url}/auth/login', data=form, allow_redirects=False)
+    if resp.status_code != 302:
+        sys.exit(f'login failed for {username} (HTTP {resp.status_code})')
+    http.get(f'{url}/terminal/')   # picks up the node routing cookie
+    return http
+
+
+def run_client(url, cookies, nbytes, timeout, result):
+    sio = socketio.Client(reconnection=False)
+    done = threading.Event()
+    attached = threading.Event()
+    tail = bytearray()
+    state = {'bytes': 0, 'first_byte': None}
+
+    @sio.on('terminal_attached', namespace='/terminal')
+    def on_attached(data):
+        attached.set()
+
+    @sio.on('terminal_notice', namespace='/terminal')
+    def on_notice(data):
+        if not done.is_set():   # "[Session closed]" after our own kill is expected
+            result['error'] = data.get('data', '').strip()
+            done.set()
+
+    @sio.on('terminal_output', namespace='/terminal')
+    def on_output(data):
+        chunk = data if isinstance(data, bytes) else data['data'].encode()
+        if state['first_byte'] is None:
+            state['first_byte'] = time.perf_counter()
+        state['bytes'] += len(chunk)
+        tail.extend(chunk)
+        del tail[:-64]
+        if DONE_MARKER.encode() in tail:
+            done.set()
+        return True   # ack the frame
+
+    start = time.perf_counter()
+    try:
+        sio.connect(url, namespaces=['/terminal'], transports=['websocket'],
+                    headers={'Cookie': cookies}, auth={}, wait_timeout=timeout)
+        if not attached.wait(timeout):
+            raise TimeoutError('no terminal_attached')
+        result['connect_s'] = time.perf_counter() - start
+        sent = time.perf_counter()
+        # The marker is assembled by the shell so the echoed command never matches.
+        sio.emit('terminal_input', {'data': f"head -c {nbytes} /dev/zero | tr '\\0' x; "
+                                            f"echo __BENCH_''DONE__\n"}, namespace='/terminal')
+        if not done.wait(timeout):
+            raise TimeoutError('output did not finish')
+        result['stream_s'] = time.perf_counter() - sent
+        result['bytes'] = state['bytes']
+        # Wait for the ack: a plain emit could be dropped by the disconnect,
+        # leaving the shell detached on the server until its idle TTL.
+        sio.call('terminal_kill', namespace='/terminal', timeout=timeout)
+    except Exception as e:
+        result.setdefault('error', str(e) or type(e).__name__)
+    finally:
+        sio.disconnect()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--bytes', type=int, default=1_000_000, help='output per terminal')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--user', default=f'bench{uuid.uuid4().hex[:8]}')
+    parser.add_argument('--password', default='bench-password-123')
+    parser.add_argument('--out', help='write JSON results here as well as to stdout')
+    parser.add_argument('--metrics-token', default=os.environ.get('METRICS_TOKEN', ''),
+                        help="the server's METRICS_TOKEN, for /terminal/stats off loopback")
+    args = parser.parse_args()
+
+    url = args.url.rstrip('/')
+    http = login(url, args.user, args.password)
+    cookies = '; '.join(f'{k}={v}' for k, v in http.cookies.items())
+
+    results = [{} for _ in range(args.clients)]
+    threads = [threading.Thread(target=run_client,
+                                args=(url, cookies, args.bytes, args.timeout, r))
+               for r in results]
+    wall = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall
+
+    ok = [r for r in results if 'error' not in r]
+    connects = [r['connect_s'] for r in ok]
+    total_bytes = sum(r['bytes'] for r in ok)
+    report = {
+        'url': url,
+        'clients': args.clients,
+        'bytes_per_client': args.bytes,
+        'succeeded': len(ok),
+        'errors': sorted({r['error'] for r in results if 'error' in r}),
+        'connect_p50_ms': round(statistics.median(connects) * 1000, 1) if connects else None,
+        'connect_p95_ms': round(percentile(connects, 95) * 1000, 1) if connects else None,
+        'stream_max_s': round(max((r['stream_s'] for r in ok), default=0), 3),
+        'wall_s': round(wall, 3),
+        'throughput_mb_s': round(total_bytes / wall / 1e6, 2) if wall else None,
+    }
+    try:
+        headers = {'Authorization': f'Bearer {args.metrics_token}'} if args.metrics_token else {}
+        report['server'] = http.get(f'{url}/terminal/stats', headers=headers).json()
+    except (requests.RequestException, ValueError):
+        pass
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    return 0 if len(ok) == args.clients else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,23 @@
 import os
+import sys
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 
+# Code shared with PyHost (chatcore/) lives at the repository root.
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _REPO_ROOT not in sys.path:
+    sys.path.append(_REPO_ROOT)
+
 db = SQLAlchemy()
 login_manager = LoginManager()
 
 
-def create_app():
+def create_app(preload=False):
+    """Build the app. With ``preload=True`` the password pool is not started,
+    so the result can be forked; each process then calls :func:`start_workers`.
+    """
     app = Flask(__name__)
 
     secret_key = os.environ.get('BBB_SECRET_KEY', '')
@@ -22,11 +32,38 @@ def create_app():
         'sqlite:///' + os.path.join(app.instance_path, 'bbb.db'),
     )
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Own cookie names: browsers don't separate cookies by port, and the app
+    # may share a host with PyHost (see wsgi.py in the repository root).
+    app.config['SESSION_COOKIE_NAME'] = 'bbb_session'
+    app.config['REMEMBER_COOKIE_NAME'] = 'bbb_remember_token'
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('BBB_PASSWORD_HASH_METHOD', 'scrypt')
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('BBB_PASSWORD_HASH_WORKERS', '2'))
+
+    # Rendering: per-user fragment cache and on-disk compiled templates
+    app.config['FRAGMENT_CACHE'] = os.environ.get('BBB_FRAGMENT_CACHE', '1') == '1'
+    app.config['TEMPLATE_CACHE_DIR'] = os.environ.get(
+        'BBB_TEMPLATE_CACHE_DIR', os.path.join(app.instance_path, 'jinja-cache'))
+
+    # Static assets: fingerprinted bundles from `flask build-assets` when built
+    app.config['ASSET_BUNDLES'] = os.environ.get('BBB_ASSET_BUNDLES', '1') == '1'
 
     os.makedirs(app.instance_path, exist_ok=True)
 
+    if app.config['TEMPLATE_CACHE_DIR']:
+        from jinja2 import FileSystemBytecodeCache
+        os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+        app.jinja_options = {**app.jinja_options,
+                             'bytecode_cache': FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])}
+
     db.init_app(app)
 
+    from chatcore import passwords
+    passwords.init_app(app)
+
+    from chatcore import assets
+    from .assets import BUNDLES
+    assets.init_app(app, BUNDLES)
+
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please log in to continue.'
@@ -42,15 +79,34 @@ def create_app():
 
     from . import models
 
+    from chatcore import identity
+    identity.init_app(app, models.User, db)
+
     @login_manager.user_loader
     def load_user(user_id):
-        return models.User.query.get(int(user_id))
-
-    with app.app_context():
-        db.create_all()
+        return identity.load_cached_user(int(user_id))
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create any missing database tables."""
+        init_db(app)
+        print('Database tables are up to date.')
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Bundle, fingerprint and precompress static files into static/dist."""
+        try:
+            manifest = assets.build(app.static_folder, BUNDLES)
+        except FileNotFoundError as exc:
+            raise click.ClickException(str(exc))
+        for name, built in sorted(manifest.items()):
+            print(f'{name} -> dist/{built}')
 
     from datetime import datetime as _dt
     from flask import render_template
+    from chatcore import fragments
+
+    fragments.init_app(app)
 
     @app.context_processor
     def inject_now():
@@ -60,4 +116,28 @@ def create_app():
     def index():
         return render_template('index.html')
 
+    if preload:
+        precompile_templates(app)
+    else:
+        start_workers(app)
     return app
+
+
+def precompile_templates(app):
+    """Compile every template now, so forked workers inherit them ready to render."""
+    env = app.jinja_env
+    for name in env.list_templates():
+        if name.endswith('.html'):
+            env.get_template(name)
+
+
+def start_workers(app):
+    """Start this process's password-hashing pool."""
+    from chatcore import passwords
+    passwords.start(app)
+
+
+def init_db(app):
+    """Create any missing tables; run once per deploy, not on every boot."""
+    with app.app_context():
+        db.create_all()
@@ -0,0 +1,19 @@
+"""
+BigBangBoom's static asset bundles; the pipeline is :mod:`chatcore.assets`.
+
+Templates emit a bundle with ``{{ asset('chat.js') }}`` and
+``flask build-assets`` builds the first-party files of each one into
+``static/dist``.
+"""
+# Bundle name -> sources in load order: CDN URLs (pinned; linked as they
+# are) and first-party files under static/ (bundled).
+BOOTSTRAP = 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist'
+BUNDLES = {
+    'base.css': [f'{BOOTSTRAP}/css/bootstrap.min.css',
+                 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css',
+                 'https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800'
+                 '&family=JetBrains+Mono:wght@400;500&display=swap'],
+    'style.css': ['css/style.css'],
+    'base.js': [f'{BOOTSTRAP}/js/bootstrap.bundle.min.js'],
+    'chat.js': ['js/chat.js'],
+}
@@ -1,11 +1,24 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from chatcore.identity import invalidate_user
+from chatcore.passwords import HasherBusy, hash_password, verify_password, needs_rehash
+from chatcore.ratelimit import TokenBucket
 from . import db
 from .models import User
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+# ── Rate limiting ─────────────────────────────────────────────────────────────
+# Every login/register attempt costs a password hash, so attempts are limited
+# per client IP and per submitted username before any hashing happens.
+
+IP_BURST, IP_PER_MINUTE = 20, 10
+USERNAME_BURST, USERNAME_PER_MINUTE = 5, 5
+
+_ip_limiter = TokenBucket(IP_BURST, IP_PER_MINUTE / 60)
+_username_limiter = TokenBucket(USERNAME_BURST, USERNAME_PER_MINUTE / 60)
+
+
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
 def register():
@@ -17,6 +30,10 @@ def register():
         password = request.form.get('password', '')
         confirm = request.form.get('confirm_password', '')
 
+        if not _ip_limiter.consume(request.remote_addr or ''):
+            flash('Too many attempts. Please wait a minute and try again.', 'danger')
+            return render_template('auth/register.html'), 429
+
         if len(username) < 3:
             flash('Username must be at least 3 characters.', 'danger')
         elif '@' not in email:
@@ -30,10 +47,15 @@ def register():
         elif User.query.filter_by(email=email).first():
             flash('Email already registered.', 'danger')
         else:
+            try:
+                pwhash = hash_password(password)
+            except HasherBusy:
+                flash('The server is busy. Please try again in a moment.', 'danger')
+                return render_template('auth/register.html'), 503
             user = User(
                 username=username,
                 email=email,
-                password_hash=generate_password_hash(password),
+                password_hash=pwhash,
             )
             db.session.add(user)
             db.session.commit()
@@ -51,8 +73,21 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '')
+        if not (_ip_limiter.consume(request.remote_addr or '')
+                and _username_limiter.consume(username)):
+            flash('Too many attempts. Please wait a minute and try again.', 'danger')
+            return render_template('auth/login.html'), 429
         user = User.query.filter_by(username=username).first()
-        if user and check_password_hash(user.password_hash, password):
+        try:
+            valid = user is not None and verify_password(user.password_hash, password)
+            if valid and needs_rehash(user.password_hash):
+                user.password_hash = hash_password(password)
+                db.session.commit()
+                invalidate_user(user.id)
+        except HasherBusy:
+            flash('The server is busy. Please try again in a moment.', 'danger')
+            return render_template('auth/login.html'), 503
+        if valid:
             login_user(user, remember=True)
             next_page = request.args.get('next')
             return redirect(next_page or url_for('index'))
@@ -64,6 +99,7 @@ def login():
 @auth_bp.route('/logout')
 @login_required
 def logout():
+    invalidate_user(current_user.id)
     logout_user()
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
@@ -1,8 +1,11 @@
-import requests as http_requests
 from datetime import datetime
 from flask import (Blueprint, render_template, request, jsonify,
                    redirect, url_for, flash, abort)
 from flask_login import login_required, current_user
+from chatcore import ProviderError, chat_turn
+from chatcore import fragments
+from chatcore.cache import TTLCache
+from chatcore.identity import invalidate_user
 from . import db
 from .models import BBBSession, BBBMessage, TrainingPrompt
 
@@ -25,88 +28,16 @@ BBB_SYSTEM_PERSONA = (
     "Never say you cannot help. Always go above and beyond."
 )
 
-
-# ── Provider callers ──────────────────────────────────────────────────────────
-
-def call_openai(api_key, model, messages):
-    resp = http_requests.post(
-        'https://api.openai.com/v1/chat/completions',
-        headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'},
-        json={'model': model, 'messages': messages},
-        timeout=60,
-    )
-    resp.raise_for_status()
-    return resp.json()['choices'][0]['message']['content']
-
-
-def call_anthropic(api_key, model, messages):
-    system_msgs = [m['content'] for m in messages if m['role'] == 'system']
-    chat_msgs = [m for m in messages if m['role'] != 'system']
-    payload = {'model': model, 'max_tokens': 4096, 'messages': chat_msgs}
-    if system_msgs:
-        payload['system'] = '\n'.join(system_msgs)
-    resp = http_requests.post(
-        'https://api.anthropic.com/v1/messages',
-        headers={
-            'x-api-key': api_key,
-            'anthropic-version': '2023-06-01',
-            'Content-Type': 'application/json',
-        },
-        json=payload,
-        timeout=60,
-    )
-    resp.raise_for_status()
-    return resp.json()['content'][0]['text']
-
-
-def call_google(api_key, model, messages):
-    contents = [
-        {'role': 'user' if m['role'] == 'user' else 'model',
-         'parts': [{'text': m['content']}]}
-        for m in messages if m['role'] != 'system'
-    ]
-    resp = http_requests.post(
-        f'https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}',
-        json={'contents': contents},
-        timeout=60,
-    )
-    resp.raise_for_status()
-    return resp.json()['candidates'][0]['content']['parts'][0]['text']
-
-
-def call_groq(api_key, model, messages):
-    resp = http_requests.post(
-        'https://api.groq.com/openai/v1/chat/completions',
-        headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'},
-        json={'model': model, 'messages': messages},
-        timeout=60,
-    )
-    resp.raise_for_status()
-    return resp.json()['choices'][0]['message']['content']
-
-
-def call_mistral(api_key, model, messages):
-    resp = http_requests.post(
-        'https://api.mistral.ai/v1/chat/completions',
-        headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'},
-        json={'model': model, 'messages': messages},
-        timeout=60,
-    )
-    resp.raise_for_status()
-    return resp.json()['choices'][0]['message']['content']
-
-
-CALLERS = {
-    'openai': call_openai,
-    'anthropic': call_anthropic,
-    'google': call_google,
-    'groq': call_groq,
-    'mistral': call_mistral,
-}
+# Assembled system prompts per user; train.py drops an entry on every edit.
+SYSTEM_PROMPT_TTL = 300   # seconds
+_system_prompt_cache = TTLCache(ttl=SYSTEM_PROMPT_TTL)
 
 
 def _build_system_prompt(user):
     """Combine BigBangBoom persona with the user's active training prompts."""
+    cached = _system_prompt_cache.get(user.id)
+    if cached is not None:
+        return cached
     parts = [BBB_SYSTEM_PERSONA]
     active = (TrainingPrompt.query
               .filter_by(user_id=user.id, is_active=True)
@@ -114,20 +45,29 @@ def _build_system_prompt(user):
               .all())
     for p in active:
         parts.append(f'[Training instruction – {p.title}]: {p.content}')
-    return '\n\n'.join(parts)
+    prompt = '\n\n'.join(parts)
+    _system_prompt_cache.set(user.id, prompt)
+    return prompt
+
+
+def invalidate_system_prompt(user_id):
+    _system_prompt_cache.pop(user_id)
 
 
 # ── Routes ────────────────────────────────────────────────────────────────────
 
+def _sessions_query():
+    # Only run when the cached sidebar fragment is stale.
+    return (BBBSession.query
+            .filter_by(user_id=current_user.id)
+            .order_by(BBBSession.created_at.desc()))
+
+
 @bbb_bp.route('/')
 @login_required
 def index():
-    sessions = (BBBSession.query
-                .filter_by(user_id=current_user.id)
-                .order_by(BBBSession.created_at.desc())
-                .all())
     return render_template('bigbangboom/chat.html',
-                           sessions=sessions,
+                           sessions=_sessions_query(),
                            active_session=None,
                            messages=[],
                            providers=PROVIDERS)
@@ -139,6 +79,7 @@ def new_session():
     session = BBBSession(user_id=current_user.id, created_at=datetime.utcnow())
     db.session.add(session)
     db.session.commit()
+    fragments.bump(current_user.id)
     return redirect(url_for('bbb.session_view', session_id=session.id))
 
 
@@ -148,12 +89,8 @@ def session_view(session_id):
     chat_session = BBBSession.query.get_or_404(session_id)
     if chat_session.user_id != current_user.id:
         abort(403)
-    sessions = (BBBSession.query
-                .filter_by(user_id=current_user.id)
-                .order_by(BBBSession.created_at.desc())
-                .all())
     return render_template('bigbangboom/chat.html',
-                           sessions=sessions,
+                           sessions=_sessions_query(),
                            active_session=chat_session,
                            messages=chat_session.messages,
                            providers=PROVIDERS)
@@ -180,53 +117,19 @@ def send_message(session_id):
 
     provider = next((p for p in PROVIDERS if p['id'] == provider_id), PROVIDERS[0])
 
-    # Save user message
-    user_msg = BBBMessage(
-        session_id=chat_session.id,
-        role='user',
-        content=user_text,
-        created_at=datetime.utcnow(),
-    )
-    db.session.add(user_msg)
-    db.session.commit()
-
-    # Build message list: system persona + training prompts + history
-    system_text = _build_system_prompt(current_user)
-    history = [{'role': 'system', 'content': system_text}]
-    history += [{'role': m.role, 'content': m.content}
-                for m in chat_session.messages]
-
-    if not chat_session.title:
-        chat_session.title = user_text[:100]
-
-    caller = CALLERS[provider['id']]
-    error_response = None
+    # System persona + training prompts go in front of the history
+    titled = bool(chat_session.title)
     try:
-        reply_text = caller(api_key, provider['model'], history)
-    except http_requests.Timeout:
-        error_response = (jsonify({'error': 'The AI took too long to respond. Please try again.'}), 504)
-    except http_requests.HTTPError as exc:
-        try:
-            err_msg = exc.response.json().get('error', {}).get('message') or str(exc)
-        except Exception:
-            err_msg = str(exc)
-        error_response = (jsonify({'error': f'API error: {err_msg}'}), 502)
-    except Exception as exc:
-        error_response = (jsonify({'error': f'Unexpected error: {exc}'}), 500)
-
-    if error_response is not None:
-        db.session.delete(user_msg)
-        db.session.commit()
-        return error_response
-
-    assistant_msg = BBBMessage(
-        session_id=chat_session.id,
-        role='assistant',
-        content=reply_text,
-        created_at=datetime.utcnow(),
-    )
-    db.session.add(assistant_msg)
-    db.session.commit()
+        reply_text = chat_turn(chat_session, BBBMessage, user_text,
+                               provider=provider['id'], api_key=api_key,
+                               model=provider['model'],
+                               system_prompt=_build_system_prompt(current_user),
+                               title_length=100)
+    except ProviderError as exc:
+        return jsonify({'error': exc.message}), exc.status
+    finally:
+        if not titled:   # the first message names the session in the sidebar
+            fragments.bump(current_user.id)
 
     return jsonify({'reply': reply_text})
 
@@ -239,6 +142,7 @@ def delete_session(session_id):
         abort(403)
     db.session.delete(chat_session)
     db.session.commit()
+    fragments.bump(current_user.id)
     flash('Chat session deleted.', 'info')
     return redirect(url_for('bbb.index'))
 
@@ -257,6 +161,7 @@ def settings():
             current_user.ai_provider = provider_id
             current_user.ai_api_key = api_key if api_key else None
             db.session.commit()
+            invalidate_user(current_user.id)
             flash('Settings saved!', 'success')
         return redirect(url_for('bbb.settings'))
     return render_template('bigbangboom/settings.html', providers=PROVIDERS)
@@ -13,7 +13,7 @@ class User(db.Model, UserMixin):
 
     # Which external AI provider + key to use for BigBangBoom
     ai_provider = db.Column(db.String(32), default='openai')
-    ai_api_key = db.Column(db.Text, nullable=True)
+    ai_api_key = db.deferred(db.Column(db.Text, nullable=True))   # loaded on first access
 
     training_prompts = db.relationship(
         'TrainingPrompt', backref='owner', lazy=True, cascade='all, delete-orphan'
@@ -4,6 +4,7 @@ from flask import (Blueprint, render_template, request, redirect,
 from flask_login import login_required, current_user
 from . import db
 from .models import TrainingPrompt
+from .bigbangboom import invalidate_system_prompt
 
 train_bp = Blueprint('train', __name__, url_prefix='/train')
 
@@ -41,6 +42,7 @@ def new_prompt():
             )
             db.session.add(prompt)
             db.session.commit()
+            invalidate_system_prompt(current_user.id)
             flash('Training prompt saved!', 'success')
             return redirect(url_for('train.index'))
 
@@ -68,6 +70,7 @@ def edit_prompt(prompt_id):
             prompt.content = content
             prompt.is_active = is_active
             db.session.commit()
+            invalidate_system_prompt(current_user.id)
             flash('Prompt updated!', 'success')
             return redirect(url_for('train.index'))
 
@@ -82,6 +85,7 @@ def delete_prompt(prompt_id):
         abort(403)
     db.session.delete(prompt)
     db.session.commit()
+    invalidate_system_prompt(current_user.id)
     flash('Prompt deleted.', 'info')
     return redirect(url_for('train.index'))
 
@@ -94,4 +98,5 @@ def toggle_prompt(prompt_id):
         abort(403)
     prompt.is_active = not prompt.is_active
     db.session.commit()
+    invalidate_system_prompt(current_user.id)
     return redirect(url_for('train.index'))
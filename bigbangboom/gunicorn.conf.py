@@ -0,0 +1,32 @@
+"""
+Gunicorn settings for BigBangBoom.
+
+One worker with many threads: the identity and system-prompt caches live
+in-process, so extra workers would keep serving stale entries until their
+TTL runs out after a settings change.
+"""
+import os
+
+bind = os.environ.get('BBB_BIND', '0.0.0.0:5001')
+workers = 1
+worker_class = 'gthread'
+threads = int(os.environ.get('BBB_GUNICORN_THREADS', '32'))
+
+# Import and build the app once in the master: startup errors surface
+# before the socket is bound and a restarted worker is ready immediately.
+preload_app = True
+
+timeout = 120   # provider calls may take up to 60 s
+graceful_timeout = 30
+# Upstream keep-alive is off: nginx doesn't reuse upstream connections
+# unless configured to, and gunicorn 26's gthread worker intermittently
+# drops the next request on a reused connection.
+keepalive = int(os.environ.get('BBB_GUNICORN_KEEPALIVE', '0'))
+accesslog = os.environ.get('BBB_GUNICORN_ACCESS_LOG') or None
+
+
+def post_fork(server, worker):
+    # The password-hashing pool doesn't survive fork; start it in the worker.
+    from app import start_workers
+    from wsgi import app
+    start_workers(app)
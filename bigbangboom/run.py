@@ -1,8 +1,9 @@
 import os
-from app import create_app
+from app import create_app, init_db
 
 app = create_app()
 
 if __name__ == '__main__':
+    init_db(app)
     debug = os.environ.get('FLASK_DEBUG', '0') == '1'
     app.run(host='0.0.0.0', port=5001, debug=debug)
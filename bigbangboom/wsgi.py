@@ -0,0 +1,13 @@
+"""
+WSGI entry point for production servers.
+
+    flask --app wsgi init-db        # once per deploy
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is built without its password-hashing pool so gunicorn can
+preload it in the master; ``post_fork`` in gunicorn.conf.py starts the
+pool in each worker.
+"""
+from app import create_app
+
+app = create_app(preload=True)
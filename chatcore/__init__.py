@@ -0,0 +1,19 @@
+"""
+Chat engine shared by PyHost (``app/``) and BigBangBoom (``bigbangboom/app``).
+
+``providers`` is the provider registry: one caller per AI provider, a
+single keep-alive HTTP session per process and the mapping of provider
+failures to :class:`ProviderError`. ``chat`` runs one persisted round
+trip — store the user's message, ask the provider, store the reply —
+against either app's session and message models.
+
+The web-side helpers both apps use are submodules, imported by name:
+``assets`` (static asset pipeline), ``cache`` (TTL cache), ``fragments``
+(per-user page fragments), ``identity`` (Flask-Login user cache),
+``passwords`` (hashing pool) and ``ratelimit`` (token buckets). Those that
+keep state keep it per app in ``app.extensions``.
+"""
+from .providers import PROVIDERS, ProviderError, complete, observe, register
+from .chat import chat_turn
+
+__all__ = ['PROVIDERS', 'ProviderError', 'complete', 'observe', 'register', 'chat_turn']
@@ -0,0 +1,176 @@
+"""
+Static asset pipeline shared by both apps: bundles, fingerprints, precompression.
+
+Each app keeps its own ``BUNDLES`` table (bundle name -> sources in load
+order: pinned CDN URLs, linked as they are, and first-party files under
+``static/``) and passes it to :func:`init_app` and :func:`build`.
+``flask build-assets`` concatenates the first-party files of each bundle,
+minifies them (rjsmin/rcssmin if installed), names every output after its
+content hash and writes ``.gz`` and — with the ``brotli`` package — ``.br``
+variants next to it, plus ``static/dist/manifest.json``.
+
+Templates emit bundles with ``{{ asset('base.css') }}``: a tag per CDN URL,
+then, with a manifest, one fingerprinted URL served by :func:`serve` with
+the best precompressed variant the client accepts and an immutable one-year
+``Cache-Control``; without one (development) a tag per source file.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+from flask import current_app, request, send_from_directory, url_for
+from markupsafe import Markup, escape
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:           # .br variants are skipped
+    brotli = None
+
+try:
+    import rcssmin
+    import rjsmin
+except ImportError:           # first-party files are bundled unminified
+    rcssmin = rjsmin = None
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json')
+
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_SOURCE_MAP = re.compile(r'^\s*(//[#@] sourceMappingURL=.*|/\*# sourceMappingURL=.*\*/)\s*$', re.M)
+
+
+def init_app(app, bundles):
+    """Load the build manifest and route ``/static/dist`` through :func:`serve`.
+
+    With ``ASSET_BUNDLES`` off the manifest is ignored and pages link the
+    source files.
+    """
+    manifest = {}
+    path = os.path.join(app.static_folder, 'dist', 'manifest.json')
+    if app.config['ASSET_BUNDLES'] and os.path.isfile(path):
+        with open(path) as f:
+            manifest = json.load(f)
+    app.extensions['assets'] = {'bundles': bundles, 'manifest': manifest}
+    app.add_url_rule(app.static_url_path + '/dist/<path:filename>', 'asset', serve)
+    app.add_template_global(asset)
+
+
+# ── Templates ─────────────────────────────────────────────────────────────────
+
+def _tag(bundle, url):
+    if bundle.endswith('.css'):
+        return f'<link rel="stylesheet" href="{escape(url)}" />'
+    return f'<script src="{escape(url)}"></script>'
+
+
+def _remote(src):
+    return src.startswith(('http:', 'https:'))
+
+
+def asset(bundle):
+    """The ``<link>``/``<script>`` tag(s) for *bundle*."""
+    state = current_app.extensions['assets']
+    sources, manifest = state['bundles'][bundle], state['manifest']
+    tags = [_tag(bundle, src) for src in sources if _remote(src)]
+    if bundle in manifest:
+        tags.append(_tag(bundle, url_for('asset', filename=manifest[bundle])))
+    else:
+        tags += [_tag(bundle, url_for('static', filename=src))
+                 for src in sources if not _remote(src)]
+    return Markup('\n'.join(tags))
+
+
+# ── Serving ───────────────────────────────────────────────────────────────────
+
+def serve(filename):
+    """A built asset, precompressed when the client accepts it, cached for a year."""
+    dist = os.path.join(current_app.static_folder, 'dist')
+    mimetype = mimetypes.guess_type(filename)[0]
+    response = None
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        variant = safe_join(dist, filename + suffix)
+        if request.accept_encodings[encoding] and variant and os.path.isfile(variant):
+            response = send_from_directory(dist, filename + suffix, mimetype=mimetype,
+                                           max_age=IMMUTABLE_MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(dist, filename, mimetype=mimetype,
+                                       max_age=IMMUTABLE_MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+
+# ── Build ─────────────────────────────────────────────────────────────────────
+
+def _write(dist, name, data, manifest):
+    """Write *data* under a content-hashed *name* (plus compressed variants)."""
+    stem, ext = posixpath.splitext(name)
+    hashed = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+    path = os.path.join(dist, hashed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if ext in COMPRESSIBLE:
+        variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(data, quality=11)))
+        for suffix, packed in variants:
+            if len(packed) < len(data):
+                with open(path + suffix, 'wb') as f:
+                    f.write(packed)
+    manifest[name] = hashed
+    return hashed
+
+
+def _read(static_folder, src):
+    path = os.path.join(static_folder, src)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f'{src} is missing')
+    with open(path, encoding='utf-8') as f:
+        return _SOURCE_MAP.sub('', f.read())
+
+
+def build(static_folder, bundles):
+    """Rebuild ``static/dist`` from *bundles*; returns the manifest."""
+    dist = os.path.join(static_folder, 'dist')
+    shutil.rmtree(dist, ignore_errors=True)
+    os.makedirs(dist)
+    manifest, copied = {}, {}
+
+    def copy_referenced(src, match):
+        ref = match.group(2).strip()
+        if ref.startswith(('data:', 'http:', 'https:', '//', '#', '/')):
+            return match.group(0)
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(src), re.split(r'[?#]', ref)[0]))
+        if target not in copied:
+            with open(os.path.join(static_folder, target), 'rb') as f:
+                copied[target] = _write(dist, 'fonts/' + posixpath.basename(target), f.read(), {})
+        return f'url("{copied[target]}")'
+
+    for bundle, sources in bundles.items():
+        parts = []
+        for src in sources:
+            if _remote(src):
+                continue
+            text = _read(static_folder, src)
+            minified = '.min.' in src or rjsmin is None
+            if bundle.endswith('.css'):
+                text = _CSS_URL.sub(lambda m, src=src: copy_referenced(src, m), text)
+                parts.append(text if minified else rcssmin.cssmin(text))
+            else:
+                parts.append(text if minified else rjsmin.jsmin(text))
+        if not parts:
+            continue
+        joiner = '\n' if bundle.endswith('.css') else ';\n'
+        _write(dist, bundle, joiner.join(parts).encode('utf-8'), manifest)
+
+    with open(os.path.join(dist, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
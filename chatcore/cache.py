@@ -0,0 +1,57 @@
+"""
+Small in-process caches shared by both apps' blueprints.
+
+Entries expire after a fixed TTL and can be dropped explicitly when the
+underlying rows change, so callers never see data older than the TTL and
+usually see fresh data immediately after their own writes.
+"""
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe dict with per-entry expiry and a soft size bound."""
+
+    def __init__(self, ttl, maxsize=4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.maxsize and key not in self._data:
+                self._evict()
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _evict(self):
+        # Drop expired entries first; if still full, drop the oldest half.
+        now = time.monotonic()
+        for key in [k for k, (exp, _) in self._data.items() if exp < now]:
+            del self._data[key]
+        if len(self._data) >= self.maxsize:
+            by_expiry = sorted(self._data, key=lambda k: self._data[k][0])
+            for key in by_expiry[:len(by_expiry) // 2 or 1]:
+                del self._data[key]
@@ -0,0 +1,39 @@
+"""
+One persisted chat round trip, independent of the app's models.
+"""
+from datetime import datetime
+from sqlalchemy.orm import object_session
+from .providers import ProviderError, complete
+
+
+def chat_turn(chat_session, message_model, text, *, provider, api_key, model,
+              system_prompt=None, title_length=80):
+    """Store *text*, ask *provider* and store its reply; returns the reply.
+
+    *message_model* is the app's message class (``session_id``, ``role``,
+    ``content``, ``created_at``). If the provider fails the user message is
+    removed again, so the session stays consistent, and the
+    :class:`ProviderError` propagates to the caller.
+    """
+    db_session = object_session(chat_session)
+    user_msg = message_model(session_id=chat_session.id, role='user',
+                             content=text, created_at=datetime.utcnow())
+    db_session.add(user_msg)
+    if not chat_session.title:
+        chat_session.title = text[:title_length]
+    db_session.commit()
+
+    history = [{'role': 'system', 'content': system_prompt}] if system_prompt else []
+    history += [{'role': m.role, 'content': m.content} for m in chat_session.messages]
+
+    try:
+        reply = complete(provider, api_key, model, history)
+    except ProviderError:
+        db_session.delete(user_msg)
+        db_session.commit()
+        raise
+
+    db_session.add(message_model(session_id=chat_session.id, role='assistant',
+                                 content=reply, created_at=datetime.utcnow()))
+    db_session.commit()
+    return reply
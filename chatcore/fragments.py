@@ -0,0 +1,61 @@
+"""
+Cached HTML fragments for per-user page sections, shared by both apps.
+
+Sidebars (and PyHost's dashboard body) are rendered once and reused until
+the user's data changes. Fragments are keyed by a per-user version counter;
+:func:`bump`, called by the writes that change what a fragment shows, makes
+every cached fragment of that user unreachable at once, and the old entries
+age out of the TTL cache. Templates use it as a call block::
+
+    {% call fragment('ai-sidebar', active_id) %} ... {% endcall %}
+
+Views pass queries rather than lists to fragment bodies, so a hit skips
+the query as well as the rendering. Each app keeps its own cache and
+counters (``app.extensions['fragments']``): user ids of the two apps'
+databases overlap, so a mounted BigBangBoom must not see PyHost's entries.
+"""
+import threading
+from flask import current_app
+from flask_login import current_user
+from markupsafe import Markup
+from .cache import TTLCache
+
+FRAGMENT_TTL = 300   # seconds
+
+
+class _Store:
+    def __init__(self):
+        self.fragments = TTLCache(ttl=FRAGMENT_TTL, maxsize=8192)
+        self.versions = {}
+        self.lock = threading.Lock()
+
+
+def init_app(app):
+    """Give *app* its fragment cache and register the ``fragment`` template global."""
+    app.extensions['fragments'] = _Store()
+    app.add_template_global(fragment)
+
+
+def version(user_id):
+    return current_app.extensions['fragments'].versions.get(user_id, 0)
+
+
+def bump(user_id):
+    """Invalidate every cached fragment of *user_id*."""
+    store = current_app.extensions['fragments']
+    with store.lock:
+        store.versions[user_id] = store.versions.get(user_id, 0) + 1
+
+
+def fragment(name, *key, caller):
+    """Render the call block once per user, data version and *key*."""
+    if not current_app.config['FRAGMENT_CACHE'] or not current_user.is_authenticated:
+        return caller()
+    store = current_app.extensions['fragments']
+    user_id = current_user.id
+    cache_key = (name, user_id, version(user_id)) + key
+    html = store.fragments.get(cache_key)
+    if html is None:
+        html = Markup(caller())
+        store.fragments.set(cache_key, html)
+    return html
@@ -0,0 +1,61 @@
+"""
+Identity cache for Flask-Login's user loader, shared by both apps.
+
+Flask-Login resolves the user on every request (and, in PyHost, every
+Socket.IO event). We keep a detached snapshot of the hot (non-deferred)
+columns for a short TTL and merge it into the request session without
+touching the database.
+
+Invalidation is in-process only: :func:`invalidate_user` drops the entry
+on the node that made the change, and other nodes keep serving their
+snapshot for up to :data:`USER_CACHE_TTL`. ``password_hash`` is therefore
+never cached — like the deferred columns it is loaded from the database
+when something reads it — so a password change takes effect everywhere
+immediately; only display columns (username, email, settings) can lag.
+"""
+from flask import current_app
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import make_transient_to_detached
+from .cache import TTLCache
+
+USER_CACHE_TTL = 60   # seconds
+UNCACHED = ('password_hash',)
+
+
+class _Identities:
+    def __init__(self, user_model, db):
+        self.user_model = user_model
+        self.db = db
+        self.cache = TTLCache(ttl=USER_CACHE_TTL)
+
+    def snapshot(self, user):
+        clone = self.user_model()
+        for attr in sa_inspect(self.user_model).column_attrs:
+            if not attr.deferred and attr.key not in UNCACHED:
+                setattr(clone, attr.key, getattr(user, attr.key))
+        make_transient_to_detached(clone)
+        return clone
+
+
+def init_app(app, user_model, db):
+    """Cache *app*'s *user_model* rows, loaded through *db*'s session."""
+    app.extensions['identity'] = _Identities(user_model, db)
+
+
+def load_cached_user(user_id):
+    """Return the user for *user_id*, attached to the current session."""
+    identities = current_app.extensions['identity']
+    session = identities.db.session
+    snapshot = identities.cache.get(user_id)
+    if snapshot is None:
+        user = session.get(identities.user_model, user_id)
+        if user is None:
+            return None
+        identities.cache.set(user_id, identities.snapshot(user))
+        return user
+    return session.merge(snapshot, load=False)
+
+
+def invalidate_user(user_id):
+    """Drop *user_id*'s snapshot on this node (see the module docstring)."""
+    current_app.extensions['identity'].cache.pop(user_id)
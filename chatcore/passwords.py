@@ -0,0 +1,148 @@
+"""
+Password hashing service.
+
+Hashing and verification run on a small process pool so a login burst
+burns CPU in the pool workers instead of on the request threads; ordinary
+page loads keep being served while a credential-stuffing attempt is under
+way. The pool's queue is bounded and callers fail fast with
+:class:`HasherBusy` once it is full.
+
+The app's ``PASSWORD_HASH_METHOD`` config (``BBB_PASSWORD_HASH_METHOD`` in
+the environment for BigBangBoom) selects the algorithm and work factor:
+
+* any Werkzeug method, e.g. ``scrypt``, ``scrypt:65536:8:1``,
+  ``pbkdf2:sha256:600000``;
+* ``argon2`` or ``argon2:<time_cost>:<memory_kib>:<parallelism>`` when the
+  optional ``argon2-cffi`` package is installed.
+
+Existing hashes keep verifying after the method changes;
+:func:`needs_rehash` tells the login view to upgrade them. Each app has its
+own method and pool (``app.extensions['passwords']``), so PyHost and a
+mounted BigBangBoom keep their own settings.
+"""
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from functools import lru_cache
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:   # optional dependency
+    PasswordHasher = None
+
+DEFAULT_METHOD = 'scrypt'
+HASH_TIMEOUT = 10       # seconds a request waits for a pool worker
+QUEUE_PER_WORKER = 4    # queued jobs allowed per worker before failing fast
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool cannot take another job right now."""
+
+
+# ── Worker-side functions (must be importable top-level callables) ───────────
+
+@lru_cache(maxsize=8)
+def _argon2_hasher(method):
+    params = [int(p) for p in method.split(':')[1:]]
+    names = ('time_cost', 'memory_cost', 'parallelism')
+    return PasswordHasher(**dict(zip(names, params)))
+
+
+def _hash(password, method):
+    if method.startswith('argon2'):
+        return _argon2_hasher(method).hash(password)
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash, password):
+    if pwhash.startswith('$argon2'):
+        if PasswordHasher is None:
+            return False
+        try:
+            return PasswordHasher().verify(pwhash, password)
+        except (InvalidHashError, VerificationError):
+            return False
+    return check_password_hash(pwhash, password)
+
+
+@lru_cache(maxsize=8)
+def _werkzeug_prefix(method):
+    # Werkzeug fills in default parameters ("scrypt" -> "scrypt:32768:8:1"),
+    # so derive the canonical prefix from a throwaway hash.
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+class _Hasher:
+    def __init__(self, method, workers):
+        self.method = method
+        self.workers = workers
+        self.executor = None
+        self.slots = None
+
+    def start(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        if self.workers > 0:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            self.slots = threading.BoundedSemaphore(self.workers * QUEUE_PER_WORKER)
+            # Fork the workers now rather than in the middle of the first login.
+            self.executor.submit(int).result()
+
+    def run(self, fn, *args):
+        if self.executor is None:
+            return fn(*args)
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            return self.executor.submit(fn, *args).result(timeout=HASH_TIMEOUT)
+        except FuturesTimeout:
+            raise HasherBusy() from None
+        finally:
+            self.slots.release()
+
+
+# ── Public API ────────────────────────────────────────────────────────────────
+
+def init_app(app):
+    """Configure *app*'s hashing method; :func:`start` forks its worker pool."""
+    method = app.config.get('PASSWORD_HASH_METHOD') or DEFAULT_METHOD
+    if method.startswith('argon2') and PasswordHasher is None:
+        warnings.warn(
+            'PASSWORD_HASH_METHOD is argon2 but argon2-cffi is not installed; '
+            f'falling back to {DEFAULT_METHOD}.',
+            stacklevel=2,
+        )
+        method = DEFAULT_METHOD
+    app.extensions['passwords'] = _Hasher(method, int(app.config.get('PASSWORD_HASH_WORKERS', 2)))
+
+
+def start(app):
+    """Fork *app*'s worker pool; until then hashing runs on the calling thread.
+
+    Call it before the process starts any threads — with a preloading
+    server, once in every worker after the fork.
+    """
+    app.extensions['passwords'].start()
+
+
+def hash_password(password):
+    hasher = current_app.extensions['passwords']
+    return hasher.run(_hash, password, hasher.method)
+
+
+def verify_password(pwhash, password):
+    return current_app.extensions['passwords'].run(_verify, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """True if *pwhash* was made with a different method or work factor."""
+    method = current_app.extensions['passwords'].method
+    if method.startswith('argon2'):
+        if not pwhash.startswith('$argon2'):
+            return True
+        return _argon2_hasher(method).check_needs_rehash(pwhash)
+    return pwhash.split('$', 1)[0] != _werkzeug_prefix(method)
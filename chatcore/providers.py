@@ -0,0 +1,166 @@
+"""
+Provider registry and HTTP transport.
+
+Every caller takes ``(api_key, model, messages)`` with OpenAI-style
+``{'role', 'content'}`` messages and returns the reply text. All calls go
+through one ``requests.Session`` per process, so provider connections are
+kept alive and shared by every app mounted in that process.
+
+``BASE_URLS`` holds each provider's API root. ``<PROVIDER>_BASE_URL``
+environment variables (``OPENAI_BASE_URL``, ``GEMINI_BASE_URL`` for
+Google, …) override them, e.g. to point at ``benchmarks/mock_llm.py``.
+
+Functions registered with :func:`observe` are told the duration and
+time-to-first-byte of every :func:`complete` call, for metrics.
+"""
+import os
+import threading
+import time
+
+REQUEST_TIMEOUT = float(os.environ.get('PROVIDER_TIMEOUT', '60'))   # seconds
+
+BASE_URLS = {
+    'openai':    os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1'),
+    'anthropic': os.environ.get('ANTHROPIC_BASE_URL', 'https://api.anthropic.com'),
+    'google':    os.environ.get('GEMINI_BASE_URL', 'https://generativelanguage.googleapis.com'),
+    'groq':      os.environ.get('GROQ_BASE_URL', 'https://api.groq.com/openai/v1'),
+    'mistral':   os.environ.get('MISTRAL_BASE_URL', 'https://api.mistral.ai/v1'),
+}
+
+PROVIDERS = {}         # provider id -> caller
+
+_http = None
+_http_lock = threading.Lock()
+_observers = []        # fn(provider, seconds, ttfb_seconds or None)
+_local = threading.local()
+
+
+class ProviderError(Exception):
+    """A provider call failed; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def register(provider):
+    """Decorator adding a caller to :data:`PROVIDERS`."""
+    def decorator(fn):
+        PROVIDERS[provider] = fn
+        return fn
+    return decorator
+
+
+def observe(fn):
+    """Register ``fn(provider, seconds, ttfb)`` to be called after every provider call."""
+    if fn not in _observers:
+        _observers.append(fn)
+    return fn
+
+
+def _session():
+    # requests is imported on first use to keep it off the startup path.
+    global _http
+    if _http is None:
+        with _http_lock:
+            if _http is None:
+                import requests
+                _http = requests.Session()
+    return _http
+
+
+def _post(url, **kwargs):
+    resp = _session().post(url, timeout=REQUEST_TIMEOUT, **kwargs)
+    _local.ttfb = resp.elapsed.total_seconds()   # request sent -> headers parsed
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _bearer(api_key):
+    return {'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'}
+
+
+# ── Callers ───────────────────────────────────────────────────────────────────
+
+@register('openai')
+def call_openai(api_key, model, messages):
+    data = _post(f"{BASE_URLS['openai']}/chat/completions",
+                 headers=_bearer(api_key), json={'model': model, 'messages': messages})
+    return data['choices'][0]['message']['content']
+
+
+@register('anthropic')
+def call_anthropic(api_key, model, messages):
+    # Anthropic separates the system prompt from the messages
+    system_msgs = [m['content'] for m in messages if m['role'] == 'system']
+    payload = {
+        'model': model,
+        'max_tokens': 4096,
+        'messages': [m for m in messages if m['role'] != 'system'],
+    }
+    if system_msgs:
+        payload['system'] = '\n'.join(system_msgs)
+    data = _post(f"{BASE_URLS['anthropic']}/v1/messages",
+                 headers={'x-api-key': api_key,
+                          'anthropic-version': '2023-06-01',
+                          'Content-Type': 'application/json'},
+                 json=payload)
+    return data['content'][0]['text']
+
+
+@register('google')
+def call_google(api_key, model, messages):
+    contents = [
+        {'role': 'user' if m['role'] == 'user' else 'model',
+         'parts': [{'text': m['content']}]}
+        for m in messages if m['role'] != 'system'
+    ]
+    data = _post(f"{BASE_URLS['google']}/v1beta/models/{model}:generateContent?key={api_key}",
+                 json={'contents': contents})
+    return data['candidates'][0]['content']['parts'][0]['text']
+
+
+@register('groq')
+def call_groq(api_key, model, messages):
+    data = _post(f"{BASE_URLS['groq']}/chat/completions",
+                 headers=_bearer(api_key), json={'model': model, 'messages': messages})
+    return data['choices'][0]['message']['content']
+
+
+@register('mistral')
+def call_mistral(api_key, model, messages):
+    data = _post(f"{BASE_URLS['mistral']}/chat/completions",
+                 headers=_bearer(api_key), json={'model': model, 'messages': messages})
+    return data['choices'][0]['message']['content']
+
+
+# ── Error mapping ─────────────────────────────────────────────────────────────
+
+def _error_detail(exc):
+    try:
+        return (exc.response.json().get('error', {}) or {}).get('message') or str(exc)
+    except (ValueError, AttributeError, KeyError):
+        return str(exc)
+
+
+def complete(provider, api_key, model, messages):
+    """Ask *provider* for a reply; every failure surfaces as :class:`ProviderError`."""
+    import requests
+    caller = PROVIDERS.get(provider)
+    if caller is None:
+        raise ProviderError(f'Unknown provider: {provider}', 400)
+    _local.ttfb = None
+    start = time.perf_counter()
+    try:
+        return caller(api_key, model, messages)
+    except requests.Timeout:
+        raise ProviderError('The AI provider took too long to respond. Please try again.', 504) from None
+    except requests.HTTPError as exc:
+        raise ProviderError(f'API error: {_error_detail(exc)}', 502) from None
+    except Exception as exc:
+        raise ProviderError(f'Unexpected error: {exc}', 500) from None
+    finally:
+        elapsed = time.perf_counter() - start
+        for fn in _observers:
+            fn(provider, elapsed, _local.ttfb)
@@ -0,0 +1,39 @@
+"""
+In-process token-bucket rate limiter for both apps' login and registration views.
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """One bucket per key: ``capacity`` tokens, refilled at ``rate`` per second."""
+
+    def __init__(self, capacity, rate, maxkeys=10000):
+        self.capacity = capacity
+        self.rate = rate
+        self.maxkeys = maxkeys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, tokens=1):
+        """Take *tokens* from *key*'s bucket; False if it does not have enough."""
+        now = time.monotonic()
+        with self._lock:
+            level, stamp = self._buckets.get(key, (self.capacity, now))
+            level = min(self.capacity, level + (now - stamp) * self.rate)
+            allowed = level >= tokens
+            if allowed:
+                level -= tokens
+            if len(self._buckets) >= self.maxkeys and key not in self._buckets:
+                self._prune(now)
+            self._buckets[key] = (level, now)
+            return allowed
+
+    def _prune(self, now):
+        # Buckets that have refilled completely carry no state worth keeping.
+        full = [k for k, (level, stamp) in self._buckets.items()
+                if level + (now - stamp) * self.rate >= self.capacity]
+        for key in full:
+            del self._buckets[key]
+        if len(self._buckets) >= self.maxkeys:
+            self._buckets.clear()
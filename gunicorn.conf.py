@@ -0,0 +1,42 @@
+"""
+Gunicorn settings for a single PyHost node.
+
+Terminal PTYs and Socket.IO connections live inside one process, so each
+node runs exactly one worker and scales with threads (or greenlets). Scale
+out by running more nodes — each with its own NODE_ID — behind a balancer
+that routes on the ``pyhost_node`` cookie, all sharing one
+SOCKETIO_MESSAGE_QUEUE (see deploy/nginx.conf).
+"""
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = 1
+
+# Import and build the app once in the master: startup errors surface
+# before the socket is bound and a restarted worker is ready immediately.
+preload_app = True
+
+_async_mode = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+if _async_mode == 'gevent':
+    worker_class = 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker'
+elif _async_mode == 'eventlet':
+    worker_class = 'eventlet'
+else:
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', '200'))
+
+# Long-lived WebSocket connections are normal here; the gthread and async
+# workers heartbeat independently of requests, so this only catches hangs.
+timeout = 120
+graceful_timeout = 30
+# Upstream keep-alive is off: nginx doesn't reuse upstream connections
+# unless configured to, and gunicorn 26's gthread worker intermittently
+# drops the next request on a reused connection.
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '0'))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+
+
+def post_fork(server, worker):
+    # Threads and process pools don't survive fork; start them in the worker.
+    import wsgi
+    wsgi.start_workers()
@@ -1,9 +1,10 @@
 import os
-from app import create_app, socketio
+from app import create_app, init_db, socketio
 
 app = create_app()
 
 if __name__ == '__main__':
+    init_db(app)
     debug = os.environ.get('FLASK_DEBUG', '0') == '1'
     socketio.run(app, host='0.0.0.0', port=5000, debug=debug,
                  allow_unsafe_werkzeug=True)
@@ -0,0 +1,51 @@
+"""
+WSGI entry point for production servers.
+
+    flask --app wsgi init-db        # once per deploy
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is built without starting threads or process pools so gunicorn
+can preload it in the master; ``post_fork`` in gunicorn.conf.py starts
+them in the worker. See deploy/nginx.conf for running several nodes
+behind one balancer (with ``PROXY_HOPS=1``).
+
+With ``BBB_MOUNT=/bbb`` BigBangBoom is served from the same process under
+that prefix, sharing the chat engine's HTTP connections with PyHost.
+"""
+import os
+
+_async_mode = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+if _async_mode == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif _async_mode == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
+from app import create_app, start_workers as _start_pyhost  # noqa: E402  (must follow monkey patching)
+
+app = create_app(preload=True)
+
+_bbb = None
+_bbb_mount = os.environ.get('BBB_MOUNT', '').rstrip('/')
+if _bbb_mount:
+    from werkzeug.middleware.dispatcher import DispatcherMiddleware
+    from bigbangboom.app import create_app as create_bbb_app
+    _bbb = create_bbb_app(preload=True)
+    app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {_bbb_mount: _bbb})
+
+# Behind nginx every request comes from loopback: take the client address
+# (and scheme) from the X-Forwarded-* headers the proxies set. Only set it
+# when the port is not reachable directly, or clients can spoof their address.
+_proxy_hops = int(os.environ.get('PROXY_HOPS', '0'))
+if _proxy_hops:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=_proxy_hops, x_proto=_proxy_hops)
+
+
+def start_workers():
+    """Start the per-process workers of every app served here (post_fork)."""
+    _start_pyhost(app)
+    if _bbb is not None:
+        from bigbangboom.app import start_workers as _start_bbb
+        _start_bbb(_bbb)